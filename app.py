@@ -1,11 +1,13 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 import datetime
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import os
+import sys
 import json
 import requests
 import logging
+import logging.handlers
 import time
 import re
 from datetime import datetime, timedelta
@@ -13,11 +15,427 @@ from flask_cors import CORS
 import csv
 import io
 import traceback
+import functools
+import itertools
+import bisect
+import heapq
+import gzip
+import glob
+import hashlib
+import hmac
+import zlib
+import math
+import unicodedata
+import contextvars
+from contextlib import contextmanager
+import threading
+import random
+from collections import deque, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import atexit
+import sqlite3
+import queue
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# ==============================
+# LOGGING PIPELINE
+# ==============================
+# Records are handed to a queue on the request thread and formatted/written
+# by a background listener, so log I/O stays off the webhook latency path.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()  # "json" or "text"
+# Per-category sampling/rate limits for high-volume debug events,
+# e.g. LOG_SAMPLE_RATES="phone=0.01,chat=0.1" LOG_RATE_LIMITS="outbound=20"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "phone=0.05,chat=0.2")
+LOG_RATE_LIMITS = os.environ.get("LOG_RATE_LIMITS", "phone=5,chat=20,outbound=20,webhook=50")
+# Operational INFO lines are always kept unless sampling them is asked for
+LOG_SAMPLE_INFO = os.environ.get("LOG_SAMPLE_INFO", "false").lower() in ("1", "true", "yes")
+
+def _parse_category_settings(raw, cast):
+    """Parse "category=value,..." settings from the environment"""
+    settings = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        category, value = item.split("=", 1)
+        try:
+            settings[category.strip()] = cast(value)
+        except ValueError:
+            pass
+    return settings
+
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Span of the trace the current request/thread is in (see TRACING)
+_active_span = contextvars.ContextVar("active_span", default=None)
+
+class TraceContextFilter(logging.Filter):
+    """Stamp records with the active trace/span id; errors mark the span failed"""
+
+    def filter(self, record):
+        span = _active_span.get()
+        if span is not None:
+            record.trace_id = span.trace.trace_id
+            record.span_id = span.span_id
+            if record.levelno >= logging.ERROR:
+                # The message template only: arguments often carry phone numbers or names
+                span.fail(record.msg)
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """Render a log record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _LOG_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class CategorySampler(logging.Filter):
+    """Sample and rate-limit categorised debug records (and info, if max_level allows)"""
+
+    def __init__(self, sample_rates, rate_limits, max_level=logging.DEBUG):
+        super().__init__()
+        self.max_level = max_level
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.windows = {}
+        self.dropped = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        category = getattr(record, "category", None)
+        if category is None or record.levelno > self.max_level:
+            return True
+        rate = self.sample_rates.get(category)
+        if rate is not None and random.random() >= rate:
+            self._drop(category)
+            return False
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            second = int(record.created)
+            with self.lock:
+                window_second, count = self.windows.get(category, (second, 0))
+                if window_second != second:
+                    window_second, count = second, 0
+                if count >= limit:
+                    self.dropped[category] = self.dropped.get(category, 0) + 1
+                    return False
+                self.windows[category] = (window_second, count + 1)
+        return True
+
+    def _drop(self, category):
+        with self.lock:
+            self.dropped[category] = self.dropped.get(category, 0) + 1
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread"""
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.target_handlers = handlers
+        self.listener = None
+        self.pid = None
+        self._ensure_listener()
+
+    def _ensure_listener(self):
+        # The listener thread does not survive a fork, so start one per process
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.target_handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def prepare(self, record):
+        # The stock prepare() formats on the calling thread; only resolve
+        # what cannot be deferred (exception text) and pass the record on.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        if self.listener and self.pid == os.getpid():
+            self.listener.stop()
+
+def configure_logging():
+    """Set up the root logger according to the LOG_* environment variables"""
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    sampler = CategorySampler(
+        _parse_category_settings(LOG_SAMPLE_RATES, float),
+        _parse_category_settings(LOG_RATE_LIMITS, int),
+        logging.INFO if LOG_SAMPLE_INFO else logging.DEBUG
+    )
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if LOG_ASYNC:
+        handler = LazyQueueHandler(queue.SimpleQueue(), [stream_handler])
+        atexit.register(handler.stop)
+    else:
+        handler = stream_handler
+    handler.addFilter(TraceContextFilter())
+    handler.addFilter(sampler)
+    root.addHandler(handler)
+    return sampler
+
+log_sampler = configure_logging()
 logger = logging.getLogger(__name__)
 
+# ==============================
+# TRACING
+# ==============================
+# One trace per inbound webhook event with child spans for booking steps,
+# Sheets calls and WhatsApp sends. Finished traces are tail-sampled (slow or
+# failed ones are always kept) and written as OTLP/JSON lines, one
+# ExportTraceServiceRequest per trace, to a rotating local file that an
+# OpenTelemetry collector's file receiver or otlpjsonfile can pick up.
+# Phone numbers are never written as-is: senders are keyed hashes and digit
+# runs in failure messages are masked.
+TRACE_FILE = os.environ.get("TRACE_FILE", "")  # empty disables tracing
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() in ("1", "true", "yes") and bool(TRACE_FILE)
+# Keep this fixed across workers/restarts so one customer hashes the same everywhere
+TRACE_HASH_KEY = (os.environ.get("TRACE_HASH_KEY", "") or os.urandom(16).hex()).encode()
+TRACE_FILE_MAX_MB = float(os.environ.get("TRACE_FILE_MAX_MB", 20))
+TRACE_FILE_BACKUPS = int(os.environ.get("TRACE_FILE_BACKUPS", 5))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 2000))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))  # share of fast, successful traces kept
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", 256))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "sindbad-whatsapp-api")
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+SPAN_STATUS_OK, SPAN_STATUS_ERROR = 1, 2
+TRACE_MASKED_DIGITS = re.compile(r"\+?\d[\d \-]{5,}\d")
+
+def trace_subject(phone_number):
+    """Keyed hash standing in for a phone number in span attributes"""
+    return hmac.new(TRACE_HASH_KEY, str(phone_number).encode(), hashlib.sha256).hexdigest()[:16]
+
+class Trace:
+    """Spans of one trace, collected until the root span ends"""
+    __slots__ = ("trace_id", "spans", "failed", "dropped_spans")
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.spans = []
+        self.failed = False
+        self.dropped_spans = 0
+
+class Span:
+    """One timed operation within a trace"""
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status_code", "status_message")
+
+    def __init__(self, trace, name, parent_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status_code = 0
+        self.status_message = None
+
+    def fail(self, message):
+        if self.status_code != SPAN_STATUS_ERROR:
+            self.status_code = SPAN_STATUS_ERROR
+            self.status_message = TRACE_MASKED_DIGITS.sub("<digits>", str(message))[:300]
+        self.trace.failed = True
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status_code}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class TraceExport:
+    """A finished trace, serialized to OTLP/JSON only when the writer formats it"""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __str__(self):
+        return json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [
+                _otlp_attribute("service.name", TRACE_SERVICE_NAME),
+                _otlp_attribute("process.pid", os.getpid())
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [span.to_otlp() for span in self.trace.spans]
+            }]
+        }]}, ensure_ascii=False, separators=(",", ":"))
+
+class TraceSampler:
+    """Tail-based sampling of finished traces and the trace file writer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writer = None
+        self.stats = {"finished": 0, "kept_failed": 0, "kept_slow": 0, "kept_sampled": 0, "dropped": 0}
+
+    def _trace_logger(self):
+        if self.writer is None:
+            file_handler = logging.handlers.RotatingFileHandler(
+                TRACE_FILE, maxBytes=int(TRACE_FILE_MAX_MB * 1024 * 1024), backupCount=TRACE_FILE_BACKUPS,
+                encoding="utf-8"
+            )
+            file_handler.setFormatter(logging.Formatter("%(message)s"))
+            writer = logging.getLogger(f"{__name__}.traces")
+            writer.propagate = False
+            writer.setLevel(logging.INFO)
+            if LOG_ASYNC:
+                handler = LazyQueueHandler(queue.SimpleQueue(), [file_handler])
+                atexit.register(handler.stop)
+            else:
+                handler = file_handler
+            writer.addHandler(handler)
+            self.writer = writer
+        return self.writer
+
+    def finish(self, trace, root):
+        duration_ms = (root.end_ns - root.start_ns) / 1e6
+        if trace.failed:
+            reason = "kept_failed"
+        elif duration_ms >= TRACE_SLOW_MS:
+            reason = "kept_slow"
+        elif random.random() < TRACE_SAMPLE_RATE:
+            reason = "kept_sampled"
+        else:
+            reason = "dropped"
+        with self.lock:
+            self.stats["finished"] += 1
+            self.stats[reason] += 1
+            writer = self._trace_logger() if reason != "dropped" else None
+        if writer:
+            root.attributes["sampling.reason"] = reason
+            writer.info("%s", TraceExport(trace))
+
+    def status(self):
+        with self.lock:
+            return dict(
+                self.stats, enabled=TRACING_ENABLED, file=TRACE_FILE,
+                slow_ms=TRACE_SLOW_MS, sample_rate=TRACE_SAMPLE_RATE
+            )
+
+trace_sampler = TraceSampler()
+
+@contextmanager
+def start_trace(name, kind=SPAN_KIND_SERVER, attributes=None, traceparent=None):
+    """Open a new trace (or continue a W3C traceparent) with a root span"""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent_id = None
+    if traceparent:
+        _, trace_id, parent_id, _ = traceparent.split("-")
+        trace = Trace(trace_id)
+    else:
+        trace = Trace()
+    root = Span(trace, name, parent_id, kind, attributes)
+    trace.spans.append(root)
+    token = _active_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.fail(e)
+        raise
+    finally:
+        _active_span.reset(token)
+        root.end_ns = time.time_ns()
+        if trace.dropped_spans:
+            root.attributes["trace.dropped_spans"] = trace.dropped_spans
+        trace_sampler.finish(trace, root)
+
+@contextmanager
+def trace_span(name, kind=SPAN_KIND_INTERNAL, attributes=None):
+    """Child span of the active span; a no-op outside a trace"""
+    parent = _active_span.get()
+    if parent is None:
+        yield None
+        return
+    trace = parent.trace
+    span = Span(trace, name, parent.span_id, kind, attributes)
+    if len(trace.spans) < TRACE_MAX_SPANS:
+        trace.spans.append(span)
+    else:
+        trace.dropped_spans += 1
+    token = _active_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.fail(e)
+        raise
+    finally:
+        _active_span.reset(token)
+        span.end_ns = time.time_ns()
+
+def traced(name, kind=SPAN_KIND_INTERNAL, root=False):
+    """Decorator running the function in a span (root=True opens a trace)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with (start_trace(name, kind) if root else trace_span(name, kind)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_span_attributes(attributes):
+    span = _active_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+def current_traceparent():
+    """W3C traceparent of the active span, for work continued on another thread"""
+    span = _active_span.get()
+    if span is None:
+        return None
+    return f"00-{span.trace.trace_id}-{span.span_id}-01"
+
 app = Flask(__name__)
 CORS(app, origins=[
     "http://localhost:3000",
@@ -35,7 +453,37 @@ VERIFY_TOKEN = os.environ.get("VERIFY_TOKEN", "SINDBADCRUISE")
 WHATSAPP_TOKEN = os.environ.get("ACCESS_TOKEN")
 WHATSAPP_PHONE_ID = os.environ.get("PHONE_NUMBER_ID", "797371456799734")
 GOOGLE_SHEET_ID = "1GoOO4fae7-3MVJ0QTEY4sGKyTi956zL9X_kaOng_0GE"
+GRAPH_API_URL = os.environ.get("GRAPH_API_URL", "https://graph.facebook.com/v17.0").rstrip("/")
+GRAPH_API_TIMEOUT = float(os.environ.get("GRAPH_API_TIMEOUT", 30))
+GRAPH_POOL_SIZE = int(os.environ.get("GRAPH_POOL_SIZE", 50))
 SHEET_NAME = "Sindbad Ship Cruises"
+# Further vessels / WhatsApp numbers served by this process: a JSON list, or
+# a path to a JSON file, of {"key", "phone_number_id", "name", "cruise_config",
+# "access_token", "sheet_id", "sheet_name"} objects (see TENANTS)
+TENANTS_CONFIG = os.environ.get("TENANTS_CONFIG", "")
+DEFAULT_TENANT_KEY = os.environ.get("DEFAULT_TENANT_KEY", "sindbad")
+
+def _detect_serving_mode():
+    """Report whether blocking I/O is cooperative (gevent-patched) in this process"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("socket"):
+            return "gevent"
+    except ImportError:
+        pass
+    return "threaded"
+
+SERVING_MODE = _detect_serving_mode()
+
+# Shared keep-alive connection pool for Graph API calls. Under the gevent
+# worker (see gunicorn.conf.py) these sockets yield instead of blocking.
+graph_session = requests.Session()
+graph_session.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE
+))
+graph_session.mount("http://", requests.adapters.HTTPAdapter(
+    pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE
+))
 
 # Validate required environment variables
 missing_vars = []
@@ -49,8 +497,462 @@ if not os.environ.get("GOOGLE_CREDS_JSON"):
 if missing_vars:
     logger.error(f"❌ Missing required environment variables: {', '.join(missing_vars)}")
 
+# ==============================
+# ADMISSION CONTROL
+# ==============================
+# Customer webhooks and the staff dashboard share each worker's request
+# slots. Webhooks are always admitted; dashboard calls go through bounded
+# lanes and are shed with 503 + Retry-After once a lane and its short queue
+# are full, or when admitting them would eat into the slots kept free for
+# webhooks.
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 0))  # set by gunicorn.conf.py
+WEBHOOK_RESERVED_SLOTS = int(os.environ.get("WEBHOOK_RESERVED_SLOTS", 8))
+ADMIN_MAX_CONCURRENT = int(os.environ.get("ADMIN_MAX_CONCURRENT", 6))
+ADMIN_MAX_QUEUE = int(os.environ.get("ADMIN_MAX_QUEUE", 6))
+ADMIN_HEAVY_MAX_CONCURRENT = int(os.environ.get("ADMIN_HEAVY_MAX_CONCURRENT", 2))
+ADMIN_HEAVY_MAX_QUEUE = int(os.environ.get("ADMIN_HEAVY_MAX_QUEUE", 2))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2.0))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 2))
+# Upper bounds (seconds) of the queue-time histogram buckets
+ADMISSION_WAIT_BOUNDS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+WEBHOOK_ENDPOINTS = {"verify_webhook", "handle_webhook"}
+# Calls that read or send in bulk get their own, smaller lane
+ADMIN_HEAVY_ENDPOINTS = {
+    "generate_daily_report", "get_all_bookings", "debug_sheets",
+    "send_broadcast", "get_passenger_manifest"
+}
+# Probes must keep answering while the dashboard lanes are saturated
+ADMISSION_EXEMPT_ENDPOINTS = {"health_check", "get_admission_stats", "static"}
+
+class AdmissionLane:
+    """Bounded-concurrency lane with a short bounded wait queue"""
+
+    def __init__(self, name, max_concurrent=None, max_queue=0, reserve_webhook_slots=False):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.reserve_webhook_slots = reserve_webhook_slots
+        self.active = 0
+        self.waiting = 0
+        self.stats = {
+            "admitted": 0, "shed_queue_full": 0, "shed_timeout": 0,
+            "queued": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "wait_histogram": [0] * (len(ADMISSION_WAIT_BOUNDS) + 1)
+        }
+
+    def _has_room(self):
+        if self.max_concurrent is not None and self.active >= self.max_concurrent:
+            return False
+        if self.reserve_webhook_slots and WORKER_CONCURRENCY > 1:
+            return admission.in_flight() < WORKER_CONCURRENCY - WEBHOOK_RESERVED_SLOTS
+        return True
+
+    def _admit(self, waited):
+        self.active += 1
+        self.stats["admitted"] += 1
+        self.stats["wait_seconds_total"] += waited
+        self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+        self.stats["wait_histogram"][bisect.bisect_left(ADMISSION_WAIT_BOUNDS, waited)] += 1
+
+    def status(self):
+        stats = json.loads(json.dumps(self.stats))
+        admitted = stats["admitted"]
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / admitted, 4) if admitted else 0.0
+        stats["wait_histogram"] = {
+            (f"le_{bound}" if i < len(ADMISSION_WAIT_BOUNDS) else "inf"): count
+            for i, (bound, count) in enumerate(zip(ADMISSION_WAIT_BOUNDS + (None,), stats["wait_histogram"]))
+        }
+        return dict(
+            stats, active=self.active, waiting=self.waiting,
+            max_concurrent=self.max_concurrent, max_queue=self.max_queue
+        )
+
+class AdmissionController:
+    """Per-worker request admission across the webhook and dashboard lanes"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.lanes = {
+            "webhook": AdmissionLane("webhook"),
+            "admin": AdmissionLane("admin", ADMIN_MAX_CONCURRENT, ADMIN_MAX_QUEUE, reserve_webhook_slots=True),
+            "admin_heavy": AdmissionLane(
+                "admin_heavy", ADMIN_HEAVY_MAX_CONCURRENT, ADMIN_HEAVY_MAX_QUEUE, reserve_webhook_slots=True
+            )
+        }
+
+    def in_flight(self):
+        return sum(lane.active for lane in self.lanes.values())
+
+    def lane_for(self, endpoint):
+        if endpoint in WEBHOOK_ENDPOINTS:
+            return self.lanes["webhook"]
+        if endpoint in ADMIN_HEAVY_ENDPOINTS:
+            return self.lanes["admin_heavy"]
+        return self.lanes["admin"]
+
+    def acquire(self, lane):
+        """Admit a request into lane, waiting briefly; False means shed it"""
+        started = time.monotonic()
+        with self.cond:
+            if lane.waiting == 0 and lane._has_room():
+                lane._admit(0.0)
+                return True
+            if lane.waiting >= lane.max_queue:
+                lane.stats["shed_queue_full"] += 1
+                return False
+            lane.waiting += 1
+            lane.stats["queued"] += 1
+            deadline = started + ADMISSION_QUEUE_TIMEOUT
+            try:
+                while not lane._has_room():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        lane.stats["shed_timeout"] += 1
+                        return False
+                    self.cond.wait(remaining)
+            finally:
+                lane.waiting -= 1
+            lane._admit(time.monotonic() - started)
+            return True
+
+    def release(self, lane):
+        with self.cond:
+            lane.active -= 1
+            self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            return {
+                "worker_concurrency": WORKER_CONCURRENCY or None,
+                "webhook_reserved_slots": WEBHOOK_RESERVED_SLOTS,
+                "in_flight": self.in_flight(),
+                "lanes": {name: lane.status() for name, lane in self.lanes.items()}
+            }
+
+admission = AdmissionController()
+
+@app.before_request
+def admit_request():
+    """Admit the request into its lane or shed it with 503"""
+    if request.method == "OPTIONS" or request.endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return None
+    lane = admission.lane_for(request.endpoint)
+    if not admission.acquire(lane):
+        logger.warning("🚧 Shed %s request to %s", lane.name, request.path, extra={"category": "admission"})
+        response = jsonify({"error": "Server busy, please retry shortly", "lane": lane.name})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(ADMISSION_RETRY_AFTER)
+        return response
+    g.admission_lane = lane
+    return None
+
+@app.teardown_request
+def release_admission(exc):
+    lane = g.pop("admission_lane", None)
+    if lane is not None:
+        admission.release(lane)
+
+# ==============================
+# GOOGLE SHEETS REQUEST SCHEDULER
+# ==============================
+# Every Sheets call goes through one scheduler so that dashboard reads can
+# never use up the quota a customer's booking write needs.
+SHEETS_READ_QUOTA_PER_MINUTE = int(os.environ.get("SHEETS_READ_QUOTA_PER_MINUTE", 60))
+SHEETS_WRITE_QUOTA_PER_MINUTE = int(os.environ.get("SHEETS_WRITE_QUOTA_PER_MINUTE", 60))
+SHEETS_WORKERS = int(os.environ.get("SHEETS_WORKERS", 2))
+SHEETS_MAX_RETRIES = int(os.environ.get("SHEETS_MAX_RETRIES", 5))
+SHEETS_REQUEST_TIMEOUT = float(os.environ.get("SHEETS_REQUEST_TIMEOUT", 60))
+
+# Priority lanes, highest priority first
+LANE_BOOKING_WRITE = 0
+LANE_CAPACITY_READ = 1
+LANE_DASHBOARD_READ = 2
+LANE_NAMES = {
+    LANE_BOOKING_WRITE: "booking_write",
+    LANE_CAPACITY_READ: "capacity_read",
+    LANE_DASHBOARD_READ: "dashboard_read"
+}
+# Fraction of each bucket a lane may not dip into, kept for the lanes above it
+LANE_RESERVE = {
+    LANE_BOOKING_WRITE: 0.0,
+    LANE_CAPACITY_READ: 0.0,
+    LANE_DASHBOARD_READ: 0.25
+}
+
+class TokenBucket:
+    """Token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.capacity = float(capacity or rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
+            self.updated = now
+
+    def try_acquire(self, reserve=0.0):
+        """Take one token; return 0 on success or the seconds to wait otherwise"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            floor = self.capacity * reserve
+            if self.tokens - 1 >= floor:
+                self.tokens -= 1
+                return 0.0
+            if self.fill_rate <= 0:
+                return 1.0
+            return max((floor + 1 - self.tokens) / self.fill_rate, 0.01)
+
+    def drain(self):
+        """Empty the bucket after the server told us we are over quota"""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+    def headroom(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+class SheetsJob:
+    """A queued Sheets call and the future its callers wait on"""
+
+    def __init__(self, lane, kind, func, args, kwargs, merge_key):
+        self.lane = lane
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.merge_key = merge_key
+        self.future = Future()
+        self.attempts = 0
+        self.started = False
+        self.cancelled = False
+        # Callers waiting on the future; merged reads have several
+        self.waiters = 1
+        self.enqueued_at = time.monotonic()
+
+class SheetsScheduler:
+    """Quota-aware priority scheduler for Google Sheets calls"""
+
+    def __init__(self, read_quota, write_quota, workers=2):
+        self.buckets = {
+            "read": TokenBucket(read_quota),
+            "write": TokenBucket(write_quota)
+        }
+        self.workers = max(1, workers)
+        self.lanes = {lane: deque() for lane in LANE_NAMES}
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.backoff_until = 0.0
+        self.consecutive_throttles = 0
+        self.pid = None
+        self.stats = {
+            "submitted": 0,
+            "executed": 0,
+            "merged": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "throttled": 0,
+            "retries": 0,
+            "by_lane": {name: 0 for name in LANE_NAMES.values()}
+        }
+
+    def _ensure_started(self):
+        # Worker threads do not survive a fork, so (re)start them per process
+        if self.pid == os.getpid():
+            return
+        with self.cond:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            for i in range(self.workers):
+                worker = threading.Thread(target=self._worker, name=f"sheets-worker-{i}", daemon=True)
+                worker.start()
+
+    def submit(self, lane, kind, func, *args, merge_key=None, **kwargs):
+        """Queue a Sheets call and block until it has run"""
+        self._ensure_started()
+        with self.cond:
+            self.stats["submitted"] += 1
+            job = self.pending.get(merge_key) if merge_key is not None else None
+            if job is not None and not job.started:
+                # Share the queued read and promote it to the more urgent lane
+                self.stats["merged"] += 1
+                job.waiters += 1
+                if lane < job.lane:
+                    job.lane = lane
+                    self.lanes[lane].append(job)
+            else:
+                job = SheetsJob(lane, kind, func, args, kwargs, merge_key)
+                if merge_key is not None:
+                    self.pending[merge_key] = job
+                self.lanes[lane].append(job)
+            self.cond.notify()
+        try:
+            return job.future.result(timeout=SHEETS_REQUEST_TIMEOUT)
+        except FutureTimeout:
+            if self._abandon(job):
+                raise
+        # Already running: wait for its outcome, since reporting failure
+        # now would let a retried write land twice
+        return job.future.result(timeout=SHEETS_REQUEST_TIMEOUT)
+
+    def _abandon(self, job):
+        """Withdraw a timed-out caller; False if the call is already running"""
+        with self.cond:
+            job.waiters -= 1
+            if job.started:
+                return False
+            if job.waiters <= 0:
+                # A queued call nobody waits for must never run later
+                job.cancelled = True
+                self.stats["cancelled"] += 1
+                if job.merge_key is not None and self.pending.get(job.merge_key) is job:
+                    del self.pending[job.merge_key]
+            return True
+
+    def _next_job(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.backoff_until:
+                    self.cond.wait(self.backoff_until - now)
+                    continue
+                wait = None
+                for lane in sorted(self.lanes):
+                    lane_queue = self.lanes[lane]
+                    # Drop entries left behind by merged/promoted or cancelled jobs
+                    while lane_queue and (lane_queue[0].started or lane_queue[0].cancelled
+                                          or lane_queue[0].lane != lane):
+                        lane_queue.popleft()
+                    if not lane_queue:
+                        continue
+                    job = lane_queue[0]
+                    delay = self.buckets[job.kind].try_acquire(LANE_RESERVE[lane])
+                    if delay == 0:
+                        lane_queue.popleft()
+                        job.started = True
+                        if job.merge_key is not None and self.pending.get(job.merge_key) is job:
+                            del self.pending[job.merge_key]
+                        return job
+                    wait = delay if wait is None else min(wait, delay)
+                self.cond.wait(wait)
+
+    def _requeue(self, job, delay):
+        with self.cond:
+            self.backoff_until = max(self.backoff_until, time.monotonic() + delay)
+            job.started = False
+            self.lanes[job.lane].appendleft(job)
+            if job.merge_key is not None and job.merge_key not in self.pending:
+                self.pending[job.merge_key] = job
+            self.cond.notify_all()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            job.attempts += 1
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except gspread.exceptions.APIError as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                retryable = status == 429 or (status is not None and status >= 500)
+                if retryable and job.attempts <= SHEETS_MAX_RETRIES:
+                    with self.cond:
+                        self.stats["retries"] += 1
+                        if status == 429:
+                            self.stats["throttled"] += 1
+                            self.consecutive_throttles += 1
+                        throttles = self.consecutive_throttles
+                    if status == 429:
+                        self.buckets[job.kind].drain()
+                    delay = min(2 ** max(throttles, job.attempts), 64) + random.uniform(0, 1)
+                    logger.warning("⏳ Sheets API %s on %s, retrying in %.1fs", status, LANE_NAMES[job.lane], delay)
+                    self._requeue(job, delay)
+                    continue
+                with self.cond:
+                    self.stats["failed"] += 1
+                job.future.set_exception(e)
+                continue
+            except Exception as e:
+                with self.cond:
+                    self.stats["failed"] += 1
+                job.future.set_exception(e)
+                continue
+            with self.cond:
+                self.consecutive_throttles = 0
+                self.stats["executed"] += 1
+                self.stats["by_lane"][LANE_NAMES[job.lane]] += 1
+            job.future.set_result(result)
+
+    def quota_status(self):
+        """Report quota headroom, queue depths and counters"""
+        with self.cond:
+            queued = {
+                LANE_NAMES[lane]: sum(1 for job in lane_queue if not job.started and not job.cancelled and job.lane == lane)
+                for lane, lane_queue in self.lanes.items()
+            }
+            stats = json.loads(json.dumps(self.stats))
+            backoff = max(0.0, self.backoff_until - time.monotonic())
+        return {
+            "read": {
+                "headroom": round(self.buckets["read"].headroom(), 2),
+                "quota_per_minute": SHEETS_READ_QUOTA_PER_MINUTE
+            },
+            "write": {
+                "headroom": round(self.buckets["write"].headroom(), 2),
+                "quota_per_minute": SHEETS_WRITE_QUOTA_PER_MINUTE
+            },
+            "queued": queued,
+            "backoff_seconds": round(backoff, 2),
+            "stats": stats
+        }
+
+sheets_scheduler = SheetsScheduler(
+    SHEETS_READ_QUOTA_PER_MINUTE, SHEETS_WRITE_QUOTA_PER_MINUTE, SHEETS_WORKERS
+)
+
+def sheets_read(lane, func, *args, merge_key=None, **kwargs):
+    """Run a Sheets read through the scheduler"""
+    with trace_span(f"sheets.{getattr(func, '__name__', 'read')}", SPAN_KIND_CLIENT, {"sheets.lane": lane}):
+        return sheets_scheduler.submit(lane, "read", func, *args, merge_key=merge_key, **kwargs)
+
+def sheets_write(lane, func, *args, **kwargs):
+    """Run a Sheets write through the scheduler"""
+    with trace_span(f"sheets.{getattr(func, '__name__', 'write')}", SPAN_KIND_CLIENT, {"sheets.lane": lane}):
+        return sheets_scheduler.submit(lane, "write", func, *args, **kwargs)
+
 # Google Sheets setup
+required_headers = [
+    'Timestamp', 'Booking ID', 'Customer Name', 'Phone Number', 'WhatsApp ID',
+    'Cruise Date', 'Cruise Time', 'Cruise Type', 'Adults Count', 'Children Count', 
+    'Infants Count', 'Total Guests', 'Total Amount', 'Payment Status', 
+    'Payment Method', 'Transaction ID', 'Language', 'Booking Status', 'Notes', 'Vessel'
+]
+# Columns the capacity check needs, read with one projected batch_get
+CAPACITY_COLUMNS = ('Cruise Date', 'Cruise Type', 'Total Guests', 'Booking Status', 'Vessel')
+
+def bind_columns(headers):
+    """Map each required header to its 1-based column in a worksheet header row"""
+    return {header: headers.index(header) + 1 for header in required_headers}
+
+def column_range(column):
+    """A1 range for a whole data column below the header row, e.g. F2:F"""
+    letter = gspread.utils.rowcol_to_a1(1, column)[:-1]
+    return f"{letter}2:{letter}"
+
+DEFAULT_COLUMNS = bind_columns(required_headers)
+sheet_columns = DEFAULT_COLUMNS
+
 sheet = None
+spreadsheet = None
+client = None
 try:
     scope = [
         "https://spreadsheets.google.com/feeds",
@@ -63,51 +965,1605 @@ try:
     client = gspread.authorize(creds)
     
     # Open spreadsheet and worksheet
-    spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+    # Scheduled like every other call, so workers starting together share the quota
+    spreadsheet = sheets_read(LANE_CAPACITY_READ, client.open_by_key, GOOGLE_SHEET_ID)
     
     try:
-        sheet = spreadsheet.worksheet(SHEET_NAME)
+        sheet = sheets_read(LANE_CAPACITY_READ, spreadsheet.worksheet, SHEET_NAME)
         logger.info(f"✅ Found existing worksheet: {SHEET_NAME}")
     except gspread.exceptions.WorksheetNotFound:
         logger.info(f"📝 Creating new worksheet: {SHEET_NAME}")
-        sheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows="1000", cols="20")
+        sheet = sheets_write(
+            LANE_BOOKING_WRITE, spreadsheet.add_worksheet,
+            title=SHEET_NAME, rows="1000", cols=str(len(required_headers))
+        )
         logger.info(f"✅ Created new worksheet: {SHEET_NAME}")
     
-    # Setup headers
-    required_headers = [
-        'Timestamp', 'Booking ID', 'Customer Name', 'Phone Number', 'WhatsApp ID',
-        'Cruise Date', 'Cruise Time', 'Cruise Type', 'Adults Count', 'Children Count', 
-        'Infants Count', 'Total Guests', 'Total Amount', 'Payment Status', 
-        'Payment Method', 'Transaction ID', 'Language', 'Booking Status', 'Notes'
-    ]
-    
-    current_headers = sheet.row_values(1)
-    if not current_headers or current_headers != required_headers:
-        if current_headers:
-            sheet.clear()
-        sheet.append_row(required_headers)
-        logger.info("✅ Updated Google Sheets headers")
+    # Setup headers: columns are bound by name, so a reordered or extended
+    # header row is kept (never cleared) and only missing headers are added
+    current_headers = sheets_read(LANE_CAPACITY_READ, sheet.row_values, 1)
+    if not current_headers:
+        sheets_write(LANE_BOOKING_WRITE, sheet.append_row, required_headers)
+        current_headers = list(required_headers)
+        logger.info("✅ Added Google Sheets headers")
+    missing_headers = [header for header in required_headers if header not in current_headers]
+    if missing_headers:
+        start = gspread.utils.rowcol_to_a1(1, len(current_headers) + 1)
+        sheets_write(LANE_BOOKING_WRITE, sheet.update, start, [missing_headers])
+        current_headers = current_headers + missing_headers
+        logger.warning("⚠️ Added missing Google Sheets headers: %s", ", ".join(missing_headers))
+    sheet_columns = bind_columns(current_headers)
     
     # Test connection
-    test_value = sheet.acell('A1').value
+    test_value = sheets_read(LANE_CAPACITY_READ, sheet.acell, 'A1').value
     logger.info(f"✅ Google Sheets connected successfully. First header: {test_value}")
     
 except Exception as e:
     logger.error(f"❌ Google Sheets initialization failed: {str(e)}")
     sheet = None
 
-# Session management
-user_sessions = {}
+# ==============================
+# BOOKING CHANGE LOG
+# ==============================
+BOOKING_CHANGE_LOG_SIZE = int(os.environ.get("BOOKING_CHANGE_LOG_SIZE", 5000))
+BOOKING_SYNC_INTERVAL = int(os.environ.get("BOOKING_SYNC_INTERVAL", 120))
+
+class BookingChangeLog:
+    """
+    Bounded log of booking row changes, addressed by a cursor
+    Fed by our own appends and by reconciling full worksheet reads, so rows
+    edited by hand show up as updates too. Rows are keyed by
+    (partition, sheet row number).
+    With the SQLite store the epoch is the database's and sequence numbers
+    are its row versions, so a cursor is valid on every worker. With the
+    Sheets store both are per process: under several workers a client
+    resyncs whenever its poll lands on another worker.
+    """
+
+    def __init__(self, max_entries):
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.seq = 0
+        # Changes after this sequence number are all in the log
+        self.floor = 0
+        self.entries = deque(maxlen=max_entries)
+        self.rows = {}
+        self.seeded = set()
+        self.loaded = False
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.sync_pid = None
+        self.start_lock = threading.Lock()
+
+    def cursor(self):
+        return f"{self.epoch}.{self.seq}"
+
+    def add_listener(self, listener):
+        """Register listener(op, row_number, record, previous) for every change"""
+        self.listeners.append(listener)
+
+    def _apply(self, row_number, op, record, seq=None):
+        previous = self.rows.get(row_number)
+        self.seq = self.seq + 1 if seq is None else seq
+        if len(self.entries) == self.entries.maxlen:
+            self.floor = self.entries[0][0]
+        if op == "delete":
+            self.rows.pop(row_number, None)
+        else:
+            self.rows[row_number] = (tuple(record.values()), record, self.seq)
+        self.entries.append((self.seq, row_number, op, record, previous[1] if previous else None))
+        self._notify(op, row_number, record, previous[1] if previous else None)
+
+    def _notify(self, op, row_number, record, previous):
+        for listener in self.listeners:
+            try:
+                listener(op, row_number, record, previous)
+            except Exception as e:
+                logger.error("Booking listener %s failed: %s", getattr(listener, "__name__", listener), e)
+
+    def record_append(self, row_number, record):
+        with self.lock:
+            self._apply(row_number, "append", record)
+
+    def record_upsert(self, key, record, seq=None):
+        """Log record as an append or update unless it is already current"""
+        with self.lock:
+            current = self.rows.get(key)
+            if current is None:
+                self._apply(key, "append", record, seq)
+            elif current[0] != tuple(record.values()):
+                self._apply(key, "update", record, seq)
+
+    def advance(self, seq, complete=True):
+        """
+        Move the sequence up to an external version (the SQLite store's);
+        complete=False means earlier changes are not in the log
+        """
+        with self.lock:
+            self.seq = max(self.seq, seq)
+            if not complete:
+                self.floor = self.seq
+
+    def reconcile(self, partition, records, started_seq, row_numbers=None):
+        """
+        Diff a full read of one partition against the snapshot; row numbers
+        default to sheet rows (data starting at row 2)
+        """
+        keyed = list(zip(row_numbers or itertools.count(2), records))
+        with self.lock:
+            if partition not in self.seeded:
+                # First read seeds the snapshot (and listeners) without flooding the log
+                for row_number, record in keyed:
+                    key = (partition, row_number)
+                    if key not in self.rows:
+                        self.rows[key] = (tuple(record.values()), record, 0)
+                        self._notify("append", key, record, None)
+                self.seeded.add(partition)
+                return
+            
+            seen = set()
+            for row_number, record in keyed:
+                key = (partition, row_number)
+                seen.add(key)
+                current = self.rows.get(key)
+                if current is None:
+                    self._apply(key, "append", record)
+                elif current[2] <= started_seq and current[0] != tuple(record.values()):
+                    self._apply(key, "update", record)
+            
+            stale = [
+                key for key, current in self.rows.items()
+                if key[0] == partition and key not in seen and current[2] <= started_seq
+            ]
+            for key in stale:
+                self._apply(key, "delete", self.rows[key][1])
+
+    def snapshot(self, vessel=None):
+        """Return (row_keys, records) in partition and sheet order, all or one vessel's"""
+        with self.lock:
+            row_keys = [
+                key for key in sorted(self.rows)
+                if vessel is None or booking_tenant_key(self.rows[key][1]) == vessel
+            ]
+            return row_keys, [self.rows[key][1] for key in row_keys]
+
+    def partition_records(self, partition):
+        """Records of one partition in sheet order"""
+        with self.lock:
+            return [self.rows[key][1] for key in sorted(self.rows) if key[0] == partition]
+
+    def changes_since(self, cursor, vessel=None):
+        """Return (changes, cursor), or (None, cursor) if the client must resync"""
+        with self.lock:
+            try:
+                epoch, since = cursor.split(".", 1)
+                since = int(since)
+            except (AttributeError, ValueError):
+                return None, self.cursor()
+            if epoch != self.epoch or not self.floor <= since <= self.seq:
+                return None, self.cursor()
+            changes = []
+            for seq, key, op, record, previous in self.entries:
+                if seq <= since:
+                    continue
+                if vessel is not None and booking_tenant_key(record) != vessel:
+                    if op != "update" or previous is None or booking_tenant_key(previous) != vessel:
+                        continue
+                    # Moved to another vessel: gone from this one's view
+                    op, record = "delete", previous
+                changes.append({"op": op, "row": row_label(key), "record": record})
+            return changes, self.cursor()
+
+    def ensure_sync_thread(self):
+        """Start the periodic rescan of the booking store (once per process)"""
+        if self.sync_pid == os.getpid() or BOOKING_SYNC_INTERVAL <= 0:
+            return
+        with self.start_lock:
+            if self.sync_pid == os.getpid():
+                return
+            self.sync_pid = os.getpid()
+            threading.Thread(target=self._sync_loop, name="booking-sync", daemon=True).start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(BOOKING_SYNC_INTERVAL)
+            try:
+                if booking_store.available():
+                    booking_store.refresh()
+            except Exception as e:
+                logger.error("Booking sync scan failed: %s", e)
+
+booking_changes = BookingChangeLog(BOOKING_CHANGE_LOG_SIZE)
+
+def row_label(key):
+    """Client-facing row id such as "2026-10!5" for a (partition, row) key"""
+    return f"{key[0]}!{key[1]}"
+
+def register_booking_listener(listener):
+    """Call listener(op, row_number, record, previous) on every booking change"""
+    booking_changes.add_listener(listener)
+    return listener
+
+def _row_number_from_append(response):
+    """Extract the sheet row number from an append_row API response"""
+    try:
+        updated_range = response["updates"]["updatedRange"]
+        match = re.search(r"![A-Z]+(\d+)", updated_range)
+        return int(match.group(1)) if match else None
+    except (KeyError, TypeError):
+        return None
+
+# ==============================
+# BOOKING PARTITIONS
+# ==============================
+# Bookings live in one worksheet per cruise month ("Sindbad Ship Cruises 2026-10").
+# Months that have fully sailed are archived (renamed and hidden); they are
+# read once per process and never rescanned, so periodic scans, capacity
+# checks and reports only touch current data. The original worksheet stays
+# readable as the "legacy" partition for bookings made before partitioning.
+BOOKING_PARTITIONING = os.environ.get("BOOKING_PARTITIONING", "true").lower() == "true"
+PARTITION_WORKSHEET_ROWS = int(os.environ.get("PARTITION_WORKSHEET_ROWS", 500))
+PARTITION_ARCHIVE_SUFFIX = " (archived)"
+LEGACY_PARTITION = "legacy"
+
+def partition_month(cruise_date):
+    """Partition key "YYYY-MM" for a DD/MM/YYYY (or ISO / DD-MM-YYYY) cruise date, or None"""
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(str(cruise_date).strip(), fmt).strftime("%Y-%m")
+        except ValueError:
+            continue
+    return None
+
+class BookingPartition:
+    """One bookings worksheet and the cruise months it holds"""
+    __slots__ = ("key", "worksheet", "months", "archived", "columns")
+
+    def __init__(self, key, worksheet, archived=False, columns=DEFAULT_COLUMNS):
+        self.key = key
+        self.worksheet = worksheet
+        # Unknown for the legacy worksheet until it has been read
+        self.months = {key} if key != LEGACY_PARTITION else None
+        self.archived = archived
+        self.columns = columns
+
+    def layout(self, values):
+        """Arrange values given in required_headers order into this worksheet's columns"""
+        if self.columns == DEFAULT_COLUMNS:
+            return values
+        row = [''] * max(self.columns.values())
+        for header, value in zip(required_headers, values):
+            row[self.columns[header] - 1] = value
+        return row
+
+    def is_active(self, current_month):
+        if self.archived:
+            return False
+        if self.key == LEGACY_PARTITION:
+            return not BOOKING_PARTITIONING or self.months is None or any(
+                month and month >= current_month for month in self.months
+            )
+        return self.key >= current_month
+
+class PartitionRouter:
+    """Maps cruise dates and month ranges to the worksheets that hold them"""
+
+    def __init__(self):
+        self.partitions = {}
+        self.title_pattern = re.compile(
+            rf"^{re.escape(SHEET_NAME)} (\d{{4}}-\d{{2}})({re.escape(PARTITION_ARCHIVE_SUFFIX)})?$"
+        )
+        self.lock = threading.Lock()
+
+    def discover(self, book, legacy_sheet, legacy_columns=DEFAULT_COLUMNS):
+        """Register the legacy worksheet and every existing month worksheet"""
+        with self.lock:
+            self.partitions = {
+                LEGACY_PARTITION: BookingPartition(LEGACY_PARTITION, legacy_sheet, columns=legacy_columns)
+            }
+            for worksheet in sheets_read(LANE_CAPACITY_READ, book.worksheets):
+                match = self.title_pattern.match(worksheet.title)
+                if match:
+                    month = match.group(1)
+                    self.partitions[month] = BookingPartition(month, worksheet, archived=bool(match.group(2)))
+        logger.info("📚 Booking partitions: %s", ", ".join(sorted(self.partitions)))
+
+    def _current_month(self):
+        return datetime.now().strftime("%Y-%m")
+
+    def all(self):
+        with self.lock:
+            return list(self.partitions.values())
+
+    def active(self):
+        current_month = self._current_month()
+        return [partition for partition in self.all() if partition.is_active(current_month)]
+
+    def for_months(self, months):
+        """Partitions that may hold bookings for any of the given months"""
+        months = set(months)
+        return [
+            partition for partition in self.all()
+            if partition.months is None or partition.months & months
+        ]
+
+    def for_write(self, cruise_date):
+        """Worksheet a new booking for cruise_date is appended to, created on first use"""
+        month = partition_month(cruise_date)
+        if not BOOKING_PARTITIONING or month is None or spreadsheet is None:
+            return self.partitions[LEGACY_PARTITION]
+        with self.lock:
+            partition = self.partitions.get(month)
+            if partition is None:
+                partition = BookingPartition(month, self._create_worksheet(month))
+                self.partitions[month] = partition
+            return partition
+
+    def _create_worksheet(self, month):
+        title = f"{SHEET_NAME} {month}"
+        try:
+            worksheet = sheets_write(
+                LANE_BOOKING_WRITE, spreadsheet.add_worksheet,
+                title=title, rows=PARTITION_WORKSHEET_ROWS, cols=len(required_headers)
+            )
+        except gspread.exceptions.APIError:
+            # Another worker process created it first
+            return sheets_read(LANE_BOOKING_WRITE, spreadsheet.worksheet, title)
+        sheets_write(LANE_BOOKING_WRITE, worksheet.append_row, required_headers)
+        logger.info("📝 Created booking partition: %s", title)
+        return worksheet
+
+    def archive_completed(self, final_read=True):
+        """
+        Rename and hide month worksheets whose sailings are all in the past;
+        final_read=False when the worksheets only mirror another store
+        """
+        current_month = self._current_month()
+        for partition in self.all():
+            if partition.key == LEGACY_PARTITION or partition.archived or partition.key >= current_month:
+                continue
+            try:
+                if final_read:
+                    # Read it once more so the final state of the month is in memory
+                    fetch_partition_records(partition, LANE_DASHBOARD_READ)
+                worksheet = partition.worksheet
+                sheets_write(LANE_DASHBOARD_READ, worksheet.update_title, worksheet.title + PARTITION_ARCHIVE_SUFFIX)
+                sheets_write(LANE_DASHBOARD_READ, worksheet.hide)
+                partition.archived = True
+                logger.info("🗄️ Archived booking partition %s", partition.key)
+            except Exception as e:
+                logger.error("Archiving partition %s failed: %s", partition.key, e)
+
+partition_router = PartitionRouter()
+if sheet:
+    try:
+        partition_router.discover(spreadsheet, sheet, sheet_columns)
+    except Exception as e:
+        logger.error("❌ Booking partition discovery failed: %s", e)
+
+def _read_partition(partition):
+    # Every full read doubles as a scan for rows edited by hand in the sheet
+    started_seq = booking_changes.seq
+    records = partition.worksheet.get_all_records()
+    if partition.key == LEGACY_PARTITION:
+        partition.months = {partition_month(record.get('Cruise Date', '')) for record in records}
+    booking_changes.reconcile(partition.key, records, started_seq)
+    return records
+
+def fetch_partition_records(partition, lane):
+    """
+    Records of one partition; archived partitions are read only once,
+    concurrent queued reads of the same worksheet share one API call
+    """
+    if partition.archived and partition.key in booking_changes.seeded:
+        return booking_changes.partition_records(partition.key)
+    return sheets_read(
+        lane, _read_partition, partition,
+        merge_key=("get_all_records", partition.worksheet.id)
+    )
+
+def _read_capacity_columns(partition):
+    ranges = [column_range(partition.columns[header]) for header in CAPACITY_COLUMNS]
+    columns = partition.worksheet.batch_get(ranges, major_dimension="COLUMNS")
+    # Each range comes back as [[values...]], or [] when the column is empty
+    values = [column_values[0] if column_values else [] for column_values in columns]
+    return [
+        tuple(str(value).strip() for value in row)
+        for row in itertools.zip_longest(*values, fillvalue='')
+    ]
+
+def fetch_capacity_rows(dates, lane):
+    """
+    (cruise date, cruise type, total guests, status, vessel) tuples from
+    the partitions for the given dates, reading only the CAPACITY_COLUMNS
+    """
+    months = {partition_month(date) for date in dates} - {None}
+    rows = []
+    for partition in partition_router.for_months(months):
+        if partition.archived and partition.key in booking_changes.seeded:
+            rows.extend(
+                tuple(str(record.get(header, '')).strip() for header in CAPACITY_COLUMNS)
+                for record in booking_changes.partition_records(partition.key)
+            )
+            continue
+        rows.extend(sheets_read(
+            lane, _read_capacity_columns, partition,
+            merge_key=("capacity_columns", partition.worksheet.id)
+        ))
+    return rows
+
+def fetch_records_for_dates(dates, lane):
+    """Booking records from only the partitions that can hold the given DD/MM/YYYY dates"""
+    months = {partition_month(date) for date in dates}
+    records = []
+    for partition in partition_router.for_months(months - {None}):
+        records.extend(fetch_partition_records(partition, lane))
+    return records
+
+def fetch_all_records(lane):
+    """Rescan active partitions and return every booking record"""
+    for partition in partition_router.active():
+        fetch_partition_records(partition, lane)
+    for partition in partition_router.all():
+        if partition.key not in booking_changes.seeded:
+            fetch_partition_records(partition, lane)
+    booking_changes.loaded = True
+    return booking_changes.snapshot()[1]
+
+# ==============================
+# BOOKING STORE
+# ==============================
+# Where bookings are kept. "sheets" (default) keeps Google Sheets as the
+# only store, so edits and cancellations staff make in the spreadsheet count
+# everywhere. "sqlite" (opt-in) makes a local database the system of record
+# and mirrors new rows to the month worksheets in the background: no booking,
+# capacity check or report waits on the Sheets API, but the mirror is one-way
+# and later edits in the spreadsheet are not read back.
+BOOKING_STORE = os.environ.get("BOOKING_STORE", "sheets").lower()
+BOOKING_DB_PATH = os.environ.get("BOOKING_DB_PATH", "bookings.db")
+BOOKING_EXPORT_INTERVAL = int(os.environ.get("BOOKING_EXPORT_INTERVAL", 15))
+BOOKING_EXPORT_BATCH = int(os.environ.get("BOOKING_EXPORT_BATCH", 200))
+# A claimed batch not marked exported within this time is retried
+BOOKING_EXPORT_CLAIM_TIMEOUT = 300
+SQLITE_PARTITION = "db"
+BOOKING_DB_COLUMNS = [re.sub(r"\W+", "_", header.lower()) for header in required_headers]
+
+class SheetsBookingStore:
+    """Google Sheets as the only booking store"""
+    name = "sheets"
+
+    def available(self):
+        return sheet is not None
+
+    def save(self, row_data):
+        cruise_date = row_data[required_headers.index('Cruise Date')]
+        partition = partition_router.for_write(cruise_date)
+        response = sheets_write(LANE_BOOKING_WRITE, partition.worksheet.append_row, partition.layout(row_data))
+        row_number = _row_number_from_append(response)
+        if row_number:
+            record = {header: gspread.utils.numericise(str(value)) for header, value in zip(required_headers, row_data)}
+            booking_changes.record_append((partition.key, row_number), record)
+        return partition.key
+
+    def capacity(self, date, cruise_type):
+        tenant = tenants.current()
+        vessels = (tenant.key, tenant.legacy_vessel)
+        total_guests = 0
+        for record_date, record_type, guests, status, vessel in fetch_capacity_rows([date], LANE_CAPACITY_READ):
+            if (record_date == date and record_type == cruise_type and vessel in vessels
+                    and status.lower() != 'cancelled'):
+                total_guests += _as_int(guests)
+        return total_guests
+
+    def records_for_date(self, date, lane):
+        vessel = tenants.current().key
+        return [
+            record for record in fetch_records_for_dates([date], lane)
+            if str(record.get('Cruise Date', '')).strip() == date and booking_tenant_key(record) == vessel
+        ]
+
+    def all_records(self, lane):
+        return fetch_all_records(lane)
+
+    def ensure_loaded(self):
+        if self.available() and not booking_changes.loaded:
+            fetch_all_records(LANE_DASHBOARD_READ)
+
+    def refresh(self):
+        partition_router.archive_completed()
+        fetch_all_records(LANE_DASHBOARD_READ)
+
+    def ensure_started(self):
+        pass
+
+class SqliteDatabase:
+    """Base for local SQLite stores: per-thread connections and write transactions"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def _connect(self):
+        # One connection per thread; opened lazily so none cross a fork
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _add_missing_columns(self, table, columns):
+        """Bring a table created by an older release up to date"""
+        conn = self._connect()
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, definition in columns.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+class SqliteBookingStore(SqliteDatabase):
+    """
+    Local SQLite database as the booking system of record
+    Rows carry a version stamp so each worker picks up the others' writes
+    cheaply, and an exported flag the background exporter uses to mirror
+    new rows to the month worksheets in batches.
+    """
+    name = "sqlite"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.loaded_version = 0
+        self.refresh_lock = threading.Lock()
+        self.export_wakeup = threading.Event()
+        self.export_pid = None
+        self.start_lock = threading.Lock()
+        self.stats = {"exported": 0, "export_batches": 0, "export_failures": 0, "imported": 0}
+        self._create_schema()
+        self.epoch = self._database_epoch()
+        booking_changes.epoch = self.epoch
+
+    def _create_schema(self):
+        columns = ", ".join(BOOKING_DB_COLUMNS)
+        conn = self._connect()
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                {columns},
+                version INTEGER NOT NULL,
+                exported INTEGER NOT NULL DEFAULT 0,
+                export_claimed_at REAL,
+                sheet_partition TEXT,
+                sheet_row INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings (cruise_date, cruise_type);
+            CREATE INDEX IF NOT EXISTS idx_bookings_whatsapp_id ON bookings (whatsapp_id);
+            CREATE INDEX IF NOT EXISTS idx_bookings_booking_id ON bookings (booking_id);
+            CREATE INDEX IF NOT EXISTS idx_bookings_version ON bookings (version);
+            CREATE INDEX IF NOT EXISTS idx_bookings_pending_export ON bookings (id) WHERE exported = 0;
+            CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._add_missing_columns("bookings", {column: "DEFAULT ''" for column in BOOKING_DB_COLUMNS})
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_bookings_vessel_slot ON bookings (vessel, cruise_date, cruise_type)"
+        )
+
+    def _database_epoch(self):
+        """Id of this database, shared by every worker using it"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR IGNORE INTO store_meta (key, value) VALUES ('epoch', ?)",
+            (format(int(time.time() * 1000), "x") + format(random.getrandbits(16), "04x"),)
+        )
+        return conn.execute("SELECT value FROM store_meta WHERE key = 'epoch'").fetchone()[0]
+
+    @staticmethod
+    def _record(row):
+        # Same value types get_all_records produces for the sheet
+        return {header: gspread.utils.numericise(value) for header, value in zip(required_headers, row)}
+
+    def _insert(self, conn, values, exported=0, sheet_partition=None, sheet_row=None):
+        placeholders = ", ".join("?" for _ in BOOKING_DB_COLUMNS)
+        cursor = conn.execute(
+            f"INSERT INTO bookings ({', '.join(BOOKING_DB_COLUMNS)}, version, exported, sheet_partition, sheet_row) "
+            f"VALUES ({placeholders}, (SELECT COALESCE(MAX(version), 0) + 1 FROM bookings), ?, ?, ?)",
+            [str(value).strip() for value in values] + [exported, sheet_partition, sheet_row]
+        )
+        return cursor.lastrowid
+
+    def available(self):
+        return True
+
+    def save(self, row_data):
+        with self._transaction() as conn:
+            self._insert(conn, row_data)
+        # Picks up our row (and any other worker's) in version order
+        self.refresh()
+        self.export_wakeup.set()
+        return SQLITE_PARTITION
+
+    def capacity(self, date, cruise_type):
+        tenant = tenants.current()
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(CAST(total_guests AS INTEGER)), 0) FROM bookings "
+            "WHERE vessel IN (?, ?) AND cruise_date = ? AND cruise_type = ? "
+            "AND LOWER(booking_status) != 'cancelled'",
+            (tenant.key, tenant.legacy_vessel, date, cruise_type)
+        ).fetchone()
+        return row[0]
+
+    def records_for_date(self, date, lane):
+        tenant = tenants.current()
+        rows = self._connect().execute(
+            f"SELECT {', '.join(BOOKING_DB_COLUMNS)} FROM bookings "
+            "WHERE cruise_date = ? AND vessel IN (?, ?) ORDER BY id",
+            (date, tenant.key, tenant.legacy_vessel)
+        ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def all_records(self, lane):
+        self.refresh()
+        return booking_changes.snapshot()[1]
+
+    def ensure_loaded(self):
+        # One indexed query; keeps every worker's view (and cursors) current
+        self.refresh()
+
+    def refresh(self):
+        """Bring the change log up to date with rows written by any worker"""
+        with self.refresh_lock:
+            rows = self._connect().execute(
+                f"SELECT id, version, {', '.join(BOOKING_DB_COLUMNS)} FROM bookings "
+                "WHERE version > ? ORDER BY version", (self.loaded_version,)
+            ).fetchall()
+            if not booking_changes.loaded:
+                started_seq = booking_changes.seq
+                booking_changes.reconcile(
+                    SQLITE_PARTITION, [self._record(row[2:]) for row in rows], started_seq,
+                    row_numbers=[row[0] for row in rows]
+                )
+                booking_changes.advance(rows[-1][1] if rows else 0, complete=False)
+                booking_changes.loaded = True
+            else:
+                for row in rows:
+                    booking_changes.record_upsert((SQLITE_PARTITION, row[0]), self._record(row[2:]), seq=row[1])
+            if rows:
+                self.loaded_version = max(self.loaded_version, rows[-1][1])
+                booking_changes.advance(self.loaded_version)
+
+    @staticmethod
+    def _sheets_imported(conn):
+        return conn.execute("SELECT 1 FROM store_meta WHERE key = 'sheets_imported'").fetchone() is not None
+
+    def import_from_sheets(self):
+        """One-time seed of the database from every booking worksheet"""
+        if self._sheets_imported(self._connect()):
+            return 0
+        # Read every worksheet before taking the write lock
+        worksheets = [
+            (partition.key, sheets_read(LANE_DASHBOARD_READ, partition.worksheet.get_all_values))
+            for partition in partition_router.all()
+        ]
+        with self._transaction() as conn:
+            if self._sheets_imported(conn):
+                return 0
+            known_ids = {row[0] for row in conn.execute("SELECT booking_id FROM bookings")}
+            imported = 0
+            for partition_key, values in worksheets:
+                if not values:
+                    continue
+                columns = {header: index for index, header in enumerate(values[0])}
+                for row_number, row in enumerate(values[1:], start=2):
+                    if not any(row):
+                        continue
+                    record = [
+                        row[columns[header]] if header in columns and columns[header] < len(row) else ''
+                        for header in required_headers
+                    ]
+                    booking_id = record[required_headers.index('Booking ID')]
+                    if booking_id in known_ids:
+                        continue
+                    self._insert(conn, record, exported=1, sheet_partition=partition_key, sheet_row=row_number)
+                    if booking_id:
+                        known_ids.add(booking_id)
+                    imported += 1
+            conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES ('sheets_imported', ?)",
+                (datetime.now().isoformat(),)
+            )
+        self.stats["imported"] = imported
+        logger.info("📥 Imported %s bookings from Google Sheets into %s", imported, self.path)
+        return imported
+
+    def ensure_started(self):
+        """Start this process's exporter thread"""
+        if self.export_pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.export_pid == os.getpid():
+                return
+            self.export_pid = os.getpid()
+            threading.Thread(target=self._export_loop, name="booking-exporter", daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            self.export_wakeup.wait(BOOKING_EXPORT_INTERVAL)
+            self.export_wakeup.clear()
+            try:
+                self.export_cycle()
+            except Exception as e:
+                logger.error("Booking export failed: %s", e)
+
+    def export_cycle(self):
+        """Pick up new rows, archive past months and mirror every pending row"""
+        self.refresh()
+        if sheet:
+            # The database already holds every booking, so past months are
+            # archived without reading (and re-seeding) their worksheets
+            partition_router.archive_completed(final_read=False)
+            while self.export_pending() == BOOKING_EXPORT_BATCH:
+                pass
+
+    def export_pending(self):
+        """Mirror one batch of unexported rows to the worksheets; returns the batch size"""
+        now = time.time()
+        with self._transaction() as conn:
+            # Claim the batch so other worker processes skip it
+            rows = conn.execute(
+                f"SELECT id, {', '.join(BOOKING_DB_COLUMNS)} FROM bookings "
+                "WHERE exported = 0 AND (export_claimed_at IS NULL OR export_claimed_at < ?) "
+                "ORDER BY id LIMIT ?", (now - BOOKING_EXPORT_CLAIM_TIMEOUT, BOOKING_EXPORT_BATCH)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE bookings SET export_claimed_at = ? WHERE id = ?", [(now, row[0]) for row in rows]
+            )
+        if not rows:
+            return 0
+        
+        by_partition = {}
+        date_index = required_headers.index('Cruise Date')
+        vessel_index = required_headers.index('Vessel')
+        for row in rows:
+            tenant = tenants.get(row[1 + vessel_index])
+            if tenant is not None and tenant.mirror_partition is not None:
+                partition = tenant.mirror_partition
+            else:
+                partition = partition_router.for_write(row[1 + date_index])
+            by_partition.setdefault(partition.key, (partition, []))[1].append(row)
+        
+        for partition, batch in by_partition.values():
+            try:
+                # Background mirroring yields to every interactive Sheets call
+                response = sheets_write(
+                    LANE_DASHBOARD_READ, partition.worksheet.append_rows,
+                    [partition.layout(list(row[1:])) for row in batch]
+                )
+            except Exception as e:
+                self.stats["export_failures"] += 1
+                logger.error("Mirroring %s bookings to %s failed: %s", len(batch), partition.key, e)
+                continue
+            first_row = _row_number_from_append(response)
+            with self._transaction() as conn:
+                conn.executemany(
+                    "UPDATE bookings SET exported = 1, sheet_partition = ?, sheet_row = ? WHERE id = ?",
+                    [
+                        (partition.key, first_row + offset if first_row else None, row[0])
+                        for offset, row in enumerate(batch)
+                    ]
+                )
+            self.stats["exported"] += len(batch)
+            self.stats["export_batches"] += 1
+        return len(rows)
+
+    def export_status(self):
+        conn = self._connect()
+        pending = conn.execute("SELECT COUNT(*) FROM bookings WHERE exported = 0").fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        return dict(self.stats, pending_export=pending, total=total, path=self.path)
+
+if BOOKING_STORE == "sqlite":
+    booking_store = SqliteBookingStore(BOOKING_DB_PATH)
+    if sheet:
+        try:
+            booking_store.import_from_sheets()
+        except Exception as e:
+            logger.error("❌ Importing bookings from Google Sheets failed: %s", e)
+else:
+    booking_store = SheetsBookingStore()
+
+# ==============================
+# TENANTS
+# ==============================
+# One process can serve several vessels, each with its own WhatsApp number.
+# Webhooks are routed by metadata.phone_number_id and dashboard calls by the
+# X-Tenant header (or ?tenant=); the tenant then decides the cruise config,
+# sessions, chat history, capacity and outbound sender number. HTTP pools,
+# Sheets auth and scheduler, the booking database and worker threads are
+# shared, and conversation memory is accounted per tenant under one budget.
+# Bookings carry the tenant key in their Vessel column; rows with an empty
+# Vessel predate tenancy and belong to the default tenant.
+_current_tenant = contextvars.ContextVar("tenant", default=None)
+
+def merge_config(base, overrides):
+    """base with overrides applied, recursing into nested dicts"""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            value = merge_config(base[key], value)
+        merged[key] = value
+    return merged
+
+class Tenant:
+    """One vessel / WhatsApp number served by this process"""
+
+    def __init__(self, key, phone_number_id, name=None, cruise_config=None, access_token=None,
+                 sheet_id=None, sheet_name=None, default=False):
+        self.key = key
+        self.phone_number_id = str(phone_number_id)
+        self.name = name or key
+        self.cruise_config = merge_config(BASE_CRUISE_CONFIG, cruise_config or {})
+        self.access_token = access_token or WHATSAPP_TOKEN
+        self.sheet_id = sheet_id
+        self.sheet_name = sheet_name
+        # Bookings with no Vessel are the default tenant's
+        self.legacy_vessel = "" if default else key
+        # Worksheet this tenant's bookings are mirrored to instead of the shared partitions
+        self.mirror_partition = None
+        self.sessions = SessionStore(key)
+        self.chat_messages = {}
+        self.chat_unread = {}
+        self.chat_index = ChatSearchIndex()
+
+    def bind_sheet(self):
+        """Open (or create) this tenant's own booking worksheet"""
+        if not self.sheet_name or client is None:
+            return
+        book = sheets_read(LANE_CAPACITY_READ, client.open_by_key, self.sheet_id or GOOGLE_SHEET_ID)
+        try:
+            worksheet = sheets_read(LANE_CAPACITY_READ, book.worksheet, self.sheet_name)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = sheets_write(
+                LANE_BOOKING_WRITE, book.add_worksheet,
+                title=self.sheet_name, rows=PARTITION_WORKSHEET_ROWS, cols=len(required_headers)
+            )
+            sheets_write(LANE_BOOKING_WRITE, worksheet.append_row, required_headers)
+        self.mirror_partition = BookingPartition(f"tenant:{self.key}", worksheet)
+        logger.info("📗 Tenant %s mirrors bookings to %s", self.key, self.sheet_name)
+
+    def status(self, memory):
+        return {
+            "key": self.key,
+            "name": self.name,
+            "phone_number_id": self.phone_number_id,
+            "sheet": self.mirror_partition.worksheet.title if self.mirror_partition else SHEET_NAME,
+            "sessions": len(self.sessions),
+            "chats": len(self.chat_messages),
+            "search_index": self.chat_index.status(),
+            "memory_bytes": memory.get("bytes", 0),
+            "conversations": memory.get("conversations", 0)
+        }
+
+class TenantRegistry:
+    """Tenants by key and by WhatsApp phone_number_id"""
+
+    def __init__(self):
+        self.by_key = {}
+        self.by_phone_number_id = {}
+        self.default = None
+
+    def load(self, raw):
+        self.default = Tenant(DEFAULT_TENANT_KEY, WHATSAPP_PHONE_ID, SHEET_NAME, default=True)
+        self._add(self.default)
+        if not raw:
+            return
+        try:
+            entries = json.loads(open(raw).read() if os.path.isfile(raw) else raw)
+            for entry in entries:
+                self._add(Tenant(**entry))
+        except Exception as e:
+            logger.error("❌ Invalid TENANTS_CONFIG: %s", e)
+        for tenant in self.all():
+            try:
+                tenant.bind_sheet()
+            except Exception as e:
+                logger.error("❌ Binding sheet for tenant %s failed: %s", tenant.key, e)
+        logger.info("🚢 Serving tenants: %s", ", ".join(self.by_key))
+
+    def _add(self, tenant):
+        self.by_key[tenant.key] = tenant
+        self.by_phone_number_id[tenant.phone_number_id] = tenant
+
+    def all(self):
+        return list(self.by_key.values())
+
+    def get(self, key):
+        if not key:
+            return self.default
+        return self.by_key.get(key)
+
+    def for_phone_number_id(self, phone_number_id):
+        """Tenant a webhook addressed to phone_number_id belongs to (None if unknown)"""
+        if not phone_number_id:
+            return self.default
+        return self.by_phone_number_id.get(str(phone_number_id))
+
+    def current(self):
+        return _current_tenant.get() or self.default
+
+tenants = TenantRegistry()
+
+def booking_tenant_key(record):
+    """Key of the tenant a booking belongs to (no Vessel means the default tenant)"""
+    return str(record.get('Vessel', '')).strip() or DEFAULT_TENANT_KEY
+
+def expire_idle_sessions(force=False):
+    """Drop idle sessions of every tenant, not just the one being served"""
+    expired = False
+    for tenant in tenants.all():
+        expired = tenant.sessions.expire_idle(force=force) or expired
+    if expired:
+        bump_data_version("sessions")
+
+@contextmanager
+def tenant_context(tenant):
+    """Run the block on behalf of tenant"""
+    token = _current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
+
+class TenantScoped:
+    """Stands in for a per-tenant object, resolving to the current tenant's on every use"""
+    __slots__ = ("_attribute",)
+
+    def __init__(self, attribute):
+        object.__setattr__(self, "_attribute", attribute)
+
+    def _target(self):
+        return getattr(tenants.current(), self._attribute)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+@app.before_request
+def bind_request_tenant():
+    """Select the tenant a dashboard request is about"""
+    key = request.headers.get("X-Tenant") or request.args.get("tenant")
+    if not key:
+        return None
+    tenant = tenants.get(key)
+    if tenant is None:
+        return jsonify({"error": f"Unknown tenant: {key}"}), 404
+    g.tenant_token = _current_tenant.set(tenant)
+    return None
+
+@app.teardown_request
+def release_request_tenant(exc):
+    token = g.pop("tenant_token", None)
+    if token is not None:
+        _current_tenant.reset(token)
+
+# ==============================
+# SESSION STORE
+# ==============================
+SESSION_IDLE_TIMEOUT = int(os.environ.get("SESSION_IDLE_TIMEOUT", 3600))
+SESSION_EXPIRY_SWEEP_INTERVAL = 60
+# Session fields the store keeps per-value indexes for
+SESSION_INDEXED_FIELDS = ("step", "language", "flow")
+# Everything a conversation may hold; the pending booking is derived from these
+SESSION_FIELDS = (
+    "step", "flow", "language", "name", "phone", "whatsapp_id", "cruise_date", "cruise_type",
+    "adults_count", "children_count", "infants_count", "booking_id", "total_amount"
+)
+# Low-cardinality values shared by every session instead of copied into each
+SESSION_INTERNED_FIELDS = ("step", "flow", "language")
+
+def session_step_label(session):
+    """Step shown for a session; menu-only sessions report their flow"""
+    return session.get('step') or session.get('flow') or 'unknown'
+
+class Session:
+    """
+    Fixed-field conversation state that reports step/language/flow changes
+    to its store. Reads and writes like the dict it replaced: unset fields
+    are missing keys, created_at/last_activity read back as ISO strings and
+    booking_data is assembled from the booking fields on demand.
+    """
+    __slots__ = SESSION_FIELDS + ("created", "last_active", "_store", "_phone", "_step_since")
+
+    def __init__(self, store, phone, data):
+        for field in SESSION_FIELDS:
+            object.__setattr__(self, field, None)
+        self.created = self.last_active = time.time()
+        self._store = None
+        self._phone = phone
+        self._step_since = time.monotonic()
+        for key, value in data.items():
+            self[key] = value
+        self._store = store
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, key):
+        if key in SESSION_FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if key == 'created_at':
+            return datetime.fromtimestamp(self.created).isoformat()
+        if key == 'last_activity':
+            return datetime.fromtimestamp(self.last_active).isoformat()
+        if key == 'booking_data' and self.booking_id is not None:
+            return self.booking_data()
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        keys = [field for field in SESSION_FIELDS if getattr(self, field) is not None]
+        keys += ['created_at', 'last_activity']
+        if self.booking_id is not None:
+            keys.append('booking_data')
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __setitem__(self, key, value):
+        if key in ('created_at', 'last_activity'):
+            timestamp = datetime.fromisoformat(value).timestamp() if isinstance(value, str) else float(value)
+            setattr(self, 'created' if key == 'created_at' else 'last_active', timestamp)
+            return
+        if key not in SESSION_FIELDS:
+            raise KeyError(f"Unknown session field: {key}")
+        if key in SESSION_INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        store = self._store
+        if store is None or key not in SESSION_INDEXED_FIELDS:
+            setattr(self, key, value)
+            if store is not None:
+                store._account(self._phone, self)
+            return
+        old_step = self.step
+        with store.lock:
+            store._unindex(self._phone, self)
+            setattr(self, key, value)
+            store._index(self._phone, self)
+        store._account(self._phone, self)
+        if key == 'step' and value != old_step:
+            store._step_changed(self, old_step, value, None)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def booking_data(self):
+        """The booking being paid for, in the shape save_booking_to_sheets takes"""
+        return {
+            'booking_id': self.booking_id,
+            'name': self.name,
+            'phone': self.phone,
+            'whatsapp_id': self._phone,
+            'cruise_date': self.cruise_date,
+            'cruise_type': self.cruise_type,
+            'adults_count': self.adults_count,
+            'children_count': self.children_count,
+            'infants_count': self.infants_count,
+            'total_guests': (self.adults_count or 0) + (self.children_count or 0) + (self.infants_count or 0),
+            'total_amount': self.total_amount
+        }
+
+    def nbytes(self):
+        """Approximate memory held by this session (interned values are shared)"""
+        total = sys.getsizeof(self)
+        for field in SESSION_FIELDS:
+            value = getattr(self, field)
+            if value is not None and field not in SESSION_INTERNED_FIELDS:
+                total += sys.getsizeof(value)
+        return total
+
+class SessionStore(dict):
+    """
+    user_sessions mapping that maintains phone sets per step, language and
+    flow, so counts and filtered listings never scan every session
+    """
+
+    # Shared by every tenant's store
+    step_listeners = []
+
+    def __init__(self, tenant_key):
+        super().__init__()
+        self.tenant_key = tenant_key
+        self.lock = threading.RLock()
+        self.indexes = {field: {} for field in SESSION_INDEXED_FIELDS}
+        self.last_sweep = 0.0
+
+    def add_step_listener(self, listener):
+        """Register listener(session, old_step, new_step, seconds_in_old, reason)"""
+        self.step_listeners.append(listener)
+
+    def _step_changed(self, session, old_step, new_step, reason):
+        now = time.monotonic()
+        elapsed = now - session._step_since
+        session._step_since = now
+        for listener in self.step_listeners:
+            try:
+                listener(session, old_step, new_step, elapsed, reason)
+            except Exception as e:
+                logger.error("Session listener %s failed: %s", getattr(listener, "__name__", listener), e)
+
+    def _account(self, phone, session):
+        conversation_memory.set_session((self.tenant_key, phone), session.nbytes() if session is not None else 0)
+
+    def _keys_for(self, session):
+        return {
+            "step": session_step_label(session),
+            "language": session.get('language') or 'unknown',
+            "flow": session.get('flow') or 'unknown'
+        }
+
+    def _index(self, phone, session):
+        for field, value in self._keys_for(session).items():
+            self.indexes[field].setdefault(value, set()).add(phone)
+
+    def _unindex(self, phone, session):
+        for field, value in self._keys_for(session).items():
+            phones = self.indexes[field].get(value)
+            if phones is not None:
+                phones.discard(phone)
+                if not phones:
+                    del self.indexes[field][value]
+
+    def __setitem__(self, phone, data):
+        with self.lock:
+            if phone in self:
+                self._detach(phone, "restarted")
+            session = Session(self, phone, data)
+            super().__setitem__(phone, session)
+            self._index(phone, session)
+        self._account(phone, session)
+        conversation_memory.enforce(keep=(self.tenant_key, phone))
+        if session.step:
+            self._step_changed(session, None, session.step, None)
+
+    def _detach(self, phone, reason):
+        session = super().__getitem__(phone)
+        self._unindex(phone, session)
+        session._store = None
+        if session.step:
+            self._step_changed(session, session.step, None, reason)
+        return session
+
+    def __delitem__(self, phone):
+        self.end(phone, "ended")
+
+    def end(self, phone, reason):
+        """Remove a session, recording why the conversation left its step"""
+        with self.lock:
+            if phone not in self:
+                return None
+            session = self._detach(phone, reason)
+            super().__delitem__(phone)
+        self._account(phone, None)
+        return session
+
+    def pop(self, phone, *default):
+        with self.lock:
+            if phone not in self:
+                if default:
+                    return default[0]
+                raise KeyError(phone)
+            return self.end(phone, "ended")
+
+    def touch(self, phone):
+        """Record inbound activity for a conversation"""
+        session = self.get(phone)
+        if session is not None:
+            session.last_active = time.time()
+        conversation_memory.touch((self.tenant_key, phone))
+
+    def counts(self, field):
+        with self.lock:
+            return {value: len(phones) for value, phones in self.indexes[field].items()}
+
+    def phones_matching(self, step=None, language=None):
+        with self.lock:
+            candidates = None
+            for field, value in (("step", step), ("language", language)):
+                if value is None:
+                    continue
+                phones = self.indexes[field].get(value, set())
+                candidates = set(phones) if candidates is None else candidates & phones
+            return list(self) if candidates is None else list(candidates)
+
+    def most_recent(self, phones, count):
+        """The count most recently active (phone, session) pairs among phones, newest first"""
+        with self.lock:
+            sessions = [(phone, self.get(phone)) for phone in phones]
+        return heapq.nlargest(
+            count,
+            ((phone, session) for phone, session in sessions if session is not None),
+            key=lambda item: item[1].last_active
+        )
+
+    def expire_idle(self, force=False):
+        """Drop sessions idle longer than SESSION_IDLE_TIMEOUT (at most once a minute)"""
+        now = time.time()
+        if not force and now - self.last_sweep < SESSION_EXPIRY_SWEEP_INTERVAL:
+            return []
+        self.last_sweep = now
+        cutoff = now - SESSION_IDLE_TIMEOUT
+        with self.lock:
+            expired = [phone for phone, session in self.items() if session.last_active < cutoff]
+            for phone in expired:
+                self.end(phone, "expired")
+        return expired
+
+    def to_dict(self):
+        with self.lock:
+            return {phone: session.to_dict() for phone, session in self.items()}
+
+user_sessions = TenantScoped("sessions")
+
+def session_projection(phone, session, now):
+    """Compact per-session view for dashboard listings"""
+    return {
+        "phone": phone,
+        "step": session_step_label(session),
+        "flow": session.get('flow'),
+        "language": session.get('language'),
+        "name": session.get('name'),
+        "cruise_type": session.get('cruise_type'),
+        "age_seconds": int(now.timestamp() - session.created),
+        "last_activity": session['last_activity']
+    }
+
+# ==============================
+# CHAT MESSAGE STORAGE
+# ==============================
+chat_messages = TenantScoped("chat_messages")
+# Customer messages not yet seen/answered by an admin, per conversation
+chat_unread = TenantScoped("chat_unread")
+
+# ==============================
+# CHAT SEARCH INDEX
+# ==============================
+# Postings (term, message pairs) the index may hold per tenant; past it the
+# oldest messages stop being searchable, though they stay in chat history.
+CHAT_SEARCH_MAX_POSTINGS = int(os.environ.get("CHAT_SEARCH_MAX_POSTINGS", 200000))
+CHAT_SEARCH_MAX_QUERY_TERMS = 8
+# Vocabulary terms one query term may expand to as a prefix
+CHAT_SEARCH_PREFIX_EXPANSIONS = 50
+CHAT_SEARCH_PREFIX_WEIGHT = 0.7
+CHAT_SEARCH_MESSAGE_HITS = 3
+
+# Letters written several ways in Arabic chat, folded to one form
+ARABIC_LETTER_FOLDS = str.maketrans({
+    "آ": "ا", "أ": "ا", "إ": "ا", "ٱ": "ا",  # alef variants
+    "ى": "ي",  # alef maqsura -> yeh
+    "ة": "ه",  # teh marbuta -> heh
+    "ؤ": "و",  # waw with hamza -> waw
+    "ئ": "ي",  # yeh with hamza -> yeh
+    "ـ": None,      # tatweel
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)}
+})
+SEARCH_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+def normalize_search_text(text):
+    """Case-fold and strip diacritics, harakat, tatweel and Arabic letter variants"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.translate(ARABIC_LETTER_FOLDS).casefold()
+
+def search_terms(text):
+    """Normalized tokens of a message or query"""
+    return [token for token in SEARCH_TOKEN_PATTERN.findall(normalize_search_text(text))
+            if len(token) > 1 or token.isdigit()]
+
+class ChatSearchIndex:
+    """
+    Inverted index over one tenant's chat messages, updated as messages are
+    stored, trimmed and evicted. Every message is a document; postings map
+    term -> {doc: count} and a sorted vocabulary serves prefix matches.
+    """
+
+    def __init__(self, max_postings=CHAT_SEARCH_MAX_POSTINGS):
+        self.max_postings = max_postings
+        self.postings = {}
+        self.vocabulary = []
+        # doc -> (phone, message, {term: count}), oldest first
+        self.docs = OrderedDict()
+        # phone -> its docs in message order
+        self.conversations = {}
+        self.posting_count = 0
+        self.next_doc = 1
+        self.lock = threading.Lock()
+        self.stats = {"indexed": 0, "trimmed": 0, "evicted": 0, "searches": 0}
+
+    def add(self, phone, message_data):
+        counts = {}
+        for term in search_terms(message_data.get("message")):
+            counts[term] = counts.get(term, 0) + 1
+        with self.lock:
+            doc = self.next_doc
+            self.next_doc += 1
+            self.docs[doc] = (phone, message_data, counts)
+            self.conversations.setdefault(phone, deque()).append(doc)
+            for term, count in counts.items():
+                docs = self.postings.get(term)
+                if docs is None:
+                    docs = self.postings[term] = {}
+                    bisect.insort(self.vocabulary, term)
+                docs[doc] = count
+            self.posting_count += len(counts)
+            self.stats["indexed"] += 1
+            # The oldest doc overall is always the oldest of its conversation
+            while self.posting_count > self.max_postings and len(self.docs) > 1:
+                self._pop_oldest(self.docs[next(iter(self.docs))][0])
+                self.stats["evicted"] += 1
+
+    def trim(self, phone, dropped):
+        """Forget messages cut from the front of a conversation's history"""
+        dropped_ids = {id(message_data) for message_data in dropped}
+        with self.lock:
+            docs = self.conversations.get(phone)
+            while docs and id(self.docs[docs[0]][1]) in dropped_ids:
+                self._pop_oldest(phone)
+                self.stats["trimmed"] += 1
+
+    def drop(self, phone):
+        """Forget a whole conversation"""
+        with self.lock:
+            while phone in self.conversations:
+                self._pop_oldest(phone)
+                self.stats["trimmed"] += 1
+
+    def _pop_oldest(self, phone):
+        docs = self.conversations[phone]
+        doc = docs.popleft()
+        if not docs:
+            del self.conversations[phone]
+        _, _, counts = self.docs.pop(doc)
+        for term in counts:
+            postings = self.postings[term]
+            del postings[doc]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        self.posting_count -= len(counts)
+
+    def _matches(self, term):
+        """{doc: weighted count} for a query term, exact or as a prefix"""
+        matches = {doc: float(count) for doc, count in self.postings.get(term, {}).items()}
+        if len(term) < 3:
+            return matches
+        start = bisect.bisect_right(self.vocabulary, term)
+        for word in itertools.islice(self.vocabulary, start, start + CHAT_SEARCH_PREFIX_EXPANSIONS):
+            if not word.startswith(term):
+                break
+            for doc, count in self.postings[word].items():
+                matches[doc] = max(matches.get(doc, 0.0), count * CHAT_SEARCH_PREFIX_WEIGHT)
+        return matches
+
+    def search(self, query, limit=20):
+        """
+        Conversations ranked by how many query terms they contain, then by
+        tf-idf of their best messages; each with its best message hits.
+        """
+        terms = list(dict.fromkeys(search_terms(query)))[:CHAT_SEARCH_MAX_QUERY_TERMS]
+        found = {}
+        with self.lock:
+            self.stats["searches"] += 1
+            total_docs = len(self.docs)
+            for term in terms:
+                matches = self._matches(term)
+                if not matches:
+                    continue
+                idf = math.log(1 + total_docs / len(matches))
+                for doc, count in matches.items():
+                    phone, message_data, _ = self.docs[doc]
+                    conversation = found.setdefault(phone, {"terms": set(), "docs": {}})
+                    conversation["terms"].add(term)
+                    score = conversation["docs"].get(doc, (0.0, message_data))[0]
+                    conversation["docs"][doc] = (score + idf * (1 + math.log(count)), message_data)
+
+        ranked = []
+        for phone, conversation in found.items():
+            hits = sorted(conversation["docs"].items(), key=lambda item: (item[1][0], item[0]), reverse=True)
+            score = sum(hit_score for _, (hit_score, _) in hits[:CHAT_SEARCH_MESSAGE_HITS])
+            ranked.append((len(conversation["terms"]), score, hits[0][0], phone, conversation, hits))
+        ranked.sort(key=lambda item: item[:3], reverse=True)
+
+        return terms, len(ranked), [{
+            "phone_number": phone,
+            "score": round(score, 3),
+            "matched_terms": sorted(conversation["terms"]),
+            "matching_messages": len(hits),
+            "hits": [dict(message_data, score=round(hit_score, 3))
+                     for _, (hit_score, message_data) in hits[:CHAT_SEARCH_MESSAGE_HITS]]
+        } for _, score, _, phone, conversation, hits in ranked[:limit]]
+
+    def status(self):
+        with self.lock:
+            return dict(
+                self.stats,
+                messages=len(self.docs),
+                conversations=len(self.conversations),
+                terms=len(self.postings),
+                postings=self.posting_count,
+                max_postings=self.max_postings
+            )
+
+chat_search = TenantScoped("chat_index")
 
 # ==============================
-# CHAT MESSAGE STORAGE
+# CONVERSATION MEMORY BUDGET
 # ==============================
-chat_messages = {}
+# Sessions and chat history together may use at most this much memory;
+# beyond it the least recently active conversations are dropped first.
+CONVERSATION_MEMORY_BUDGET_MB = float(os.environ.get("CONVERSATION_MEMORY_BUDGET_MB", 64))
+# Bookkeeping per tracked conversation (map entries, lists, keys)
+CONVERSATION_OVERHEAD_BYTES = 400
+
+def chat_message_nbytes(message_data):
+    """Approximate memory held by one stored chat message"""
+    return sys.getsizeof(message_data) + sum(sys.getsizeof(value) for value in message_data.values())
+
+class ConversationMemory:
+    """
+    Approximate bytes held per conversation (session + chat history), kept
+    in least-recently-active order so evictions drop stale conversations.
+    One budget is shared by all tenants; conversations are (tenant key, phone).
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        # (tenant key, phone) -> [session_bytes, chat_bytes]
+        self.usage = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.stats = {"evicted_conversations": 0, "evicted_bytes": 0}
+
+    def _entry(self, phone):
+        entry = self.usage.get(phone)
+        if entry is None:
+            entry = self.usage[phone] = [0, 0]
+            self.total += CONVERSATION_OVERHEAD_BYTES
+        return entry
+
+    def _drop_if_empty(self, phone, entry):
+        if entry[0] <= 0 and entry[1] <= 0:
+            del self.usage[phone]
+            self.total -= CONVERSATION_OVERHEAD_BYTES + entry[0] + entry[1]
+
+    def set_session(self, phone, nbytes):
+        with self.lock:
+            if nbytes == 0 and phone not in self.usage:
+                return
+            entry = self._entry(phone)
+            self.total += nbytes - entry[0]
+            entry[0] = nbytes
+            self._drop_if_empty(phone, entry)
+
+    def add_chat(self, phone, delta):
+        with self.lock:
+            if delta <= 0 and phone not in self.usage:
+                return
+            entry = self._entry(phone)
+            self.total += delta
+            entry[1] += delta
+            self.usage.move_to_end(phone)
+            self._drop_if_empty(phone, entry)
+
+    def touch(self, phone):
+        with self.lock:
+            if phone in self.usage:
+                self.usage.move_to_end(phone)
+
+    def enforce(self, keep=None):
+        """Evict least recently active conversations until under budget"""
+        victims = []
+        with self.lock:
+            for phone in list(self.usage):
+                if self.total <= self.budget:
+                    break
+                if phone == keep:
+                    continue
+                entry = self.usage.pop(phone)
+                freed = CONVERSATION_OVERHEAD_BYTES + entry[0] + entry[1]
+                self.total -= freed
+                self.stats["evicted_conversations"] += 1
+                self.stats["evicted_bytes"] += freed
+                victims.append(phone)
+        # Tear down outside our lock; ending a session reports back to us
+        for tenant_key, phone in victims:
+            tenant = tenants.get(tenant_key)
+            tenant.sessions.end(phone, "evicted")
+            tenant.chat_messages.pop(phone, None)
+            tenant.chat_unread.pop(phone, None)
+            tenant.chat_index.drop(phone)
+        if victims:
+            logger.info("🧹 Memory budget: evicted %s idle conversations", len(victims),
+                           extra={"category": "memory"})
+        return victims
+
+    def tenant_usage(self):
+        """Bytes and conversations per tenant"""
+        usage = {}
+        with self.lock:
+            for (tenant_key, _), entry in self.usage.items():
+                tenant = usage.setdefault(tenant_key, {"bytes": 0, "conversations": 0})
+                tenant["bytes"] += CONVERSATION_OVERHEAD_BYTES + entry[0] + entry[1]
+                tenant["conversations"] += 1
+        return usage
+
+    def status(self):
+        by_tenant = self.tenant_usage()
+        with self.lock:
+            session_bytes = sum(entry[0] for entry in self.usage.values())
+            chat_bytes = sum(entry[1] for entry in self.usage.values())
+            return dict(
+                self.stats,
+                budget_bytes=int(self.budget),
+                bytes_in_use=self.total,
+                session_bytes=session_bytes,
+                chat_bytes=chat_bytes,
+                conversations=len(self.usage),
+                utilization_percentage=round(self.total / self.budget * 100, 2) if self.budget else None,
+                by_tenant=by_tenant
+            )
+
+conversation_memory = ConversationMemory(CONVERSATION_MEMORY_BUDGET_MB * 1024 * 1024)
 
 # ==============================
 # CRUISE CONFIGURATION
 # ==============================
-CRUISE_CONFIG = {
+BASE_CRUISE_CONFIG = {
     "max_capacity": 135,
     "cruise_types": {
         "morning": {
@@ -157,6 +2613,9 @@ CRUISE_CONFIG = {
     "reporting_time": "1 hour before cruise"
 }
 
+tenants.load(TENANTS_CONFIG)
+CRUISE_CONFIG = TenantScoped("cruise_config")
+
 # ==============================
 # MESSAGES
 # ==============================
@@ -176,7 +2635,9 @@ MESSAGES = {
         "payment_confirmed": "🎉 *Booking Confirmed!* ✅\n\nThank you {}! Your cruise has been booked successfully. 🚢\n\n📋 *Booking Details:*\n🆔 Booking ID: {}\n👤 Name: {}\n📞 Phone: {}\n📅 Date: {}\n🕒 Time: {}\n🚢 Cruise Type: {}\n👥 Guests: {} total\n   • {} adults\n   • {} children\n   • {} infants\n💰 Amount: {} OMR\n💳 Payment: Simulated (Test Mode)\n\n⏰ *Reporting Time:* 1 hour before cruise\n📍 *Location:* {}\n📞 *For inquiries:* {} | {}\n\nWe wish you a wonderful cruise experience! 🌊",
         "booking_cancelled": "❌ Booking cancelled. We welcome you anytime! 🌊",
         "invalid_input": "❌ Invalid input. Please try again.",
-        "invalid_date": "❌ Invalid date format. Please use DD/MM/YYYY format only.\n\n*Examples:*\n• 23/11/2024\n• 15/12/2024\n• 01/01/2025"
+        "choose_option": "👆 Please choose one of the options above.",
+        "invalid_date": "❌ Invalid date format. Please use DD/MM/YYYY format only.\n\n*Examples:*\n• 23/11/2024\n• 15/12/2024\n• 01/01/2025",
+        "rate_limited": "⏳ You're sending messages a little too fast. Please wait a moment and try again - we'll be right with you! 🌊"
     },
     "arabic": {
         "welcome": "🌊 مرحباً بكم في رحلات السندباد البحرية!\n\nاختر لغتك المفضلة:",
@@ -193,7 +2654,9 @@ MESSAGES = {
         "payment_confirmed": "🎉 *تم تأكيد الحجز!* ✅\n\nشكراً {}! تم حجز رحلتك بنجاح. 🚢\n\n📋 *تفاصيل الحجز:*\n🆔 رقم الحجز: {}\n👤 الاسم: {}\n📞 الهاتف: {}\n📅 التاريخ: {}\n🕒 الوقت: {}\n🚢 نوع الرحلة: {}\n👥 الضيوف: {} إجمالاً\n   • {} بالغين\n   • {} أطفال\n   • {} رضع\n💰 المبلغ: {} ريال عماني\n💳 الدفع: محاكاة (وضع الاختبار)\n\n⏰ *وقت الحضور:* ساعة قبل الرحلة\n📍 *موقعنا:* {}\n📞 *للاستفسار:* {} | {}\n\nنتمنى لكم رحلة بحرية ممتعة! 🌊",
         "booking_cancelled": "❌ تم إلغاء الحجز. نرحب بك في أي وقت! 🌊",
         "invalid_input": "❌ إدخال غير صالح. يرجى المحاولة مرة أخرى.",
-        "invalid_date": "❌ تنسيق تاريخ غير صالح. يرجى استخدام صيغة DD/MM/YYYY فقط.\n\n*أمثلة:*\n• 23/11/2024\n• 15/12/2024\n• 01/01/2025"
+        "choose_option": "👆 الرجاء اختيار أحد الخيارات أعلاه.",
+        "invalid_date": "❌ تنسيق تاريخ غير صالح. يرجى استخدام صيغة DD/MM/YYYY فقط.\n\n*أمثلة:*\n• 23/11/2024\n• 15/12/2024\n• 01/01/2025",
+        "rate_limited": "⏳ أنت ترسل الرسائل بسرعة كبيرة. يرجى الانتظار قليلاً ثم المحاولة مرة أخرى 🌊"
     }
 }
 
@@ -270,83 +2733,116 @@ def generate_booking_id():
     """Generate unique booking ID"""
     return f"SDB{int(time.time())}"
 
-def clean_phone_number(number):
-    """Clean and validate phone numbers for WhatsApp API"""
-    if not number:
-        return None
-    
+PHONE_CACHE_SIZE = int(os.environ.get("PHONE_CACHE_SIZE", 4096))
+
+@functools.lru_cache(maxsize=PHONE_CACHE_SIZE)
+def _normalize_phone(number):
+    """
+    Normalize a phone number string for WhatsApp API
+    Returns: (whatsapp_id, rejection_reason)
+    """
     # Remove all non-digit characters
-    clean_number = ''.join(filter(str.isdigit, str(number)))
+    clean_number = ''.join(filter(str.isdigit, number))
     
     if not clean_number:
-        return None
+        return None, "no_digits"
     
     # Remove any leading zeros
     clean_number = clean_number.lstrip('0')
     
-    logger.info(f"🔍 Cleaning phone number: {number} -> {clean_number} (length: {len(clean_number)})")
+    logger.debug("🔍 Cleaning phone number: %s -> %s (length: %d)", number, clean_number, len(clean_number),
+                 extra={"category": "phone"})
     
     # Case 1: Already in correct format (968XXXXXXXXX)
     if len(clean_number) == 12 and clean_number.startswith('968'):
-        logger.info(f"✅ Already in correct format: {clean_number}")
-        return clean_number
+        logger.debug("✅ Already in correct format: %s", clean_number, extra={"category": "phone"})
+        return clean_number, None
     
     # Case 2: 8-digit Oman number (e.g., 78505509, 91234567)
     elif len(clean_number) == 8 and clean_number.startswith(('7', '9', '8')):
         formatted = '968' + clean_number
-        logger.info(f"✅ Converted 8-digit Oman number: {clean_number} -> {formatted}")
-        return formatted
+        logger.debug("✅ Converted 8-digit Oman number: %s -> %s", clean_number, formatted,
+                     extra={"category": "phone"})
+        return formatted, None
     
     # Case 3: 9-digit number starting with 9
     elif len(clean_number) == 9 and clean_number.startswith('9'):
         formatted = '968' + clean_number
-        logger.info(f"✅ Converted 9-digit number: {clean_number} -> {formatted}")
-        return formatted
+        logger.debug("✅ Converted 9-digit number: %s -> %s", clean_number, formatted,
+                     extra={"category": "phone"})
+        return formatted, None
     
     # Case 4: Number already starts with 968 but has different length
     elif clean_number.startswith('968'):
         if len(clean_number) > 12:
             formatted = clean_number[:12]
-            logger.info(f"✅ Trimmed long number: {clean_number} -> {formatted}")
-            return formatted
+            logger.debug("✅ Trimmed long number: %s -> %s", clean_number, formatted,
+                         extra={"category": "phone"})
+            return formatted, None
         else:
-            logger.info(f"✅ Using as-is with 968 prefix: {clean_number}")
-            return clean_number
-    
-    # Case 5: Handle numbers that might have country code but wrong format
-    elif len(clean_number) == 11 and clean_number.startswith('968'):
-        if len(clean_number[3:]) == 8:
-            formatted = '968' + clean_number[3:]
-            logger.info(f"✅ Fixed 11-digit number: {clean_number} -> {formatted}")
-            return formatted
+            logger.debug("✅ Using as-is with 968 prefix: %s", clean_number, extra={"category": "phone"})
+            return clean_number, None
     
-    logger.warning(f"⚠️ Unrecognized phone format: {number} (cleaned: {clean_number}, length: {len(clean_number)})")
+    logger.warning("⚠️ Unrecognized phone format: %s (cleaned: %s, length: %d)", number, clean_number,
+                   len(clean_number), extra={"category": "phone"})
     
     # Final fallback: if it's a number that looks like it could work, try it
     if len(clean_number) >= 8 and len(clean_number) <= 15:
-        logger.info(f"🔄 Using fallback for: {clean_number}")
-        return clean_number
+        logger.debug("🔄 Using fallback for: %s", clean_number, extra={"category": "phone"})
+        return clean_number, None
     
-    return None
+    return None, "too_short" if len(clean_number) < 8 else "too_long"
+
+def clean_phone_number(number):
+    """Clean and validate phone numbers for WhatsApp API (memoized)"""
+    if not number:
+        return None
+    return _normalize_phone(str(number).strip())[0]
+
+def normalize_phone_numbers(numbers):
+    """
+    Normalize a batch of raw phone numbers (e.g. a sheet column) in one pass
+    Returns: dict with deduplicated WhatsApp IDs, rejected inputs and stats
+    """
+    unique = {}
+    rejected = []
+    duplicates = 0
+    
+    for number in numbers:
+        raw = str(number).strip() if number is not None else ""
+        if not raw:
+            rejected.append({"input": number, "reason": "empty"})
+            continue
+        
+        normalized, reason = _normalize_phone(raw)
+        if normalized is None:
+            rejected.append({"input": number, "reason": reason})
+        elif normalized in unique:
+            duplicates += 1
+        else:
+            unique[normalized] = None
+    
+    valid = len(unique) + duplicates
+    return {
+        "normalized": list(unique),
+        "rejected": rejected,
+        "stats": {
+            "total": valid + len(rejected),
+            "valid": valid,
+            "unique": len(unique),
+            "duplicates": duplicates,
+            "rejected": len(rejected)
+        }
+    }
 
+@traced("get_cruise_capacity")
 def get_cruise_capacity(date, cruise_type):
     """Get current capacity for a specific cruise"""
     try:
-        if not sheet:
+        if not booking_store.available():
             return 0
-            
-        records = sheet.get_all_records()
-        total_guests = 0
-        
-        for record in records:
-            record_date = record.get('Cruise Date', '')
-            # Handle both DD/MM/YYYY and other formats in existing data
-            if str(record_date).strip() == str(date).strip() and \
-               str(record.get('Cruise Type', '')).strip() == str(cruise_type).strip() and \
-               str(record.get('Booking Status', '')).strip().lower() != 'cancelled':
-                total_guests += int(record.get('Total Guests', 0))
         
-        return total_guests
+        return booking_store.capacity(str(date).strip(), str(cruise_type).strip())
     except Exception as e:
         logger.error(f"Error getting capacity: {str(e)}")
         return 0
@@ -357,20 +2853,86 @@ def calculate_total_amount(cruise_type, adults, children, infants):
     total = (adults * config["price_adult"]) + (children * config["price_child"])
     return round(total, 3)
 
+# ==============================
+# OUTBOUND CALL BUDGET
+# ==============================
+# Each inbound webhook event is one conversation turn; every Graph API send
+# made while handling it is charged to that turn.
+OUTBOUND_CALL_BUDGET = int(os.environ.get("OUTBOUND_CALL_BUDGET", 2))
+# Report-only by default: over-budget sends are logged and counted but still made
+OUTBOUND_BUDGET_ENFORCED = os.environ.get("OUTBOUND_BUDGET_ENFORCED", "false").lower() in ("1", "true", "yes")
+WHATSAPP_INTERACTIVE_BODY_LIMIT = 1024
+
+_outbound_turn = contextvars.ContextVar("outbound_turn", default=None)
+_outbound_turn_ids = itertools.count(1)
+outbound_stats_lock = threading.Lock()
+outbound_stats = {
+    "turns": 0,
+    "calls": 0,
+    "over_budget_turns": 0,
+    "suppressed_calls": 0,
+    "calls_per_turn": {}
+}
+
+@contextmanager
+def outbound_turn(phone_number):
+    """Count the outbound API calls made while handling one inbound event"""
+    turn = {"id": next(_outbound_turn_ids), "phone": phone_number, "calls": 0, "suppressed": 0}
+    token = _outbound_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _outbound_turn.reset(token)
+        with outbound_stats_lock:
+            outbound_stats["turns"] += 1
+            outbound_stats["calls"] += turn["calls"]
+            bucket = str(turn["calls"])
+            outbound_stats["calls_per_turn"][bucket] = outbound_stats["calls_per_turn"].get(bucket, 0) + 1
+            if turn["calls"] + turn["suppressed"] > OUTBOUND_CALL_BUDGET:
+                outbound_stats["over_budget_turns"] += 1
+            outbound_stats["suppressed_calls"] += turn["suppressed"]
+
+def charge_outbound_call(description):
+    """Charge one send to the current turn; False if the budget forbids it"""
+    turn = _outbound_turn.get()
+    if turn is None:
+        return True
+    if turn["calls"] >= OUTBOUND_CALL_BUDGET:
+        if OUTBOUND_BUDGET_ENFORCED:
+            turn["suppressed"] += 1
+            logger.warning("🚫 Outbound call budget (%d) exceeded in turn %d for %s: suppressed %s",
+                           OUTBOUND_CALL_BUDGET, turn["id"], turn["phone"], description,
+                           extra={"category": "outbound"})
+            return False
+        logger.warning("⚠️ Outbound call budget (%d) exceeded in turn %d for %s: sending %s anyway",
+                       OUTBOUND_CALL_BUDGET, turn["id"], turn["phone"], description,
+                       extra={"category": "outbound"})
+    turn["calls"] += 1
+    return True
+
+def compose_interactive_body(info_text, prompt):
+    """Prepend informational text to an interactive body if it fits in one message"""
+    body = f"{info_text}\n\n{prompt}"
+    if len(body) > WHATSAPP_INTERACTIVE_BODY_LIMIT:
+        return None
+    return body
+
+@traced("send_whatsapp_message")
 def send_whatsapp_message(to, message, interactive_data=None):
-    """Send WhatsApp message via Meta API"""
+    """Send WhatsApp message via Meta API (through the outbox when enabled)"""
     try:
+        if interactive_data:
+            description = f"interactive {interactive_data.get('type', '')} message"
+        else:
+            description = f"text message ({len(str(message))} chars)"
+        if not charge_outbound_call(description):
+            return False
+        
         clean_to = clean_phone_number(to)
         if not clean_to:
-            logger.error(f"❌ Invalid phone number: {to}")
+            logger.error("❌ Invalid phone number: %s", to, extra={"category": "outbound"})
             return False
         
-        url = f"https://graph.facebook.com/v17.0/{WHATSAPP_PHONE_ID}/messages"
-        headers = {
-            "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
         if interactive_data:
             payload = {
                 "messaging_product": "whatsapp",
@@ -386,27 +2948,66 @@ def send_whatsapp_message(to, message, interactive_data=None):
                 "text": {"body": message}
             }
 
-        logger.info(f"📤 Sending message to {clean_to}")
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response_data = response.json()
+        sender_id = tenants.current().phone_number_id
+        if OUTBOX_ENABLED:
+            try:
+                outbox.enqueue(clean_to, payload, sender_id)
+                return True
+            except sqlite3.Error as e:
+                logger.error("❌ Outbox unavailable, sending inline: %s", e, extra={"category": "outbound"})
         
-        if response.status_code == 200:
-            logger.info(f"✅ Message sent to {clean_to}")
-            return True
-        else:
-            error_msg = response_data.get('error', {}).get('message', 'Unknown error')
-            logger.error(f"❌ WhatsApp API error: {error_msg}")
+        # Without the outbox this runs on the request thread, which must never sleep for a slot
+        if not outbound_pacer.acquire(blocking=False):
+            logger.warning("🐢 Outbound send rate reached; not sending %s to %s", description, clean_to,
+                           extra={"category": "outbound"})
             return False
+        return post_whatsapp_message(payload, sender_id)[0]
         
     except Exception as e:
-        logger.error(f"🚨 Failed to send message: {str(e)}")
+        logger.error("🚨 Failed to send message: %s", e, extra={"category": "outbound"})
         return False
 
+@traced("graph.send_message", SPAN_KIND_CLIENT)
+def post_whatsapp_message(payload, sender_id=None):
+    """POST one message to the Graph API; returns (sent, retryable, error)"""
+    tenant = tenants.for_phone_number_id(sender_id)
+    if tenant is None:
+        # A queued message from a number that is no longer configured
+        logger.error("🚨 No tenant sends from phone_number_id %s", sender_id, extra={"category": "outbound"})
+        return False, False, "unknown sender"
+    url = f"{GRAPH_API_URL}/{tenant.phone_number_id}/messages"
+    headers = {
+        "Authorization": f"Bearer {tenant.access_token}",
+        "Content-Type": "application/json"
+    }
+    logger.debug("📤 Sending message to %s", payload["to"], extra={"category": "outbound"})
+    
+    try:
+        response = graph_session.post(url, headers=headers, json=payload, timeout=GRAPH_API_TIMEOUT)
+        response_data = response.json()
+    except Exception as e:
+        logger.error("🚨 Failed to send message: %s", e, extra={"category": "outbound"})
+        return False, True, str(e)
+    
+    if response.status_code == 200:
+        logger.info("✅ Message sent to %s", payload["to"], extra={"category": "outbound"})
+        for sent_message in response_data.get("messages", []):
+            delivery_tracker.record_sent(sent_message.get("id", ""))
+        return True, False, None
+    
+    error = response_data.get('error', {})
+    error_code = _as_int(error.get('code'))
+    error_msg = error.get('message', 'Unknown error')
+    outbound_pacer.observe(failed=1, error_codes=[error_code])
+    logger.error("❌ WhatsApp API error: %s", error_msg,
+                 extra={"category": "outbound", "status_code": response.status_code})
+    retryable = response.status_code == 429 or response.status_code >= 500 or error_code in THROTTLE_ERROR_CODES
+    return False, retryable, f"{response.status_code} {error_code}: {error_msg}"
+
 def save_booking_to_sheets(booking_data, language, payment_status="Paid", payment_method="Simulated"):
-    """Save booking to Google Sheets"""
+    """Save booking to the booking store (and through it to Google Sheets)"""
     try:
-        if not sheet:
+        if not booking_store.available():
             logger.error("❌ Google Sheets not available")
             return False
             
@@ -432,16 +3033,17 @@ def save_booking_to_sheets(booking_data, language, payment_status="Paid", paymen
             f"SIM_{int(time.time())}",
             language.title(),
             'Confirmed',
-            'Via WhatsApp Bot - Test Mode'
+            'Via WhatsApp Bot - Test Mode',
+            tenants.current().key
         ]
         
-        logger.info(f"💾 Saving to sheets: {booking_data['booking_id']}")
-        sheet.append_row(row_data)
-        logger.info(f"✅ Booking saved: {booking_data['booking_id']}")
+        logger.info("💾 Saving booking: %s", booking_data['booking_id'])
+        partition = booking_store.save(row_data)
+        logger.info("✅ Booking saved: %s (%s)", booking_data['booking_id'], partition)
         return True
         
     except Exception as e:
-        logger.error(f"❌ Failed to save booking: {str(e)}")
+        logger.error("❌ Failed to save booking: %s", e)
         return False
 
 # ==============================
@@ -454,8 +3056,10 @@ def store_chat_message(phone_number, message, sender, message_type="text"):
         if phone_number not in chat_messages:
             chat_messages[phone_number] = []
         
+        # Ids keep counting past the trim below so search hits stay unambiguous
+        history = chat_messages[phone_number]
         message_data = {
-            "id": len(chat_messages[phone_number]) + 1,
+            "id": history[-1]["id"] + 1 if history else 1,
             "message": message,
             "sender": sender,  # "user" or "admin"
             "timestamp": datetime.now().isoformat(),
@@ -463,50 +3067,1249 @@ def store_chat_message(phone_number, message, sender, message_type="text"):
         }
         
         chat_messages[phone_number].append(message_data)
+        chat_search.add(phone_number, message_data)
+        if sender == "user":
+            chat_unread[phone_number] = chat_unread.get(phone_number, 0) + 1
+        else:
+            chat_unread.pop(phone_number, None)
+        bump_data_version("chat")
         
         # Keep only last 100 messages per user to prevent memory issues
+        added_bytes = chat_message_nbytes(message_data)
         if len(chat_messages[phone_number]) > 100:
+            dropped = chat_messages[phone_number][:-100]
             chat_messages[phone_number] = chat_messages[phone_number][-100:]
+            chat_search.trim(phone_number, dropped)
+            added_bytes -= sum(chat_message_nbytes(old) for old in dropped)
+        conversation = (tenants.current().key, phone_number)
+        conversation_memory.add_chat(conversation, added_bytes)
+        conversation_memory.enforce(keep=conversation)
         
-        logger.info(f"💬 Stored {sender} message for {phone_number}: {message[:50]}...")
+        logger.debug("💬 Stored %s message for %s: %.50s...", sender, phone_number, message,
+                     extra={"category": "chat"})
         return True
         
     except Exception as e:
-        logger.error(f"Error storing chat message: {str(e)}")
+        logger.error("Error storing chat message: %s", e, extra={"category": "chat"})
+        return False
+
+def get_chat_history(phone_number, limit=50):
+    """Get chat history for a user"""
+    try:
+        if phone_number not in chat_messages:
+            return []
+        
+        messages = chat_messages[phone_number][-limit:]
+        return messages
+        
+    except Exception as e:
+        logger.error(f"Error getting chat history: {str(e)}")
+        return []
+
+def send_admin_chat_message(phone_number, message):
+    """Send message from admin to user via WhatsApp and store it"""
+    try:
+        # Store the admin message
+        store_chat_message(phone_number, message, "admin")
+        
+        # Send via WhatsApp API
+        success = send_whatsapp_message(phone_number, message)
+        
+        if success:
+            logger.info(f"✅ Admin message sent to {phone_number}")
+            return True
+        else:
+            logger.error(f"❌ Failed to send admin message to {phone_number}")
+            return False
+            
+    except Exception as e:
+        logger.error(f"Error sending admin chat message: {str(e)}")
         return False
 
-def get_chat_history(phone_number, limit=50):
-    """Get chat history for a user"""
-    try:
-        if phone_number not in chat_messages:
-            return []
-        
-        messages = chat_messages[phone_number][-limit:]
-        return messages
-        
-    except Exception as e:
-        logger.error(f"Error getting chat history: {str(e)}")
-        return []
+# ==============================
+# DASHBOARD AGGREGATES
+# ==============================
+
+class BookingAggregates:
+    """Per cruise date booking counts, revenue and slot occupancy, kept incrementally"""
+
+    def __init__(self):
+        # tenant key -> cruise date -> day stats
+        self.by_vessel = {}
+        self.parsed_dates = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _contribution(record):
+        status = str(record.get('Booking Status', '')).strip()
+        try:
+            amount = float(record.get('Total Amount') or 0)
+        except (TypeError, ValueError):
+            amount = 0.0
+        try:
+            guests = int(record.get('Total Guests') or 0)
+        except (TypeError, ValueError):
+            guests = 0
+        confirmed = status == 'Confirmed'
+        return {
+            "vessel": booking_tenant_key(record),
+            "date": str(record.get('Cruise Date', '')).strip(),
+            "slot": str(record.get('Cruise Type', '')).strip(),
+            "confirmed": 1 if confirmed else 0,
+            "revenue": amount if confirmed else 0.0,
+            # Same rule as get_cruise_capacity: cancelled bookings free their seats
+            "guests": guests if status.lower() != 'cancelled' else 0
+        }
+
+    def _add(self, record, sign):
+        c = self._contribution(record)
+        by_date = self.by_vessel.setdefault(c["vessel"], {})
+        day = by_date.setdefault(c["date"], {
+            "bookings": 0, "confirmed": 0, "revenue": 0.0, "guests": 0, "slots": {}
+        })
+        day["bookings"] += sign
+        day["confirmed"] += sign * c["confirmed"]
+        day["revenue"] += sign * c["revenue"]
+        day["guests"] += sign * c["guests"]
+        day["slots"][c["slot"]] = day["slots"].get(c["slot"], 0) + sign * c["guests"]
+        if day["bookings"] <= 0:
+            del by_date[c["date"]]
+
+    def apply(self, op, row_number, record, previous):
+        with self.lock:
+            if previous is not None:
+                self._add(previous, -1)
+            if op != "delete":
+                self._add(record, 1)
+
+    def _parse_date(self, value):
+        if value not in self.parsed_dates:
+            try:
+                self.parsed_dates[value] = datetime.strptime(value, "%d/%m/%Y").date()
+            except ValueError:
+                self.parsed_dates[value] = None
+        return self.parsed_dates[value]
+
+    def summary(self, today, vessel):
+        """Totals for one vessel's today, upcoming dates and all time"""
+        today_key = today.strftime("%d/%m/%Y")
+        with self.lock:
+            by_date = self.by_vessel.get(vessel, {})
+            day = by_date.get(today_key, {
+                "bookings": 0, "confirmed": 0, "revenue": 0.0, "guests": 0, "slots": {}
+            })
+            today_stats = {
+                "date": today_key,
+                "bookings": day["bookings"],
+                "confirmed": day["confirmed"],
+                "revenue": round(day["revenue"], 3),
+                "guests": day["guests"],
+                "slots": dict(day["slots"])
+            }
+            upcoming = {"bookings": 0, "confirmed": 0, "guests": 0, "revenue": 0.0, "dates": 0}
+            totals = {"bookings": 0, "confirmed": 0, "revenue": 0.0}
+            for date_key, stats in by_date.items():
+                totals["bookings"] += stats["bookings"]
+                totals["confirmed"] += stats["confirmed"]
+                totals["revenue"] += stats["revenue"]
+                cruise_date = self._parse_date(date_key)
+                if cruise_date and cruise_date > today:
+                    upcoming["bookings"] += stats["bookings"]
+                    upcoming["confirmed"] += stats["confirmed"]
+                    upcoming["guests"] += stats["guests"]
+                    upcoming["revenue"] += stats["revenue"]
+                    upcoming["dates"] += 1
+        upcoming["revenue"] = round(upcoming["revenue"], 3)
+        totals["revenue"] = round(totals["revenue"], 3)
+        return today_stats, upcoming, totals
+
+booking_aggregates = BookingAggregates()
+register_booking_listener(booking_aggregates.apply)
+
+# ==============================
+# BOOKING FUNNEL METRICS
+# ==============================
+FUNNEL_STEPS = [
+    'awaiting_name', 'awaiting_phone', 'awaiting_date', 'awaiting_adults',
+    'awaiting_children', 'awaiting_infants', 'awaiting_cruise_type', 'awaiting_payment', 'completed'
+]
+# Upper bounds (seconds) of the time-in-step / latency histogram buckets
+FUNNEL_HISTOGRAM_BOUNDS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+FUNNEL_RETENTION_MINUTES = 24 * 60
+FUNNEL_WINDOWS = {"15m": 15, "1h": 60, "6h": 360, "24h": 24 * 60}
+
+class FunnelMinute:
+    """Counters for one minute of funnel activity"""
+    __slots__ = ("minute", "entered", "exited", "retries", "dropoffs", "durations", "capacity_checks")
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.entered = {}
+        self.exited = {}
+        self.retries = {}
+        self.dropoffs = {}
+        self.durations = {}
+        self.capacity_checks = [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1)
+
+def _histogram_bucket(seconds):
+    return bisect.bisect_left(FUNNEL_HISTOGRAM_BOUNDS, seconds)
+
+def _histogram_summary(counts):
+    """Bucket counts plus percentile estimates (bucket upper bounds)"""
+    total = sum(counts)
+    labels = [f"<={bound}s" for bound in FUNNEL_HISTOGRAM_BOUNDS] + [f">{FUNNEL_HISTOGRAM_BOUNDS[-1]}s"]
+    summary = {"count": total, "buckets": dict(zip(labels, counts))}
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        if not total:
+            summary[name] = None
+            continue
+        running = 0
+        for index, count in enumerate(counts):
+            running += count
+            if running >= total * fraction:
+                summary[name] = labels[index]
+                break
+    return summary
+
+class BookingFunnel:
+    """Rolling per-minute counters of booking step transitions"""
+
+    def __init__(self):
+        self.minutes = deque(maxlen=FUNNEL_RETENTION_MINUTES)
+        self.lock = threading.Lock()
+
+    def _current(self):
+        minute = int(time.time() // 60)
+        if not self.minutes or self.minutes[-1].minute != minute:
+            self.minutes.append(FunnelMinute(minute))
+        return self.minutes[-1]
+
+    @staticmethod
+    def _bump(counter, key, amount=1):
+        counter[key] = counter.get(key, 0) + amount
+
+    def on_step_change(self, session, old_step, new_step, seconds_in_old, reason):
+        language = session.get('language') or 'unknown'
+        with self.lock:
+            bucket = self._current()
+            if old_step in FUNNEL_STEPS:
+                self._bump(bucket.exited, (old_step, language))
+                histogram = bucket.durations.setdefault(old_step, [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1))
+                histogram[_histogram_bucket(seconds_in_old)] += 1
+                if new_step is None and old_step != 'completed':
+                    self._bump(bucket.dropoffs, (old_step, language, reason or "ended"))
+            if new_step in FUNNEL_STEPS:
+                self._bump(bucket.entered, (new_step, language))
+
+    def record_retry(self, step, language):
+        """An invalid answer kept the customer in the same step"""
+        with self.lock:
+            self._bump(self._current().retries, (step, language or 'unknown'))
+
+    def record_capacity_check(self, seconds):
+        with self.lock:
+            self._current().capacity_checks[_histogram_bucket(seconds)] += 1
+
+    def report(self, window_minutes, language=None):
+        """Aggregate the last window_minutes into a per-step funnel"""
+        since = int(time.time() // 60) - window_minutes + 1
+        with self.lock:
+            buckets = [bucket for bucket in self.minutes if bucket.minute >= since]
+            steps = {step: {
+                "entered": 0, "exited": 0, "retries": 0, "dropoffs": {},
+                "retries_by_language": {},
+                "time_in_step": [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1)
+            } for step in FUNNEL_STEPS}
+            capacity = [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1)
+            for bucket in buckets:
+                for (step, lang), count in bucket.entered.items():
+                    if language in (None, lang):
+                        steps[step]["entered"] += count
+                for (step, lang), count in bucket.exited.items():
+                    if language in (None, lang):
+                        steps[step]["exited"] += count
+                for (step, lang), count in bucket.retries.items():
+                    if language in (None, lang):
+                        steps[step]["retries"] += count
+                        self._bump(steps[step]["retries_by_language"], lang, count)
+                for (step, lang, reason), count in bucket.dropoffs.items():
+                    if language in (None, lang):
+                        self._bump(steps[step]["dropoffs"], reason, count)
+                if language is None:
+                    for step, histogram in bucket.durations.items():
+                        totals = steps[step]["time_in_step"]
+                        for index, count in enumerate(histogram):
+                            totals[index] += count
+                for index, count in enumerate(bucket.capacity_checks):
+                    capacity[index] += count
+        
+        funnel = []
+        for index, step in enumerate(FUNNEL_STEPS):
+            stats = steps[step]
+            next_entered = steps[FUNNEL_STEPS[index + 1]]["entered"] if index + 1 < len(FUNNEL_STEPS) else None
+            funnel.append({
+                "step": step,
+                "entered": stats["entered"],
+                "exited": stats["exited"],
+                "retries": stats["retries"],
+                "retries_by_language": stats["retries_by_language"],
+                "dropoffs": stats["dropoffs"],
+                "dropoff_total": sum(stats["dropoffs"].values()),
+                "conversion_to_next": (
+                    round(next_entered / stats["entered"], 4)
+                    if next_entered is not None and stats["entered"] else None
+                ),
+                # Durations are not split by language to keep buckets small
+                "time_in_step": _histogram_summary(stats["time_in_step"]) if language is None else None
+            })
+        started = steps[FUNNEL_STEPS[0]]["entered"]
+        completed = steps['completed']["entered"]
+        return {
+            "steps": funnel,
+            "started": started,
+            "completed": completed,
+            "overall_conversion": round(completed / started, 4) if started else None,
+            "capacity_check": _histogram_summary(capacity)
+        }
+
+booking_funnel = BookingFunnel()
+user_sessions.add_step_listener(booking_funnel.on_step_change)
+
+# ==============================
+# OUTBOUND PACING
+# ==============================
+# Sends are spaced to an adaptive rate: throttling error codes (from the send
+# response or a failed status callback) halve it, a window with too many
+# failed deliveries lowers it, and clean windows raise it again step by step.
+OUTBOUND_MAX_RATE = float(os.environ.get("OUTBOUND_MAX_RATE", 40))  # messages/second per worker
+OUTBOUND_MIN_RATE = float(os.environ.get("OUTBOUND_MIN_RATE", 1))
+OUTBOUND_RATE_STEP = float(os.environ.get("OUTBOUND_RATE_STEP", 2))
+OUTBOUND_BURST = int(os.environ.get("OUTBOUND_BURST", 10))
+OUTBOUND_PACING_WINDOW = int(os.environ.get("OUTBOUND_PACING_WINDOW", 60))
+OUTBOUND_FAILURE_THRESHOLD = float(os.environ.get("OUTBOUND_FAILURE_THRESHOLD", 0.05))
+# An outbox sender never waits longer than this for a slot (inline sends never wait)
+OUTBOUND_PACING_MAX_WAIT = float(os.environ.get("OUTBOUND_PACING_MAX_WAIT", 2.0))
+
+# Graph API / WhatsApp error codes meaning "send slower"
+THROTTLE_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+class OutboundPacer:
+    """Adaptive send-rate limiter (GCRA spacing with a small burst)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = OUTBOUND_MAX_RATE
+        self.theoretical_arrival = 0.0
+        self.window_started = time.monotonic()
+        self.window = {"delivered": 0, "failed": 0, "throttled": 0}
+        self.last_decrease = 0.0
+        self.stats = {
+            "paced": 0, "wait_seconds_total": 0.0, "overruns": 0, "rejected": 0, "decreases": 0, "increases": 0
+        }
+
+    def acquire(self, blocking=True):
+        """Wait for this worker's next send slot; without blocking, False if there is none free now"""
+        with self.lock:
+            now = time.monotonic()
+            interval = 1.0 / self.rate
+            self.theoretical_arrival = max(self.theoretical_arrival, now)
+            wait = self.theoretical_arrival - now - interval * (OUTBOUND_BURST - 1)
+            if wait > 0 and not blocking:
+                self.stats["rejected"] += 1
+                return False
+            self.theoretical_arrival += interval
+            if wait > 0:
+                self.stats["paced"] += 1
+                if wait > OUTBOUND_PACING_MAX_WAIT:
+                    self.stats["overruns"] += 1
+                    wait = OUTBOUND_PACING_MAX_WAIT
+                self.stats["wait_seconds_total"] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def observe(self, delivered=0, failed=0, error_codes=()):
+        """Feed delivery outcomes back into the send rate"""
+        throttled = sum(1 for code in error_codes if code in THROTTLE_ERROR_CODES)
+        with self.lock:
+            now = time.monotonic()
+            self.window["delivered"] += delivered
+            self.window["failed"] += failed
+            self.window["throttled"] += throttled
+            # React to throttling at once, but at most once a second
+            if throttled and now - self.last_decrease >= 1.0:
+                self._set_rate(self.rate / 2, now)
+            if now - self.window_started < OUTBOUND_PACING_WINDOW:
+                return
+            outcomes = self.window["delivered"] + self.window["failed"]
+            failure_rate = self.window["failed"] / outcomes if outcomes else 0.0
+            if self.window["throttled"] or failure_rate > OUTBOUND_FAILURE_THRESHOLD:
+                self._set_rate(self.rate * 0.75, now)
+            elif outcomes:
+                self._set_rate(self.rate + OUTBOUND_RATE_STEP, now)
+            self.window = {"delivered": 0, "failed": 0, "throttled": 0}
+            self.window_started = now
+
+    def _set_rate(self, rate, now):
+        rate = min(OUTBOUND_MAX_RATE, max(OUTBOUND_MIN_RATE, rate))
+        if rate < self.rate:
+            self.stats["decreases"] += 1
+            self.last_decrease = now
+            logger.warning("🐢 Outbound send rate lowered to %.1f/s", rate, extra={"category": "outbound"})
+        elif rate > self.rate:
+            self.stats["increases"] += 1
+        self.rate = rate
+
+    def status(self):
+        with self.lock:
+            return dict(
+                self.stats, rate_per_second=round(self.rate, 2), max_rate=OUTBOUND_MAX_RATE,
+                min_rate=OUTBOUND_MIN_RATE, burst=OUTBOUND_BURST, window=dict(self.window)
+            )
+
+outbound_pacer = OutboundPacer()
+
+# ==============================
+# DELIVERY STATUS TRACKING
+# ==============================
+# Meta posts sent/delivered/read/failed callbacks for every outbound message;
+# at volume they outnumber inbound messages. They take a fast path into a
+# compact per-message store (keyed by the hash of the message id) that is
+# bounded by age and size.
+DELIVERY_RETENTION_HOURS = float(os.environ.get("DELIVERY_RETENTION_HOURS", 72))
+DELIVERY_MAX_MESSAGES = int(os.environ.get("DELIVERY_MAX_MESSAGES", 200000))
+DELIVERY_STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+class DeliveryRecord:
+    """Timestamps of one outbound message's delivery progress"""
+    __slots__ = ("created", "seen", "sent", "delivered", "read", "error_code")
+
+    def __init__(self, created):
+        self.created = created
+        self.seen = 0  # bit per status already applied
+        self.sent = None
+        self.delivered = None
+        self.read = None
+        self.error_code = None
+
+class DeliveryTracker:
+    """Per-message delivery status store with latency and failure statistics"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = OrderedDict()
+        self.counts = {status: 0 for status in DELIVERY_STATUS_RANK}
+        self.counts.update({"unknown_message": 0, "duplicate": 0, "evicted": 0})
+        self.error_codes = {}
+        self.delivery_latency = [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1)
+        self.read_latency = [0] * (len(FUNNEL_HISTOGRAM_BOUNDS) + 1)
+
+    def record_sent(self, message_id):
+        """Remember an accepted send so its callbacks can be timed"""
+        now = time.time()
+        with self.lock:
+            record = DeliveryRecord(now)
+            record.sent = now
+            self.messages[hash(message_id)] = record
+            self._prune(now)
+
+    def ingest(self, statuses):
+        """Apply a batch of status callbacks; returns how many were applied"""
+        now = time.time()
+        delivered = failed = applied = 0
+        error_codes = []
+        with self.lock:
+            for status in statuses:
+                name = status.get("status")
+                if name not in DELIVERY_STATUS_RANK:
+                    continue
+                key = hash(status.get("id", ""))
+                record = self.messages.get(key)
+                if record is None:
+                    # Sent by another worker or before a restart
+                    self.counts["unknown_message"] += 1
+                    record = self.messages[key] = DeliveryRecord(now)
+                bit = 1 << DELIVERY_STATUS_RANK[name]
+                if record.seen & bit:
+                    self.counts["duplicate"] += 1
+                    continue
+                record.seen |= bit
+                at = _as_int(status.get("timestamp")) or now
+                if name == "sent":
+                    record.sent = min(record.sent or at, at)
+                elif name == "delivered":
+                    record.delivered = at
+                    delivered += 1
+                    if record.sent is not None:
+                        self.delivery_latency[_histogram_bucket(max(0, at - record.sent))] += 1
+                elif name == "read":
+                    record.read = at
+                    if record.sent is not None:
+                        self.read_latency[_histogram_bucket(max(0, at - record.sent))] += 1
+                else:
+                    errors = status.get("errors") or [{}]
+                    record.error_code = _as_int(errors[0].get("code"))
+                    failed += 1
+                    error_codes.append(record.error_code)
+                    code = str(record.error_code)
+                    self.error_codes[code] = self.error_codes.get(code, 0) + 1
+                self.counts[name] += 1
+                applied += 1
+            self._prune(now)
+        if delivered or failed:
+            outbound_pacer.observe(delivered=delivered, failed=failed, error_codes=error_codes)
+        return applied
+
+    def _prune(self, now):
+        cutoff = now - DELIVERY_RETENTION_HOURS * 3600
+        while self.messages:
+            oldest = next(iter(self.messages.values()))
+            if len(self.messages) <= DELIVERY_MAX_MESSAGES and oldest.created >= cutoff:
+                break
+            self.messages.popitem(last=False)
+            self.counts["evicted"] += 1
+
+    def status(self):
+        with self.lock:
+            outcomes = self.counts["delivered"] + self.counts["failed"]
+            top_errors = sorted(self.error_codes.items(), key=lambda item: item[1], reverse=True)[:10]
+            return {
+                "tracked_messages": len(self.messages),
+                "counts": dict(self.counts),
+                "failure_rate": round(self.counts["failed"] / outcomes, 4) if outcomes else 0.0,
+                "error_codes": dict(top_errors),
+                "delivery_latency": _histogram_summary(self.delivery_latency),
+                "read_latency": _histogram_summary(self.read_latency),
+                "retention_hours": DELIVERY_RETENTION_HOURS,
+                "max_messages": DELIVERY_MAX_MESSAGES
+            }
+
+delivery_tracker = DeliveryTracker()
+
+# ==============================
+# OUTBOUND OUTBOX
+# ==============================
+# Outbound messages are written to a local SQLite outbox and sent by
+# background senders, so a slow or failing Graph API neither holds up the
+# request that produced the message nor loses it. Failed sends are retried
+# with exponential backoff; a recipient's messages go out strictly in order
+# (a message waits while an earlier one to the same number is pending).
+# Shares the booking database by default; with Sheets as the booking store
+# there is none, so the outbox stays off until OUTBOX_DB_PATH is set
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH") or (BOOKING_DB_PATH if BOOKING_STORE == "sqlite" else "")
+OUTBOX_ENABLED = os.environ.get(
+    "OUTBOX_ENABLED", "true" if OUTBOX_DB_PATH else "false"
+).lower() in ("1", "true", "yes")
+if OUTBOX_ENABLED and not OUTBOX_DB_PATH:
+    logger.warning("⚠️ OUTBOX_DB_PATH not set with BOOKING_STORE=sheets; sending without the outbox",
+                   extra={"category": "outbound"})
+    OUTBOX_ENABLED = False
+OUTBOX_SENDERS = int(os.environ.get("OUTBOX_SENDERS", 4))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF_BASE = float(os.environ.get("OUTBOX_BACKOFF_BASE", 2.0))
+OUTBOX_BACKOFF_MAX = float(os.environ.get("OUTBOX_BACKOFF_MAX", 900))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1.0))
+OUTBOX_SENT_RETENTION_HOURS = float(os.environ.get("OUTBOX_SENT_RETENTION_HOURS", 24))
+# A claimed message not completed within this time (worker died) is resent
+OUTBOX_CLAIM_TIMEOUT = GRAPH_API_TIMEOUT * 4
+
+class Outbox(SqliteDatabase):
+    """Persistent outbound message queue with retry, ordering and dead letters"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.wakeup = threading.Event()
+        self.sender_pid = None
+        self.start_lock = threading.Lock()
+        self.last_prune = 0.0
+        self.stats = {"enqueued": 0, "sent": 0, "retried": 0, "dead_lettered": 0}
+        self._create_schema()
+
+    def _create_schema(self):
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                claimed_at REAL,
+                sent_at REAL,
+                last_error TEXT,
+                traceparent TEXT,
+                sender_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, recipient, id);
+            CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (status, sent_at);
+        """)
+        self._add_missing_columns("outbox", {"traceparent": "TEXT", "sender_id": "TEXT"})
+
+    def enqueue(self, recipient, payload, sender_id=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO outbox (recipient, payload, created_at, next_attempt_at, traceparent, sender_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (recipient, json.dumps(payload, ensure_ascii=False), now, now, current_traceparent(), sender_id)
+            )
+        self.stats["enqueued"] += 1
+        self.ensure_started()
+        self.wakeup.set()
+
+    def ensure_started(self):
+        """Start this process's sender threads"""
+        if self.sender_pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.sender_pid == os.getpid():
+                return
+            self.sender_pid = os.getpid()
+            for number in range(OUTBOX_SENDERS):
+                threading.Thread(target=self._send_loop, name=f"outbox-sender-{number}", daemon=True).start()
+
+    def _claim(self):
+        """Claim the oldest sendable message whose recipient has nothing earlier pending"""
+        now = time.time()
+        query = (
+            "SELECT id, payload, attempts, traceparent, sender_id FROM outbox o "
+            "WHERE status = 'pending' AND next_attempt_at <= ? "
+            "AND (claimed_at IS NULL OR claimed_at < ?) "
+            "AND NOT EXISTS (SELECT 1 FROM outbox e WHERE e.status = 'pending' "
+            "AND e.recipient = o.recipient AND e.id < o.id) "
+            "ORDER BY id LIMIT 1"
+        )
+        params = (now, now - OUTBOX_CLAIM_TIMEOUT)
+        # Idle polls only read; the write lock is taken once there is a message to claim
+        if self._connect().execute(query, params).fetchone() is None:
+            return None
+        with self._transaction() as conn:
+            row = conn.execute(query, params).fetchone()
+            if row:
+                conn.execute("UPDATE outbox SET claimed_at = ? WHERE id = ?", (now, row[0]))
+        return row
+
+    def _send_loop(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                job = self._claim()
+                if job is None:
+                    self._prune()
+                    self.wakeup.wait(OUTBOX_POLL_INTERVAL)
+                    continue
+                message_id, payload, attempts, traceparent, sender_id = job
+                # The send joins the trace of the request that queued it
+                with start_trace("outbox.send", SPAN_KIND_INTERNAL, {"outbox.attempt": attempts + 1},
+                                 traceparent=traceparent):
+                    outbound_pacer.acquire()
+                    sent, retryable, error = post_whatsapp_message(json.loads(payload), sender_id)
+                self._complete(message_id, attempts + 1, sent, retryable, error)
+            except Exception as e:
+                logger.error("Outbox sender failed: %s", e, extra={"category": "outbound"})
+                time.sleep(OUTBOX_POLL_INTERVAL)
+
+    def _complete(self, message_id, attempts, sent, retryable, error):
+        now = time.time()
+        with self._transaction() as conn:
+            if sent:
+                conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, claimed_at = NULL WHERE id = ?",
+                    (attempts, now, message_id)
+                )
+                self.stats["sent"] += 1
+            elif retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+                backoff = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, claimed_at = NULL, last_error = ? "
+                    "WHERE id = ?", (attempts, now + backoff * random.uniform(0.5, 1.0), error, message_id)
+                )
+                self.stats["retried"] += 1
+            else:
+                conn.execute(
+                    "UPDATE outbox SET status = 'dead', attempts = ?, claimed_at = NULL, last_error = ? WHERE id = ?",
+                    (attempts, error, message_id)
+                )
+                self.stats["dead_lettered"] += 1
+                logger.error("☠️ Outbox message %s dead-lettered after %s attempts: %s", message_id, attempts, error,
+                             extra={"category": "outbound"})
+
+    def _prune(self):
+        now = time.time()
+        if now - self.last_prune < 600:
+            return
+        self.last_prune = now
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?",
+                (now - OUTBOX_SENT_RETENTION_HOURS * 3600,)
+            )
+
+    def retry(self, message_id):
+        """Put a dead-lettered message back in the queue; False if there is none"""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, last_error = NULL "
+                "WHERE id = ? AND status = 'dead'", (time.time(), message_id)
+            ).rowcount
+        if updated:
+            self.ensure_started()
+            self.wakeup.set()
+        return bool(updated)
+
+    def backlog(self):
+        return self._connect().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def status(self, dead_limit=20):
+        now = time.time()
+        conn = self._connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        pending = conn.execute(
+            "SELECT COUNT(*), MIN(created_at), "
+            "SUM(CASE WHEN attempts > 0 AND claimed_at IS NULL THEN 1 ELSE 0 END), "
+            "SUM(CASE WHEN claimed_at IS NOT NULL THEN 1 ELSE 0 END) "
+            "FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        dead = conn.execute(
+            "SELECT id, recipient, attempts, created_at, last_error FROM outbox "
+            "WHERE status = 'dead' ORDER BY id DESC LIMIT ?", (dead_limit,)
+        ).fetchall()
+        return {
+            "enabled": OUTBOX_ENABLED,
+            "backlog": pending[0],
+            "oldest_pending_age_seconds": round(now - pending[1], 1) if pending[1] else None,
+            "in_backoff": pending[2] or 0,
+            "in_flight": pending[3] or 0,
+            "sent_retained": counts.get("sent", 0),
+            "dead_letters": counts.get("dead", 0),
+            "recent_dead_letters": [
+                {
+                    "id": row[0], "recipient": row[1], "attempts": row[2],
+                    "created_at": datetime.fromtimestamp(row[3]).isoformat(), "last_error": row[4]
+                }
+                for row in dead
+            ],
+            "process": dict(self.stats),
+            "senders": OUTBOX_SENDERS,
+            "max_attempts": OUTBOX_MAX_ATTEMPTS
+        }
+
+outbox = Outbox(OUTBOX_DB_PATH) if OUTBOX_ENABLED else None
+
+# ==============================
+# PASSENGER MANIFESTS
+# ==============================
+MANIFEST_DAYS_AHEAD = int(os.environ.get("MANIFEST_DAYS_AHEAD", 7))
+MANIFEST_REFRESH_INTERVAL = int(os.environ.get("MANIFEST_REFRESH_INTERVAL", 300))
+MANIFEST_CSV_HEADERS = [
+    'Booking ID', 'Customer Name', 'Phone Number', 'WhatsApp ID',
+    'Adults', 'Children', 'Infants', 'Total Guests', 'Booking Status'
+]
+
+def _as_int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def normalize_url_date(value):
+    """Accept DD-MM-YYYY, YYYY-MM-DD or DD/MM/YYYY and return DD/MM/YYYY"""
+    for fmt in ("%d-%m-%Y", "%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    return None
+
+def resolve_cruise_slot(slot):
+    """Map a slot key ("sunset") or English name ("Sunset Cruise") to its config"""
+    slot = slot.strip().lower()
+    for cruise_key, cruise_info in CRUISE_CONFIG["cruise_types"].items():
+        if slot in (cruise_key, cruise_info["name_en"].lower()):
+            return cruise_key, cruise_info
+    return None, None
+
+class ManifestBuilder:
+    """
+    Per (vessel, cruise date, cruise type) passenger manifests, kept ready to serve
+    Booking changes only mark their slot dirty; a background thread rebuilds
+    dirty slots straight away and pre-builds every upcoming slot periodically.
+    """
+
+    def __init__(self):
+        self.rows_by_slot = {}
+        self.cache = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    @staticmethod
+    def _slot_key(record):
+        return (
+            booking_tenant_key(record),
+            str(record.get('Cruise Date', '')).strip(),
+            str(record.get('Cruise Type', '')).strip()
+        )
+
+    def on_booking_change(self, op, row_number, record, previous):
+        with self.lock:
+            if previous is not None:
+                key = self._slot_key(previous)
+                self.rows_by_slot.get(key, {}).pop(row_number, None)
+                self.dirty.add(key)
+            if op != "delete":
+                key = self._slot_key(record)
+                self.rows_by_slot.setdefault(key, {})[row_number] = record
+                self.dirty.add(key)
+        self.wakeup.set()
+
+    def _build(self, key):
+        vessel, cruise_date, cruise_name = key
+        rows = self.rows_by_slot.get(key, {})
+        passengers = []
+        cancelled = 0
+        for row_number in sorted(rows):
+            record = rows[row_number]
+            status = str(record.get('Booking Status', '')).strip()
+            if status.lower() == 'cancelled':
+                cancelled += 1
+                continue
+            passengers.append({
+                "booking_id": record.get('Booking ID', ''),
+                "name": record.get('Customer Name', ''),
+                "phone": str(record.get('Phone Number', '')),
+                "whatsapp_id": str(record.get('WhatsApp ID', '')),
+                "adults": _as_int(record.get('Adults Count')),
+                "children": _as_int(record.get('Children Count')),
+                "infants": _as_int(record.get('Infants Count')),
+                "total_guests": _as_int(record.get('Total Guests')),
+                "status": status
+            })
+        
+        totals = {
+            "bookings": len(passengers),
+            "adults": sum(p["adults"] for p in passengers),
+            "children": sum(p["children"] for p in passengers),
+            "infants": sum(p["infants"] for p in passengers),
+            "guests": sum(p["total_guests"] for p in passengers),
+            "cancelled_bookings": cancelled
+        }
+        generated_at = datetime.now().isoformat()
+        
+        output = io.StringIO()
+        writer = csv.writer(output)
+        tenant = tenants.get(vessel)
+        writer.writerow([f'{tenant.name if tenant else vessel} - Passenger Manifest'])
+        writer.writerow([f'Cruise: {cruise_name}'])
+        writer.writerow([f'Date: {cruise_date}'])
+        writer.writerow([f'Generated: {generated_at}'])
+        writer.writerow([])
+        writer.writerow(MANIFEST_CSV_HEADERS)
+        for p in passengers:
+            writer.writerow([
+                p["booking_id"], p["name"], p["phone"], p["whatsapp_id"],
+                p["adults"], p["children"], p["infants"], p["total_guests"], p["status"]
+            ])
+        writer.writerow([])
+        writer.writerow(['Totals', '', '', '', totals["adults"], totals["children"],
+                         totals["infants"], totals["guests"], f'{totals["bookings"]} bookings'])
+        
+        self.cache[key] = {
+            "manifest": {
+                "vessel": vessel,
+                "date": cruise_date,
+                "cruise_type": cruise_name,
+                "generated_at": generated_at,
+                "passengers": passengers,
+                "totals": totals
+            },
+            "csv": output.getvalue()
+        }
+        self.dirty.discard(key)
+
+    def get(self, vessel, cruise_date, cruise_name):
+        """Cached manifest for one vessel's slot, rebuilt first if a booking changed it"""
+        key = (vessel, cruise_date, cruise_name)
+        with self.lock:
+            if key in self.dirty or key not in self.cache:
+                self._build(key)
+            return self.cache[key]
+
+    def _upcoming_keys(self):
+        today = datetime.now().date()
+        for offset in range(MANIFEST_DAYS_AHEAD + 1):
+            cruise_date = (today + timedelta(days=offset)).strftime("%d/%m/%Y")
+            # Runs off-request, so every tenant's own sailings are listed explicitly
+            for tenant in tenants.all():
+                for cruise_info in tenant.cruise_config["cruise_types"].values():
+                    yield (tenant.key, cruise_date, cruise_info["name_en"])
+
+    def ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name="manifest-builder", daemon=True).start()
+
+    def _run(self):
+        last_full_build = 0.0
+        while True:
+            self.wakeup.wait(MANIFEST_REFRESH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                booking_store.ensure_loaded()
+                upcoming = set(self._upcoming_keys())
+                with self.lock:
+                    if time.time() - last_full_build >= MANIFEST_REFRESH_INTERVAL:
+                        # Also drops manifests for sailings that have passed
+                        self.cache = {key: value for key, value in self.cache.items() if key in upcoming}
+                        for key in upcoming:
+                            self._build(key)
+                        last_full_build = time.time()
+                    else:
+                        for key in [key for key in self.dirty if key in upcoming]:
+                            self._build(key)
+            except Exception as e:
+                logger.error("Manifest build failed: %s", e)
+
+manifest_builder = ManifestBuilder()
+register_booking_listener(manifest_builder.on_booking_change)
+
+@app.before_request
+def start_background_workers():
+    """Start this process's background threads (no-op once running)"""
+    booking_changes.ensure_sync_thread()
+    booking_store.ensure_started()
+    manifest_builder.ensure_started()
+    if OUTBOX_ENABLED:
+        outbox.ensure_started()
+
+# ==============================
+# BROADCAST AUDIENCE INDEX
+# ==============================
+AUDIENCE_FIELDS = ("status", "slot", "language", "cruise_date", "booked_on")
+# Longest day range a single cruise_within/booked_within/date term may span
+AUDIENCE_MAX_RANGE_DAYS = 730
+
+@functools.lru_cache(maxsize=4096)
+def _parse_day(value, fmt):
+    try:
+        return datetime.strptime(value, fmt).date()
+    except ValueError:
+        return None
+
+class AudienceIndex:
+    """
+    Deduplicated WhatsApp IDs per vessel, then per booking status, cruise
+    slot, language, cruise date and booking day, kept current from the
+    booking change log. Members are reference counted, so a customer leaves
+    a set only when their last booking with that value does.
+    """
+
+    def __init__(self):
+        # tenant key -> {"sets": {field: {value: members}}, "everyone": members}
+        self.vessels = {}
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _vessel(self, vessel):
+        index = self.vessels.get(vessel)
+        if index is None:
+            index = self.vessels[vessel] = {"sets": {field: {} for field in AUDIENCE_FIELDS}, "everyone": {}}
+        return index
+
+    @staticmethod
+    def _keys(record):
+        return {
+            "status": str(record.get('Booking Status', '')).strip().lower(),
+            "slot": str(record.get('Cruise Type', '')).strip().lower(),
+            "language": str(record.get('Language', '')).strip().lower(),
+            "cruise_date": _parse_day(str(record.get('Cruise Date', '')).strip(), "%d/%m/%Y"),
+            # Timestamp is "YYYY-MM-DD HH:MM:SS"
+            "booked_on": _parse_day(str(record.get('Timestamp', ''))[:10], "%Y-%m-%d")
+        }
+
+    @staticmethod
+    def _adjust(members, whatsapp_id, sign):
+        count = members.get(whatsapp_id, 0) + sign
+        if count > 0:
+            members[whatsapp_id] = count
+        else:
+            members.pop(whatsapp_id, None)
+
+    def _add(self, record, sign):
+        whatsapp_id = clean_phone_number(str(record.get('WhatsApp ID', '')))
+        if not whatsapp_id:
+            self.rejected += sign
+            return
+        index = self._vessel(booking_tenant_key(record))
+        self._adjust(index["everyone"], whatsapp_id, sign)
+        for field, value in self._keys(record).items():
+            if value is None or value == '':
+                continue
+            members = index["sets"][field].setdefault(value, {})
+            self._adjust(members, whatsapp_id, sign)
+            if not members:
+                del index["sets"][field][value]
+
+    def apply(self, op, row_number, record, previous):
+        with self.lock:
+            if previous is not None:
+                self._add(previous, -1)
+            if op != "delete":
+                self._add(record, 1)
+
+    @staticmethod
+    def _members(vessel_index, field, values):
+        if field == "all":
+            return vessel_index["everyone"].keys()
+        index = vessel_index["sets"][field]
+        if isinstance(values, tuple):
+            start, end = values
+            values = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        if len(values) == 1:
+            return index.get(values[0], {}).keys()
+        members = set()
+        for value in values:
+            members.update(index.get(value, ()))
+        return members
+
+    def resolve(self, terms, vessel):
+        """WhatsApp IDs among vessel's customers matching every (field, values, negated) term"""
+        with self.lock:
+            index = self.vessels.get(vessel)
+            if index is None:
+                return set()
+            included = [self._members(index, field, values) for field, values, negated in terms if not negated]
+            excluded = [self._members(index, field, values) for field, values, negated in terms if negated]
+            if not included:
+                included = [index["everyone"].keys()]
+            included.sort(key=len)
+            result = set(included[0])
+            for members in included[1:]:
+                if not result:
+                    break
+                result &= members
+            for members in excluded:
+                result -= members
+        return result
+
+    def status(self, vessel):
+        with self.lock:
+            index = self.vessels.get(vessel) or {"sets": {field: {} for field in AUDIENCE_FIELDS}, "everyone": {}}
+            return {
+                "vessel": vessel,
+                "customers": len(index["everyone"]),
+                "rejected_bookings": self.rejected,
+                "values": {field: len(values) for field, values in index["sets"].items()}
+            }
+
+audience_index = AudienceIndex()
+register_booking_listener(audience_index.apply)
 
-def send_admin_chat_message(phone_number, message):
-    """Send message from admin to user via WhatsApp and store it"""
-    try:
-        # Store the admin message
-        store_chat_message(phone_number, message, "admin")
+def parse_segment(expression):
+    """
+    Parse a broadcast segment expression into (field, values, negated) terms
+    Space-separated terms are ANDed, "|" ORs values within a term and a
+    leading "-" excludes, e.g. "language:arabic slot:sunset cruise_within:7"
+    or "status:confirmed|pending -slot:morning". Terms: all, status:,
+    language:, slot:, date:D or date:D..D, cruise_within:N, booked_within:N.
+    The original segment names "all", "confirmed" and "pending" still work.
+    """
+    expression = (expression or "all").strip()
+    if expression in ("confirmed", "pending"):
+        expression = f"status:{expression}"
+    
+    today = datetime.now().date()
+    terms = []
+    for token in expression.split():
+        negated = token.startswith("-")
+        name, _, raw = token.lstrip("-").partition(":")
+        name = name.lower()
+        if name == "all" and not raw:
+            terms.append(("all", None, negated))
+            continue
+        if not raw:
+            raise ValueError(f"Missing value in segment term: {token}")
         
-        # Send via WhatsApp API
-        success = send_whatsapp_message(phone_number, message)
+        if name in ("status", "language"):
+            terms.append((name, [value.lower() for value in raw.split("|")], negated))
+        elif name == "slot":
+            slots = []
+            for value in raw.split("|"):
+                cruise_key, cruise_info = resolve_cruise_slot(value)
+                if not cruise_info:
+                    raise ValueError(f"Unknown cruise slot: {value}")
+                slots.append(cruise_info["name_en"].lower())
+            terms.append(("slot", slots, negated))
+        elif name == "date":
+            bounds = []
+            for value in raw.split("..", 1):
+                normalized = normalize_url_date(value)
+                if not normalized:
+                    raise ValueError(f"Invalid date in segment: {value}")
+                bounds.append(datetime.strptime(normalized, "%d/%m/%Y").date())
+            terms.append(("cruise_date", (bounds[0], bounds[-1]), negated))
+        elif name in ("cruise_within", "booked_within"):
+            try:
+                days = int(raw)
+            except ValueError:
+                raise ValueError(f"{name} needs a number of days: {raw}")
+            if name == "cruise_within":
+                terms.append(("cruise_date", (today, today + timedelta(days=days)), negated))
+            else:
+                terms.append(("booked_on", (today - timedelta(days=days), today), negated))
+        else:
+            raise ValueError(f"Unknown segment term: {name}")
         
-        if success:
-            logger.info(f"✅ Admin message sent to {phone_number}")
-            return True
+        values = terms[-1][1]
+        if isinstance(values, tuple) and not 0 <= (values[1] - values[0]).days <= AUDIENCE_MAX_RANGE_DAYS:
+            raise ValueError(f"Date range out of bounds in segment term: {token}")
+    return terms
+
+# ==============================
+# BOOKING LOOKUP INDEX
+# ==============================
+CUSTOMER_SEARCH_MAX_RESULTS = 25
+
+def normalize_customer_name(name):
+    """Customer name folded like chat search text, with whitespace collapsed"""
+    return " ".join(normalize_search_text(name).split())
+
+class BookingLookupIndex:
+    """
+    Bookings by Booking ID and WhatsApp ID (hash maps) and by customer name
+    prefix (sorted list searched with bisect), kept current from the booking
+    change log. Every word of a name is indexed, so "bal" finds
+    "Ahmed Al Balushi" as well as "Balqis". Lookups only return the bookings
+    of the vessel asked about.
+    """
+
+    def __init__(self):
+        # row key -> record
+        self.records = {}
+        # Booking ID / WhatsApp ID -> {row key: None}, in insertion order
+        self.by_booking_id = {}
+        self.by_whatsapp_id = {}
+        # Sorted (name from one of its words on, row key)
+        self.names = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _booking_id(record):
+        return str(record.get('Booking ID', '')).strip().upper()
+
+    @staticmethod
+    def _whatsapp_id(record):
+        value = str(record.get('WhatsApp ID', '')).strip()
+        return clean_phone_number(value) or value
+
+    @staticmethod
+    def _name_entries(record, row_key):
+        words = normalize_customer_name(record.get('Customer Name', '')).split()
+        return {(" ".join(words[start:]), row_key) for start in range(len(words))}
+
+    @staticmethod
+    def _adjust(index, value, row_key, sign):
+        if not value:
+            return
+        if sign > 0:
+            index.setdefault(value, {})[row_key] = None
+            return
+        rows = index.get(value)
+        if rows is not None:
+            rows.pop(row_key, None)
+            if not rows:
+                del index[value]
+
+    def _add(self, row_key, record, sign):
+        self._adjust(self.by_booking_id, self._booking_id(record), row_key, sign)
+        self._adjust(self.by_whatsapp_id, self._whatsapp_id(record), row_key, sign)
+        for entry in self._name_entries(record, row_key):
+            position = bisect.bisect_left(self.names, entry)
+            present = position < len(self.names) and self.names[position] == entry
+            if sign > 0 and not present:
+                self.names.insert(position, entry)
+            elif sign < 0 and present:
+                del self.names[position]
+        if sign > 0:
+            self.records[row_key] = record
         else:
-            logger.error(f"❌ Failed to send admin message to {phone_number}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Error sending admin chat message: {str(e)}")
-        return False
+            self.records.pop(row_key, None)
+
+    def apply(self, op, row_number, record, previous):
+        with self.lock:
+            if previous is not None:
+                self._add(row_number, previous, -1)
+            if op != "delete":
+                self._add(row_number, record, 1)
+
+    def _vessel_rows(self, rows, vessel):
+        return [row_key for row_key in rows if booking_tenant_key(self.records[row_key]) == vessel]
+
+    def bookings(self, booking_id, vessel):
+        """(row key, record) of every booking of vessel with this ID, oldest first"""
+        with self.lock:
+            rows = self.by_booking_id.get(str(booking_id).strip().upper(), {})
+            return [(row_key, self.records[row_key]) for row_key in self._vessel_rows(rows, vessel)]
+
+    def customer_bookings(self, whatsapp_id, vessel):
+        """A customer's bookings on vessel, newest first"""
+        value = str(whatsapp_id).strip()
+        with self.lock:
+            rows = self.by_whatsapp_id.get(clean_phone_number(value) or value, {})
+            records = [self.records[row_key] for row_key in self._vessel_rows(rows, vessel)]
+        records.sort(key=lambda record: str(record.get('Timestamp', '')), reverse=True)
+        return records
+
+    def customers_by_prefix(self, prefix, limit, vessel):
+        """Distinct customers of vessel whose name has a word starting with prefix"""
+        prefix = normalize_customer_name(prefix)
+        customers = {}
+        if not prefix:
+            return []
+        with self.lock:
+            position = bisect.bisect_left(self.names, (prefix,))
+            while position < len(self.names) and len(customers) < limit:
+                name, row_key = self.names[position]
+                if not name.startswith(prefix):
+                    break
+                position += 1
+                record = self.records[row_key]
+                if booking_tenant_key(record) != vessel:
+                    continue
+                whatsapp_id = self._whatsapp_id(record)
+                key = whatsapp_id or normalize_customer_name(record.get('Customer Name', ''))
+                customer = customers.get(key)
+                if customer is None:
+                    customer = customers[key] = {
+                        "name": str(record.get('Customer Name', '')).strip(),
+                        "whatsapp_id": whatsapp_id,
+                        "bookings": len(self._vessel_rows(self.by_whatsapp_id.get(whatsapp_id, ()), vessel)) or 1,
+                        "latest_booking_id": record.get('Booking ID', ''),
+                        "latest_timestamp": str(record.get('Timestamp', ''))
+                    }
+                elif str(record.get('Timestamp', '')) > customer["latest_timestamp"]:
+                    customer["latest_booking_id"] = record.get('Booking ID', '')
+                    customer["latest_timestamp"] = str(record.get('Timestamp', ''))
+        return list(customers.values())
+
+    def status(self):
+        with self.lock:
+            return {
+                "bookings": len(self.records),
+                "booking_ids": len(self.by_booking_id),
+                "customers": len(self.by_whatsapp_id),
+                "name_entries": len(self.names)
+            }
+
+booking_lookup = BookingLookupIndex()
+register_booking_listener(booking_lookup.apply)
 
 # ==============================
 # FLOW MANAGEMENT
@@ -531,8 +4334,8 @@ def send_language_menu(to):
     }
     return send_whatsapp_message(to, "", interactive_data)
 
-def send_main_menu(to, language):
-    """Send main menu"""
+def send_main_menu(to, language, info_text=None):
+    """Send main menu, with optional info text combined into the same message"""
     if language == "arabic":
         message = MESSAGES["arabic"]["main_menu"]
         interactive_data = {
@@ -572,9 +4375,18 @@ def send_main_menu(to, language):
             }
         }
     
+    if info_text:
+        prompt = interactive_data["body"]["text"]
+        body = compose_interactive_body(info_text, prompt)
+        if not body:
+            # Too long for a single interactive body; shorten it rather than spend a second send
+            room = WHATSAPP_INTERACTIVE_BODY_LIMIT - len(prompt) - len("\n\n…")
+            body = compose_interactive_body(info_text[:room] + "…", prompt)
+        interactive_data["body"]["text"] = body
+    
     return send_whatsapp_message(to, message, interactive_data)
 
-def start_booking(to, language):
+def start_booking(to, language, intro=None):
     """Start booking flow"""
     user_sessions[to] = {
         'language': language,
@@ -583,11 +4395,15 @@ def start_booking(to, language):
         'flow': 'booking'
     }
     message = MESSAGES[language]["booking_start"]
+    if intro:
+        message = f"{intro}\n\n{message}"
     return send_whatsapp_message(to, message)
 
+@traced("handle_booking_step")
 def handle_booking_step(to, text, language, session):
     """Handle booking flow steps"""
     step = session.get('step')
+    set_span_attributes({"booking.step": step})
     
     if step == 'awaiting_name':
         session.update({'step': 'awaiting_phone', 'name': text})
@@ -603,6 +4419,7 @@ def handle_booking_step(to, text, language, session):
                 error_msg = "❌ رقم الهاتف غير صالح. يرجى إدخال رقم هاتف عماني صالح (مثال: 78505509 أو 91234567)"
             else:
                 error_msg = "❌ Invalid phone number. Please enter a valid Omani phone number (e.g., 78505509 or 91234567)"
+            booking_funnel.record_retry(step, language)
             return send_whatsapp_message(to, error_msg)
         
         session.update({
@@ -622,6 +4439,7 @@ def handle_booking_step(to, text, language, session):
             error_message = MESSAGES[language]["invalid_date"]
             if error_msg:
                 error_message += f"\n\n❌ {error_msg}"
+            booking_funnel.record_retry(step, language)
             send_whatsapp_message(to, error_message)
             return False
         
@@ -639,6 +4457,7 @@ def handle_booking_step(to, text, language, session):
             message = MESSAGES[language]["ask_children"].format(text)
             return send_whatsapp_message(to, message)
         else:
+            booking_funnel.record_retry(step, language)
             return send_whatsapp_message(to, MESSAGES[language]["invalid_input"])
     
     elif step == 'awaiting_children':
@@ -649,6 +4468,7 @@ def handle_booking_step(to, text, language, session):
             )
             return send_whatsapp_message(to, message)
         else:
+            booking_funnel.record_retry(step, language)
             return send_whatsapp_message(to, MESSAGES[language]["invalid_input"])
     
     elif step == 'awaiting_infants':
@@ -656,6 +4476,7 @@ def handle_booking_step(to, text, language, session):
             session.update({'infants_count': int(text)})
             return send_cruise_type_menu(to, language, session)
         else:
+            booking_funnel.record_retry(step, language)
             return send_whatsapp_message(to, MESSAGES[language]["invalid_input"])
     
     return False
@@ -669,6 +4490,7 @@ def send_cruise_type_menu(to, language, session):
     date = session['cruise_date']  # This is now in DD/MM/YYYY format
     
     # Check capacity
+    check_started = time.monotonic()
     available_cruises = []
     for cruise_key, cruise_info in CRUISE_CONFIG["cruise_types"].items():
         current_capacity = get_cruise_capacity(date, cruise_info["name_en"])
@@ -676,14 +4498,14 @@ def send_cruise_type_menu(to, language, session):
         
         if available_seats >= total_guests:
             available_cruises.append((cruise_key, cruise_info, available_seats))
+    booking_funnel.record_capacity_check(time.monotonic() - check_started)
     
     if not available_cruises:
         if language == "arabic":
             message = f"❌ عذراً، لا توجد أماكن متاحة بتاريخ {date}.\nيرجى اختيار تاريخ آخر."
         else:
             message = f"❌ Sorry, no available seats on {date}.\nPlease choose another date."
-        send_whatsapp_message(to, message)
-        start_booking(to, language)
+        start_booking(to, language, intro=message)
         return False
     
     if language == "arabic":
@@ -747,22 +4569,10 @@ def request_payment(to, session):
     
     booking_id = generate_booking_id()
     
-    # Prepare booking data
-    booking_data = {
-        'booking_id': booking_id,
-        'name': session['name'],
-        'phone': session['phone'],
-        'whatsapp_id': to,
-        'cruise_date': session['cruise_date'],  # Already in DD/MM/YYYY format
-        'cruise_type': cruise_type,
-        'adults_count': session['adults_count'],
-        'children_count': session['children_count'],
-        'infants_count': session['infants_count'],
-        'total_guests': session['adults_count'] + session['children_count'] + session['infants_count'],
-        'total_amount': total_amount
-    }
-    
-    session['booking_data'] = booking_data
+    # The other booking fields are already in the session; booking_data is derived from them
+    session['cruise_type'] = cruise_type
+    session['booking_id'] = booking_id
+    session['total_amount'] = total_amount
     session['step'] = 'awaiting_payment'
     
     if language == "arabic":
@@ -844,15 +4654,14 @@ def confirm_booking(to, session):
         )
     
     # Clear session
-    if to in user_sessions:
-        del user_sessions[to]
+    session['step'] = 'completed'
+    user_sessions.end(to, "completed")
     
     return send_whatsapp_message(to, message)
 
 def cancel_booking(to, language):
     """Cancel booking"""
-    if to in user_sessions:
-        del user_sessions[to]
+    user_sessions.end(to, "cancelled")
     
     message = MESSAGES[language]["booking_cancelled"]
     return send_whatsapp_message(to, message)
@@ -879,34 +4688,125 @@ def health_check():
         "timestamp": datetime.now().isoformat(),
         "whatsapp_configured": bool(WHATSAPP_TOKEN and WHATSAPP_PHONE_ID),
         "sheets_available": sheet is not None,
+        "sheets_quota": sheets_scheduler.quota_status(),
+        "phone_cache": _normalize_phone.cache_info()._asdict(),
         "active_sessions": len(user_sessions),
         "active_chats": len(chat_messages),
+        "serving_mode": SERVING_MODE,
         "version": "4.0 - SIMULATION MODE",
         "payment_mode": "SIMULATION - Test payments only"
     }
     return jsonify(status)
 
+@app.route("/api/dashboard/summary", methods=["GET"])
+def get_dashboard_summary():
+    """Everything the dashboard header needs in one response"""
+    try:
+        booking_store.ensure_loaded()
+        
+        today_stats, upcoming, totals = booking_aggregates.summary(datetime.now().date(), tenants.current().key)
+        max_capacity = CRUISE_CONFIG["max_capacity"]
+        occupancy = {}
+        for cruise_info in CRUISE_CONFIG["cruise_types"].values():
+            booked = today_stats["slots"].get(cruise_info["name_en"], 0)
+            occupancy[cruise_info["name_en"]] = {
+                "time": cruise_info["time"],
+                "booked": booked,
+                "available": max_capacity - booked,
+                "utilization_percentage": round((booked / max_capacity) * 100, 2)
+            }
+        del today_stats["slots"]
+        today_stats["occupancy"] = occupancy
+        
+        expire_idle_sessions()
+        steps = user_sessions.counts("step")
+        
+        return jsonify({
+            "health": {
+                "timestamp": datetime.now().isoformat(),
+                "whatsapp_configured": bool(WHATSAPP_TOKEN and WHATSAPP_PHONE_ID),
+                "sheets_available": sheet is not None,
+                "bookings_loaded": booking_changes.loaded,
+                "version": "4.0 - SIMULATION MODE"
+            },
+            "today": today_stats,
+            "upcoming": upcoming,
+            "totals": totals,
+            "sessions": {
+                "active": len(user_sessions),
+                "by_step": steps,
+                "by_language": user_sessions.counts("language")
+            },
+            "chat": {
+                "conversations": len(chat_messages),
+                "unread_conversations": len(chat_unread),
+                "unread_messages": sum(chat_unread.values())
+            }
+        })
+    except Exception as e:
+        logger.error("Error building dashboard summary: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/active_sessions", methods=["GET"])
 def get_active_sessions():
     """Get active user sessions"""
     try:
-        # Clean up old sessions (older than 1 hour)
-        current_time = datetime.now()
-        expired_sessions = []
-        
-        for phone, session in user_sessions.items():
-            created_at = datetime.fromisoformat(session.get('created_at', current_time.isoformat()))
-            if (current_time - created_at) > timedelta(hours=1):
-                expired_sessions.append(phone)
+        # Clean up idle sessions (no activity for an hour)
+        expire_idle_sessions(force=True)
         
-        for phone in expired_sessions:
-            del user_sessions[phone]
-        
-        return jsonify({"sessions": user_sessions})
+        return jsonify({"sessions": user_sessions.to_dict()})
     except Exception as e:
         logger.error(f"Error getting sessions: {str(e)}")
         return jsonify({"sessions": {}})
 
+@app.route("/api/sessions/list", methods=["GET"])
+def list_sessions():
+    """Paged, projected session listing with per-step and per-language counts"""
+    try:
+        expire_idle_sessions()
+        
+        page = max(request.args.get("page", 1, type=int), 1)
+        page_size = min(max(request.args.get("page_size", 50, type=int), 1), 500)
+        phones = user_sessions.phones_matching(
+            step=request.args.get("step"),
+            language=request.args.get("language")
+        )
+        
+        # Only the sessions up to the end of the requested page are ranked
+        start = (page - 1) * page_size
+        recent = user_sessions.most_recent(phones, start + page_size)
+        now = datetime.now()
+        return jsonify({
+            "sessions": [session_projection(phone, session, now) for phone, session in recent[start:]],
+            "page": page,
+            "page_size": page_size,
+            "total": len(phones),
+            "pages": (len(phones) + page_size - 1) // page_size,
+            "counts": {
+                "total": len(user_sessions),
+                "by_step": user_sessions.counts("step"),
+                "by_language": user_sessions.counts("language"),
+                "by_flow": user_sessions.counts("flow")
+            }
+        })
+    except Exception as e:
+        logger.error("Error listing sessions: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/funnel", methods=["GET"])
+def get_booking_funnel():
+    """Booking funnel: step conversion, drop-off, retries and time-in-step"""
+    try:
+        window = request.args.get("window", "1h")
+        if window not in FUNNEL_WINDOWS:
+            return jsonify({"error": f"window must be one of {', '.join(FUNNEL_WINDOWS)}"}), 400
+        report = booking_funnel.report(FUNNEL_WINDOWS[window], request.args.get("language"))
+        report.update({"window": window, "language": request.args.get("language", "all")})
+        return jsonify(report)
+    except Exception as e:
+        logger.error("Error building funnel report: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/user_session/<phone_number>", methods=["GET"])
 def get_user_session(phone_number):
     """Get specific user session"""
@@ -946,16 +4846,10 @@ def get_capacity_for_date(date, cruise_type):
 def generate_daily_report(date):
     """Generate CSV report for specific date"""
     try:
-        if not sheet:
+        if not booking_store.available():
             return jsonify({"error": "Google Sheets not available"}), 500
         
-        records = sheet.get_all_records()
-        
-        # Filter bookings for the specific date
-        daily_bookings = []
-        for record in records:
-            if str(record.get('Cruise Date', '')).strip() == date:
-                daily_bookings.append(record)
+        daily_bookings = booking_store.records_for_date(date.strip(), LANE_DASHBOARD_READ)
         
         # Create CSV content
         output = io.StringIO()
@@ -971,11 +4865,14 @@ def generate_daily_report(date):
         total_bookings = len(daily_bookings)
         confirmed_bookings = len([b for b in daily_bookings if b.get('Booking Status') == 'Confirmed'])
         total_revenue = sum(float(b.get('Total Amount', 0)) for b in daily_bookings if b.get('Booking Status') == 'Confirmed')
+        customers = normalize_phone_numbers(b.get('WhatsApp ID') for b in daily_bookings)
         
         writer.writerow(['Summary'])
         writer.writerow(['Total Bookings', total_bookings])
         writer.writerow(['Confirmed Bookings', confirmed_bookings])
         writer.writerow(['Total Revenue', f"{total_revenue:.3f} OMR"])
+        writer.writerow(['Unique Customers', customers["stats"]["unique"]])
+        writer.writerow(['Invalid WhatsApp IDs', customers["stats"]["rejected"]])
         writer.writerow([])
         
         # Write detailed data
@@ -1001,6 +4898,56 @@ def generate_daily_report(date):
         logger.error(f"Error generating report: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/manifest/<date>/<slot>", methods=["GET"])
+def get_passenger_manifest(date, slot):
+    """Serve the precomputed passenger manifest for one sailing as CSV or JSON"""
+    try:
+        cruise_date = normalize_url_date(date)
+        if not cruise_date:
+            return jsonify({"error": "Date must be DD-MM-YYYY or YYYY-MM-DD"}), 400
+        cruise_key, cruise_info = resolve_cruise_slot(slot)
+        if not cruise_info:
+            return jsonify({"error": f"Unknown cruise slot: {slot}"}), 404
+        
+        booking_store.ensure_loaded()
+        
+        entry = manifest_builder.get(tenants.current().key, cruise_date, cruise_info["name_en"])
+        if request.args.get("format", "csv").lower() == "json":
+            manifest = dict(entry["manifest"], slot=cruise_key, time=cruise_info["time"])
+            return jsonify(manifest)
+        
+        response = app.response_class(response=entry["csv"], status=200, mimetype='text/csv')
+        filename = f"Sindbad_Manifest_{cruise_date.replace('/', '-')}_{cruise_key}.csv"
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+        return response
+    except Exception as e:
+        logger.error("Error serving manifest: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/audience/count", methods=["GET"])
+def count_audience():
+    """Dry-run a broadcast segment expression: how many customers it reaches"""
+    try:
+        segment = request.args.get("segment", "all")
+        try:
+            terms = parse_segment(segment)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        booking_store.ensure_loaded()
+        started = time.perf_counter()
+        vessel = tenants.current().key
+        count = len(audience_index.resolve(terms, vessel))
+        return jsonify({
+            "segment": segment,
+            "count": count,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+            "index": audience_index.status(vessel)
+        })
+    except Exception as e:
+        logger.error("Error counting audience: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/broadcast", methods=["POST"])
 def send_broadcast():
     """Send broadcast message to segment"""
@@ -1009,26 +4956,23 @@ def send_broadcast():
         segment = data.get('segment', 'all')
         message = data.get('message', '')
         
-        if not message:
+        if not message and not data.get('dry_run'):
             return jsonify({"error": "Message is required"}), 400
         
-        if not sheet:
+        if not booking_store.available():
             return jsonify({"error": "Google Sheets not available"}), 500
         
-        records = sheet.get_all_records()
-        
-        # Filter recipients based on segment
-        recipients = []
-        for record in records:
-            if segment == 'all':
-                recipients.append(record.get('WhatsApp ID'))
-            elif segment == 'confirmed' and record.get('Booking Status') == 'Confirmed':
-                recipients.append(record.get('WhatsApp ID'))
-            elif segment == 'pending' and record.get('Booking Status') == 'Pending':
-                recipients.append(record.get('WhatsApp ID'))
+        try:
+            terms = parse_segment(segment)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Remove duplicates and None values
-        recipients = list(set([r for r in recipients if r]))
+        booking_store.ensure_loaded()
+        # Recipients come pre-normalized and deduplicated from the audience index,
+        # limited to customers of the vessel whose number the broadcast goes out from
+        recipients = sorted(audience_index.resolve(terms, tenants.current().key))
+        if data.get('dry_run'):
+            return jsonify({"dry_run": True, "segment": segment, "total_recipients": len(recipients)})
         
         # In a real implementation, you would send messages via WhatsApp API
         # For now, we'll simulate the broadcast
@@ -1049,6 +4993,7 @@ def send_broadcast():
             "sent": sent_count,
             "failed": failed_count,
             "total_recipients": len(recipients),
+            "segment": segment,
             "message": f"Broadcast completed: {sent_count} sent, {failed_count} failed"
         })
         
@@ -1130,6 +5075,29 @@ def get_chat_users():
         logger.error(f"Error getting chat users: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/chat/search", methods=["GET"])
+def search_chat_messages():
+    """Search all chat conversations for messages matching a query"""
+    try:
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"success": False, "error": "Query parameter q is required"}), 400
+        limit = min(max(_as_int(request.args.get("limit")) or 20, 1), 100)
+
+        started = time.perf_counter()
+        terms, total, conversations = chat_search.search(query, limit)
+        return jsonify({
+            "success": True,
+            "query": query,
+            "terms": terms,
+            "conversations": conversations,
+            "total_conversations": total,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+    except Exception as e:
+        logger.error(f"Error searching chat messages: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ==============================
 # BOOKINGS API ENDPOINTS
 # ==============================
@@ -1138,19 +5106,139 @@ def get_chat_users():
 def get_all_bookings():
     """Get all bookings"""
     try:
-        if not sheet:
+        if not booking_store.available():
             return jsonify({"error": "Sheets not available"}), 500
         
-        records = sheet.get_all_records()
+        vessel = tenants.current().key
+        records = [
+            record for record in booking_store.all_records(LANE_DASHBOARD_READ)
+            if booking_tenant_key(record) == vessel
+        ]
         return jsonify(records)
     except Exception as e:
         logger.error(f"Error getting bookings: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/sheets/quota", methods=["GET"])
+def get_sheets_quota():
+    """Get Google Sheets quota headroom and scheduler queue state"""
+    return jsonify(sheets_scheduler.quota_status())
+
+@app.route("/api/logging/stats", methods=["GET"])
+def get_logging_stats():
+    """Get logging pipeline settings and sampled-out record counts"""
+    with log_sampler.lock:
+        dropped = dict(log_sampler.dropped)
+    return jsonify({
+        "async": LOG_ASYNC,
+        "format": LOG_FORMAT,
+        "level": LOG_LEVEL,
+        "sample_rates": log_sampler.sample_rates,
+        "rate_limits": log_sampler.rate_limits,
+        "dropped": dropped
+    })
+
+@app.route("/api/outbound/stats", methods=["GET"])
+def get_outbound_stats():
+    """Get outbound Graph API calls per conversation turn"""
+    with outbound_stats_lock:
+        stats = json.loads(json.dumps(outbound_stats))
+    turns = stats["turns"]
+    stats["avg_calls_per_turn"] = round(stats["calls"] / turns, 3) if turns else 0.0
+    stats["budget"] = OUTBOUND_CALL_BUDGET
+    stats["enforced"] = OUTBOUND_BUDGET_ENFORCED
+    return jsonify(stats)
+
+@app.route("/api/bookings/<booking_id>", methods=["GET"])
+def get_booking(booking_id):
+    """Get one booking by its Booking ID"""
+    try:
+        if not booking_store.available():
+            return jsonify({"error": "Sheets not available"}), 500
+        
+        booking_store.ensure_loaded()
+        
+        matches = booking_lookup.bookings(booking_id, tenants.current().key)
+        if not matches:
+            return jsonify({"error": "Booking not found", "booking_id": booking_id}), 404
+        if len(matches) > 1:
+            # A reused ID: show every row rather than guess which one was meant
+            return jsonify({
+                "error": "Booking ID is used by more than one booking",
+                "booking_id": booking_id,
+                "bookings": [{"booking": record, "row": row_label(row_key)} for row_key, record in matches]
+            }), 409
+        row_key, record = matches[0]
+        return jsonify({"booking": record, "row": row_label(row_key)})
+    except Exception as e:
+        logger.error("Error getting booking %s: %s", booking_id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/customers/<whatsapp_id>/bookings", methods=["GET"])
+def get_customer_bookings(whatsapp_id):
+    """Get all bookings made from one WhatsApp ID"""
+    try:
+        if not booking_store.available():
+            return jsonify({"error": "Sheets not available"}), 500
+        
+        booking_store.ensure_loaded()
+        
+        bookings = booking_lookup.customer_bookings(whatsapp_id, tenants.current().key)
+        return jsonify({"whatsapp_id": whatsapp_id, "bookings": bookings, "count": len(bookings)})
+    except Exception as e:
+        logger.error("Error getting bookings for %s: %s", whatsapp_id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/customers/search", methods=["GET"])
+def search_customers():
+    """Autocomplete customers by the start of any word of their name"""
+    try:
+        prefix = request.args.get("prefix", "").strip()
+        if not prefix:
+            return jsonify({"error": "Query parameter prefix is required"}), 400
+        if not booking_store.available():
+            return jsonify({"error": "Sheets not available"}), 500
+        
+        booking_store.ensure_loaded()
+        
+        limit = min(max(_as_int(request.args.get("limit")) or 10, 1), CUSTOMER_SEARCH_MAX_RESULTS)
+        customers = booking_lookup.customers_by_prefix(prefix, limit, tenants.current().key)
+        return jsonify({"prefix": prefix, "customers": customers, "count": len(customers)})
+    except Exception as e:
+        logger.error("Error searching customers: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/bookings/changes", methods=["GET"])
+def get_booking_changes():
+    """Get bookings appended or modified since the client's cursor"""
+    try:
+        if not booking_store.available():
+            return jsonify({"error": "Sheets not available"}), 500
+        
+        booking_store.ensure_loaded()
+        
+        since = request.args.get("since")
+        vessel = tenants.current().key
+        changes, cursor = booking_changes.changes_since(since, vessel) if since else (None, booking_changes.cursor())
+        if changes is None:
+            rows, bookings = booking_changes.snapshot(vessel)
+            return jsonify({
+                "reset": True,
+                "cursor": cursor,
+                "rows": [row_label(key) for key in rows],
+                "bookings": bookings,
+                "count": len(bookings)
+            })
+        
+        return jsonify({"reset": False, "cursor": cursor, "changes": changes, "count": len(changes)})
+    except Exception as e:
+        logger.error("Error getting booking changes: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/sessions", methods=["GET"])
 def get_sessions():
     """Get active sessions"""
-    return jsonify({"sessions": user_sessions})
+    return jsonify({"sessions": user_sessions.to_dict()})
 
 @app.route("/api/debug/sheets", methods=["GET"])
 def debug_sheets():
@@ -1160,29 +5248,14 @@ def debug_sheets():
             return jsonify({"error": "Sheet not available"}), 500
         
         # Test read
-        records = sheet.get_all_records()
-        
-        # Test write
-        test_id = f"TEST_{int(time.time())}"
-        test_data = [
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            test_id,
-            "Test User",
-            "91234567",
-            "96812345678",
-            "23/11/2024",  # Now in DD/MM/YYYY format
-            "9:00 AM - 10:30 AM",
-            "Morning Cruise",
-            "2", "1", "0", "3", "7.500",
-            'Paid', 'Simulated', 'TEST_123', 'English', 'Confirmed', 'Test Record'
-        ]
-        
-        sheet.append_row(test_data)
+        records = fetch_all_records(LANE_DASHBOARD_READ)
         
+        # No write probe: a test row would be a real booking to capacity, reports,
+        # manifests and broadcasts. /api/sheets/quota shows whether writes are flowing.
         return jsonify({
             "status": "success",
             "records_count": len(records),
-            "test_id": test_id,
+            "store": booking_store.name,
             "sheet_name": SHEET_NAME
         })
         
@@ -1190,6 +5263,358 @@ def debug_sheets():
         logger.error(f"Debug sheets error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# ==============================
+# OPERATIONS API ENDPOINTS
+# ==============================
+
+@app.route("/api/admission/stats", methods=["GET"])
+def get_admission_stats():
+    """Get per-lane admission counts, shedding and queue-time distribution"""
+    return jsonify(admission.status())
+
+@app.route("/api/tenants", methods=["GET"])
+def get_tenants():
+    """List tenants with their sessions, chats and memory use"""
+    usage = conversation_memory.tenant_usage()
+    return jsonify({
+        "default": tenants.default.key,
+        "tenants": [tenant.status(usage.get(tenant.key, {})) for tenant in tenants.all()]
+    })
+
+@app.route("/api/memory/stats", methods=["GET"])
+def get_memory_stats():
+    """Get session + chat memory use against the conversation budget"""
+    return jsonify(conversation_memory.status())
+
+@app.route("/api/ratelimit/stats", methods=["GET"])
+def get_rate_limit_stats():
+    """Get inbound per-phone rate limiter counters and top throttled numbers"""
+    return jsonify(inbound_limiter.status())
+
+@app.route("/api/recorder/stats", methods=["GET"])
+def get_recorder_stats():
+    """Get webhook traffic recorder state and counters"""
+    return jsonify(webhook_recorder.status())
+
+@app.route("/api/store/stats", methods=["GET"])
+def get_store_stats():
+    """Get booking store type and Sheets mirror backlog"""
+    stats = {"store": booking_store.name, "loaded": booking_changes.loaded, "lookup": booking_lookup.status()}
+    if isinstance(booking_store, SqliteBookingStore):
+        stats["sqlite"] = booking_store.export_status()
+    return jsonify(stats)
+
+@app.route("/api/outbox", methods=["GET"])
+def get_outbox():
+    """Get outbound message backlog, oldest pending age and dead letters"""
+    try:
+        if outbox is None:
+            return jsonify({"enabled": False})
+        return jsonify(outbox.status())
+    except Exception as e:
+        logger.error(f"Error getting outbox status: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/outbox/<int:message_id>/retry", methods=["POST"])
+def retry_outbox_message(message_id):
+    """Requeue a dead-lettered outbound message"""
+    try:
+        if outbox is None or not outbox.retry(message_id):
+            return jsonify({"error": "No dead-lettered message with that id"}), 404
+        return jsonify({"success": True, "id": message_id})
+    except Exception as e:
+        logger.error(f"Error retrying outbox message: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/delivery/stats", methods=["GET"])
+def get_delivery_stats():
+    """Get delivery status counts, latency, failure codes and outbound pacing"""
+    return jsonify(dict(delivery_tracker.status(), pacing=outbound_pacer.status()))
+
+@app.route("/api/tracing/stats", methods=["GET"])
+def get_tracing_stats():
+    """Get trace tail-sampling counters and settings"""
+    return jsonify(trace_sampler.status())
+
+# ==============================
+# INBOUND RATE LIMITING
+# ==============================
+# Every inbound message can cost Sheets reads and Graph sends, so each phone
+# number gets a token bucket; a flood gets one polite notice and is then
+# dropped until the bucket refills.
+INBOUND_RATE_PER_MINUTE = float(os.environ.get("INBOUND_RATE_PER_MINUTE", 20))
+INBOUND_BURST = int(os.environ.get("INBOUND_BURST", 8))
+INBOUND_LIMITER_MAX_PHONES = int(os.environ.get("INBOUND_LIMITER_MAX_PHONES", 20000))
+
+class InboundRateLimiter:
+    """
+    Per-phone token buckets in an LRU map of bounded size
+    A phone evicted for inactivity would have refilled its bucket anyway.
+    """
+    ALLOW = "allow"
+    NOTIFY = "notify"
+    DROP = "drop"
+
+    def __init__(self, rate_per_minute, burst, max_phones):
+        self.fill_rate = rate_per_minute / 60.0
+        self.burst = float(burst)
+        self.max_phones = max_phones
+        # phone -> [tokens, updated, notice_sent, throttled_count]
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"allowed": 0, "throttled": 0, "notices_sent": 0, "evicted": 0}
+
+    def check(self, phone_number):
+        """ALLOW the message, NOTIFY (throttle and tell the user once) or DROP it"""
+        now = time.monotonic()
+        with self.lock:
+            state = self.buckets.get(phone_number)
+            if state is None:
+                state = self.buckets[phone_number] = [self.burst, now, False, 0]
+                if len(self.buckets) > self.max_phones:
+                    self.buckets.popitem(last=False)
+                    self.stats["evicted"] += 1
+            else:
+                self.buckets.move_to_end(phone_number)
+                state[0] = min(self.burst, state[0] + (now - state[1]) * self.fill_rate)
+                state[1] = now
+            
+            if state[0] >= 1:
+                state[0] -= 1
+                state[2] = False
+                self.stats["allowed"] += 1
+                return self.ALLOW
+            
+            state[3] += 1
+            self.stats["throttled"] += 1
+            if state[2]:
+                return self.DROP
+            state[2] = True
+            self.stats["notices_sent"] += 1
+            return self.NOTIFY
+
+    def status(self, top=10):
+        with self.lock:
+            stats = dict(self.stats)
+            offenders = sorted(
+                ((phone, state[3]) for phone, state in self.buckets.items() if state[3]),
+                key=lambda item: item[1], reverse=True
+            )[:top]
+            tracked = len(self.buckets)
+        return dict(
+            stats,
+            tracked_phones=tracked,
+            max_phones=self.max_phones,
+            rate_per_minute=self.fill_rate * 60,
+            burst=self.burst,
+            top_throttled=[{"phone": phone, "throttled": count} for phone, count in offenders]
+        )
+
+inbound_limiter = InboundRateLimiter(INBOUND_RATE_PER_MINUTE, INBOUND_BURST, INBOUND_LIMITER_MAX_PHONES)
+
+# ==============================
+# WEBHOOK RECORDER
+# ==============================
+# Opt-in capture of real webhook traffic for replay.py. Payloads are written
+# with their arrival time to rotating gzip JSONL files; phone numbers (sender
+# ids and numbers typed into messages, separators and all) are replaced by
+# keyed pseudonyms of the same shape that keep their leading prefix, so a
+# replay keeps conversations and validation paths intact. Answers to the name
+# and phone questions are redacted outright.
+WEBHOOK_RECORD_DIR = os.environ.get("WEBHOOK_RECORD_DIR", "")  # empty disables recording
+# Keep this fixed across workers/restarts so one customer maps to one pseudonym
+WEBHOOK_RECORD_KEY = os.environ.get("WEBHOOK_RECORD_KEY", "")
+WEBHOOK_RECORD_ROTATE_MB = float(os.environ.get("WEBHOOK_RECORD_ROTATE_MB", 16))
+WEBHOOK_RECORD_ROTATE_SECONDS = int(os.environ.get("WEBHOOK_RECORD_ROTATE_SECONDS", 3600))
+WEBHOOK_RECORD_KEEP_FILES = int(os.environ.get("WEBHOOK_RECORD_KEEP_FILES", 168))
+WEBHOOK_RECORD_QUEUE = int(os.environ.get("WEBHOOK_RECORD_QUEUE", 10000))
+
+# Payload keys that carry a customer's phone number
+PHONE_PAYLOAD_KEYS = {"from", "wa_id", "recipient_id"}
+# Digit groups that may be split by spaces, dashes, dots or brackets
+PHONE_DIGITS_PATTERN = re.compile(r"\+?\d[\d \t\-.()]*\d")
+PHONE_MIN_DIGITS = 7
+# Booking steps whose answer is the customer's name or phone number
+WEBHOOK_RECORD_PRIVATE_STEPS = {"awaiting_name", "awaiting_phone"}
+
+class WebhookRecorder:
+    """Writes pseudonymized webhook payloads to rotating compressed JSONL files"""
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = (key or os.urandom(16).hex()).encode()
+        self.queue = queue.Queue(maxsize=WEBHOOK_RECORD_QUEUE)
+        self.pid = None
+        self.writer = None
+        self.file = None
+        self.path = None
+        self.opened_at = 0.0
+        self.written_bytes = 0
+        self.stats = {"recorded": 0, "dropped": 0, "files": 0, "write_errors": 0}
+        if directory and not key:
+            logger.warning("⚠️ WEBHOOK_RECORD_KEY not set; pseudonyms will differ between workers")
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def pseudonym(self, digits):
+        """
+        Stable same-length digit string standing in for a phone number
+        The country code (or local mobile prefix) is kept, so a replayed
+        number passes or fails phone validation just like the original.
+        """
+        significant = digits.lstrip("0")
+        keep = len(digits) - len(significant) + (3 if len(significant) >= 11 else 1)
+        rest = len(digits) - keep
+        if rest <= 0:
+            return digits
+        digest = hmac.new(self.key, digits.encode(), hashlib.sha256).digest()
+        return digits[:keep] + str(int.from_bytes(digest, "big")).rjust(rest, "0")[-rest:]
+
+    @staticmethod
+    def _phone_like(text):
+        """Phone-number-looking matches in text; dates such as 15-01-2030 are left alone"""
+        for match in PHONE_DIGITS_PATTERN.finditer(text):
+            candidate = match.group()
+            if sum(ch.isdigit() for ch in candidate) >= PHONE_MIN_DIGITS and partition_month(candidate) is None:
+                yield match
+
+    def _pseudonymize_numbers(self, text):
+        parts, last = [], 0
+        for match in self._phone_like(text):
+            candidate = match.group()
+            replacement = iter(self.pseudonym("".join(filter(str.isdigit, candidate))))
+            parts.append(text[last:match.start()])
+            # Digits are swapped in place, so separators and spacing survive
+            parts.append("".join(next(replacement) if ch.isdigit() else ch for ch in candidate))
+            last = match.end()
+        parts.append(text[last:])
+        return "".join(parts)
+
+    def _redact(self, body):
+        """What is kept of an answer to the name or phone question: only the number typed, if any"""
+        numbers = [match.group() for match in self._phone_like(body)]
+        return " ".join(numbers) if numbers else "Guest"
+
+    def pseudonymize(self, value, key=None, private=frozenset()):
+        if isinstance(value, dict):
+            if private and value.get("id") in private and isinstance(value.get("text"), dict):
+                value = dict(value, text=dict(value["text"], body=self._redact(str(value["text"].get("body", "")))))
+            return {k: self.pseudonymize(v, k, private) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.pseudonymize(v, None, private) for v in value]
+        if isinstance(value, str):
+            if key in PHONE_PAYLOAD_KEYS or key == "body":
+                return self._pseudonymize_numbers(value)
+            if key == "name":
+                return "Guest"
+        return value
+
+    @staticmethod
+    def _private_message_ids(payload):
+        """Ids of messages answering the name or phone question, looked up before the message is handled"""
+        ids = set()
+        try:
+            for entry in payload.get("entry", []):
+                for change in entry.get("changes", []):
+                    value = change.get("value", {})
+                    tenant = tenants.for_phone_number_id(value.get("metadata", {}).get("phone_number_id"))
+                    if tenant is None:
+                        continue
+                    for message in value.get("messages", []):
+                        session = tenant.sessions.get(message.get("from"))
+                        if session is not None and session.step in WEBHOOK_RECORD_PRIVATE_STEPS:
+                            ids.add(message.get("id"))
+        except AttributeError:
+            # Malformed payloads are recorded as they are
+            pass
+        return frozenset(ids)
+
+    def record(self, payload):
+        """Queue one webhook payload; never blocks the request"""
+        if not self.enabled or payload is None:
+            return
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait((time.time(), payload, self._private_message_ids(payload)))
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _ensure_writer(self):
+        # The writer thread does not survive a fork, so start one per process
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.file = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.writer = threading.Thread(target=self._write_loop, name="webhook-recorder", daemon=True)
+        self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self._close()
+                return
+            try:
+                received_at, payload, private = item
+                line = json.dumps(
+                    {"ts": round(received_at, 3), "payload": self.pseudonymize(payload, private=private)},
+                    ensure_ascii=False
+                ).encode("utf-8") + b"\n"
+                self._rotate_if_needed(received_at)
+                self.file.write(line)
+                self.written_bytes += len(line)
+                self.stats["recorded"] += 1
+                if self.queue.empty():
+                    self.file.flush()
+            except Exception as e:
+                self.stats["write_errors"] += 1
+                logger.error("Webhook recording failed: %s", e, extra={"category": "recorder"})
+
+    def _rotate_if_needed(self, now):
+        if (self.file is not None
+                and self.written_bytes < WEBHOOK_RECORD_ROTATE_MB * 1024 * 1024
+                and now - self.opened_at < WEBHOOK_RECORD_ROTATE_SECONDS):
+            return
+        self._close()
+        stamp = datetime.fromtimestamp(now).strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(self.directory, f"webhooks-{stamp}-{os.getpid()}.jsonl.gz")
+        self.file = gzip.open(self.path, "ab")
+        self.opened_at = now
+        self.written_bytes = 0
+        self.stats["files"] += 1
+        self._prune()
+
+    def _prune(self):
+        recordings = sorted(glob.glob(os.path.join(self.directory, "webhooks-*.jsonl.gz")), key=os.path.getmtime)
+        for path in recordings[:-WEBHOOK_RECORD_KEEP_FILES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stop(self):
+        # Drain and close so the current file gets its gzip trailer
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+
+    def status(self):
+        return dict(
+            self.stats, enabled=self.enabled, directory=self.directory or None,
+            current_file=self.path, queued=self.queue.qsize()
+        )
+
+webhook_recorder = WebhookRecorder(WEBHOOK_RECORD_DIR, WEBHOOK_RECORD_KEY)
+atexit.register(webhook_recorder.stop)
+
 # ==============================
 # WEBHOOK HANDLERS
 # ==============================
@@ -1208,10 +5633,24 @@ def verify_webhook():
         return "Verification token mismatch", 403
 
 @app.route("/webhook", methods=["POST"])
+@traced("POST /webhook", SPAN_KIND_SERVER, root=True)
 def handle_webhook():
     """Handle incoming WhatsApp messages"""
     try:
         data = request.get_json()
+        webhook_recorder.record(data)
+        
+        # Delivery callbacks skip the conversation machinery entirely
+        statuses = [
+            status
+            for entry in data.get("entry", [])
+            for change in entry.get("changes", [])
+            for status in change.get("value", {}).get("statuses", [])
+        ]
+        if statuses:
+            set_span_attributes({"webhook.kind": "statuses", "webhook.statuses": len(statuses)})
+            applied = delivery_tracker.ingest(statuses)
+            return jsonify({"status": "statuses", "applied": applied})
         
         entry = data.get("entry", [{}])[0]
         changes = entry.get("changes", [{}])[0]
@@ -1223,48 +5662,80 @@ def handle_webhook():
         
         message = messages[0]
         phone_number = message["from"]
+        phone_number_id = value.get("metadata", {}).get("phone_number_id")
+        tenant = tenants.for_phone_number_id(phone_number_id)
+        if tenant is None:
+            # Acknowledged so Meta does not redeliver it; answering from another number would be wrong
+            logger.warning("⚠️ Dropped webhook for unknown phone_number_id %s", phone_number_id,
+                           extra={"category": "webhook"})
+            return jsonify({"status": "unknown_number"})
+        expire_idle_sessions()
+        set_span_attributes({
+            "webhook.kind": "message", "whatsapp.from_hash": trace_subject(phone_number), "tenant": tenant.key
+        })
         
-        # Store user message in chat history
-        if "text" in message:
-            text = message["text"]["body"].strip()
-            store_chat_message(phone_number, text, "user")
-            logger.info(f"💬 User message stored: {phone_number}: {text[:50]}...")
-        
-        # Handle interactive messages
-        if "interactive" in message:
-            interactive = message["interactive"]
-            
-            if interactive["type"] == "list_reply":
-                option_id = interactive["list_reply"]["id"]
-                logger.info(f"📋 List selection: {option_id} from {phone_number}")
-                handle_interactive_message(phone_number, option_id)
-                
-            elif interactive["type"] == "button_reply":
-                button_id = interactive["button_reply"]["id"]
-                logger.info(f"🔘 Button click: {button_id} from {phone_number}")
-                handle_interactive_message(phone_number, button_id)
-            
-            return jsonify({"status": "interactive_handled"})
-        
-        # Handle text messages
-        if "text" in message:
-            text = message["text"]["body"].strip()
-            logger.info(f"💬 Text message: '{text}' from {phone_number}")
-            handle_text_message(phone_number, text)
-            return jsonify({"status": "text_handled"})
-        
-        return jsonify({"status": "unhandled"})
+        try:
+            with tenant_context(tenant):
+                user_sessions.touch(phone_number)
+                with outbound_turn(phone_number):
+                    return process_inbound_message(phone_number, message)
+        finally:
+            bump_data_version("sessions")
         
     except Exception as e:
-        logger.error(f"🚨 Webhook error: {str(e)}")
+        logger.error("🚨 Webhook error: %s", e, exc_info=True, extra={"category": "webhook"})
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def process_inbound_message(phone_number, message):
+    """Dispatch one inbound WhatsApp message"""
+    decision = inbound_limiter.check(phone_number)
+    if decision != InboundRateLimiter.ALLOW:
+        logger.info("🚦 Throttled message from %s", phone_number, extra={"category": "webhook"})
+        if decision == InboundRateLimiter.NOTIFY:
+            language = user_sessions.get(phone_number, {}).get('language', 'english')
+            send_whatsapp_message(phone_number, MESSAGES[language]["rate_limited"])
+        return jsonify({"status": "throttled"})
+    
+    # Store user message in chat history
+    if "text" in message:
+        text = message["text"]["body"].strip()
+        store_chat_message(phone_number, text, "user")
+        logger.debug("💬 User message stored: %s: %.50s...", phone_number, text, extra={"category": "chat"})
+    
+    # Handle interactive messages
+    if "interactive" in message:
+        interactive = message["interactive"]
+        
+        if interactive["type"] == "list_reply":
+            option_id = interactive["list_reply"]["id"]
+            logger.info("📋 List selection: %s from %s", option_id, phone_number,
+                        extra={"category": "webhook"})
+            handle_interactive_message(phone_number, option_id)
+            
+        elif interactive["type"] == "button_reply":
+            button_id = interactive["button_reply"]["id"]
+            logger.info("🔘 Button click: %s from %s", button_id, phone_number,
+                        extra={"category": "webhook"})
+            handle_interactive_message(phone_number, button_id)
+        
+        return jsonify({"status": "interactive_handled"})
+    
+    # Handle text messages
+    if "text" in message:
+        text = message["text"]["body"].strip()
+        logger.info("💬 Text message: '%s' from %s", text, phone_number, extra={"category": "webhook"})
+        handle_text_message(phone_number, text)
+        return jsonify({"status": "text_handled"})
+    
+    return jsonify({"status": "unhandled"})
+
 def handle_interactive_message(phone_number, interaction_id):
     """Handle interactive message responses"""
     session = user_sessions.get(phone_number, {})
     language = session.get('language', 'english')
     
-    logger.info(f"🔄 Handling interaction: {interaction_id} for {phone_number}")
+    logger.debug("🔄 Handling interaction: %s for %s", interaction_id, phone_number,
+                 extra={"category": "webhook"})
     
     # Language selection
     if interaction_id == "lang_english":
@@ -1285,8 +5756,7 @@ def handle_interactive_message(phone_number, interaction_id):
         else:
             message = "💰 *Cruise Pricing*\n\n*Morning:* 2.500 OMR per person\n(9:00 AM - 10:30 AM)\n\n*Afternoon:* 3.500 OMR per person\n(1:30 PM - 3:00 PM)\n\n*Sunset:* 4.500 OMR per person\n(5:00 PM - 6:30 PM)\n\n*Evening:* 3.500 OMR per person\n(7:30 PM - 9:00 PM)\n\n*Infants:* Free (below 2 years)"
         
-        send_whatsapp_message(phone_number, message)
-        send_main_menu(phone_number, language)
+        send_main_menu(phone_number, language, info_text=message)
     
     elif interaction_id == "schedule":
         if language == "arabic":
@@ -1294,8 +5764,7 @@ def handle_interactive_message(phone_number, interaction_id):
         else:
             message = "🕒 *Cruise Schedule*\n\n*Morning:* 9:00 AM - 10:30 AM\n*Afternoon:* 1:30 PM - 3:00 PM\n*Sunset:* 5:00 PM - 6:30 PM\n*Evening:* 7:30 PM - 9:00 PM\n\n⏰ *Reporting Time:* 1 hour before cruise"
         
-        send_whatsapp_message(phone_number, message)
-        send_main_menu(phone_number, language)
+        send_main_menu(phone_number, language, info_text=message)
     
     elif interaction_id == "contact":
         contact = CRUISE_CONFIG["contact"]
@@ -1304,8 +5773,7 @@ def handle_interactive_message(phone_number, interaction_id):
         else:
             message = f"📞 *Contact Information*\n\n*Phone:* {contact['phone1']} | {contact['phone2']}\n*Location:* {contact['location']}\n*Email:* {contact['email']}\n*Website:* {contact['website']}\n\n⏰ *Working Hours:* 8:00 AM - 10:00 PM"
         
-        send_whatsapp_message(phone_number, message)
-        send_main_menu(phone_number, language)
+        send_main_menu(phone_number, language, info_text=message)
     
     # Cruise type selection
     elif interaction_id.startswith("cruise_"):
@@ -1322,26 +5790,144 @@ def handle_interactive_message(phone_number, interaction_id):
     elif interaction_id == "cancel_booking":
         cancel_booking(phone_number, language)
 
+# Steps answered by tapping a list or button, not by typing
+BUTTON_STEPS = {"awaiting_cruise_type", "awaiting_payment"}
+GREETINGS = ["hi", "hello", "hey", "مرحبا", "اهلا", "السلام"]
+
 def handle_text_message(phone_number, text):
     """Handle text message responses"""
     session = user_sessions.get(phone_number, {})
     language = session.get('language', 'english')
-    
-    # Store user message
-    store_chat_message(phone_number, text, "user")
+    greeting = text.lower() in GREETINGS
     
     # New user - send language menu
-    if not session and text.lower() in ["hi", "hello", "hey", "مرحبا", "اهلا", "السلام"]:
+    if not session and greeting:
         send_language_menu(phone_number)
         return
     
-    # Handle booking flow
-    if session and session.get('step', '').startswith('awaiting_'):
+    # Every branch below answers with exactly one message
+    step = (session.get('step') if session else None) or ''
+    menu_shown = not step and session and session.get('flow') == 'main_menu'
+    if step in BUTTON_STEPS or (menu_shown and not greeting):
+        # The menu or buttons for this step are already on screen; point back to them
+        send_whatsapp_message(phone_number, MESSAGES[language]["choose_option"])
+    elif step.startswith('awaiting_'):
         handle_booking_step(phone_number, text, language, session)
     else:
         # Fallback to main menu
         send_main_menu(phone_number, language)
 
+# ==============================
+# HTTP CACHING
+# ==============================
+# Dashboard endpoints are versioned by in-process counters that are bumped
+# whenever the underlying data changes. The ETag is derived from the counter
+# (never from the body), so an unchanged poll is answered with 304 before
+# the view runs or serializes anything.
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 5))
+GZIP_MIMETYPES = {"application/json", "text/csv", "text/plain", "text/html"}
+
+# Sessions and chat live in each worker's memory, so their counters are per
+# process; the epoch keeps them from colliding across workers and restarts.
+# Bookings in the SQLite store are versioned by the database itself, which
+# every worker shares, so their ETags revalidate on any worker.
+DATA_VERSION_EPOCH = f"{os.getpid():x}{int(time.time()):x}"
+data_versions_lock = threading.Lock()
+data_versions = {"bookings": 0, "sessions": 0, "chat": 0}
+
+# endpoint -> (data versions it depends on, Cache-Control)
+HTTP_CACHE_ROUTES = {
+    "get_all_bookings": (("bookings",), "private, no-cache"),
+    "get_booking_changes": (("bookings",), "private, no-cache"),
+    "get_booking": (("bookings",), "private, no-cache"),
+    "get_customer_bookings": (("bookings",), "private, no-cache"),
+    "search_customers": (("bookings",), "private, no-cache"),
+    "get_capacity_for_date": (("bookings",), "private, no-cache"),
+    "generate_daily_report": (("bookings",), "private, max-age=30, must-revalidate"),
+    "get_passenger_manifest": (("bookings",), "private, no-cache"),
+    "get_active_sessions": (("sessions",), "private, no-cache"),
+    "get_sessions": (("sessions",), "private, no-cache"),
+    "list_sessions": (("sessions",), "private, no-cache"),
+    "get_user_session": (("sessions",), "private, no-cache"),
+    "get_chat_users": (("chat",), "private, no-cache"),
+    "get_chat_history_endpoint": (("chat",), "private, no-cache"),
+    "get_dashboard_summary": (("bookings", "sessions", "chat"), "private, no-cache")
+}
+NO_STORE_ENDPOINTS = {"handle_webhook", "verify_webhook", "health_check", "debug_sheets"}
+
+def bump_data_version(resource):
+    """Invalidate cached representations that depend on resource"""
+    with data_versions_lock:
+        data_versions[resource] += 1
+
+@register_booking_listener
+def _bump_bookings_version(op, row_number, record, previous):
+    bump_data_version("bookings")
+
+def _data_version(resource):
+    if resource == "bookings" and isinstance(booking_store, SqliteBookingStore):
+        return f"{booking_store.epoch}.{booking_store.loaded_version}"
+    with data_versions_lock:
+        return f"{DATA_VERSION_EPOCH}.{data_versions[resource]}"
+
+def _current_etag(resources):
+    version = "-".join(_data_version(resource) for resource in resources)
+    # The day is part of the key because "today" figures roll over at midnight
+    variant = zlib.crc32(f"{tenants.current().key}|{request.full_path}|{datetime.now():%Y%m%d}".encode())
+    encoding = "-gz" if "gzip" in request.headers.get("Accept-Encoding", "") else ""
+    return f"{resources[0]}-{version}-{variant:x}{encoding}"
+
+@app.before_request
+def mark_chat_read():
+    """Opening a conversation clears its unread count, even if the history is then a 304"""
+    if request.method == "GET" and request.endpoint == "get_chat_history_endpoint":
+        if chat_unread.pop(request.view_args["phone_number"], None):
+            bump_data_version("chat")
+
+@app.before_request
+def answer_conditional_request():
+    if request.method != "GET" or request.endpoint not in HTTP_CACHE_ROUTES:
+        return None
+    resources, cache_control = HTTP_CACHE_ROUTES[request.endpoint]
+    if "bookings" in resources:
+        if isinstance(booking_store, SqliteBookingStore):
+            # Catch up with other workers' writes so the version is current
+            booking_store.ensure_loaded()
+        elif not booking_changes.loaded:
+            # Until the first full read we have no version to compare against
+            return None
+    g.etag = _current_etag(resources)
+    if request.if_none_match.contains(g.etag):
+        response = app.response_class(status=304)
+        response.set_etag(g.etag)
+        response.headers["Cache-Control"] = cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+    return None
+
+@app.after_request
+def apply_http_caching(response):
+    endpoint = request.endpoint
+    if endpoint in HTTP_CACHE_ROUTES:
+        if response.status_code == 200 and "etag" in g:
+            response.set_etag(g.etag)
+        response.headers["Cache-Control"] = HTTP_CACHE_ROUTES[endpoint][1]
+    elif endpoint in NO_STORE_ENDPOINTS:
+        response.headers["Cache-Control"] = "no-store"
+    
+    if (response.status_code == 200
+            and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in GZIP_MIMETYPES
+            and "gzip" in request.headers.get("Accept-Encoding", "")):
+        body = response.get_data()
+        if len(body) >= GZIP_MIN_BYTES:
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+            response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
 # ==============================
 # CORS SETUP
 # ==============================
@@ -1362,6 +5948,7 @@ if __name__ == "__main__":
     logger.info(f"🚀 Starting Sindbad Ship Cruises WhatsApp Bot on port {port}")
     logger.info(f"💳 PAYMENT MODE: SIMULATION")
     logger.info(f"📊 Google Sheets: {'Connected' if sheet else 'Not Available'}")
+    logger.info(f"🗃️ Booking store: {booking_store.name}")
     logger.info(f"💬 Chat system: ENABLED")
     
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
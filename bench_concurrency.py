@@ -0,0 +1,154 @@
+"""
+Concurrent-connection benchmark: sync workers vs gevent workers
+
+Starts a stub Graph API that answers every send after GRAPH_DELAY seconds,
+runs the app under gunicorn in each serving mode, fires CONCURRENCY
+simultaneous webhook messages at it and reports completion, throughput and
+latency percentiles.
+
+Usage:
+    python bench_concurrency.py [--concurrency 200] [--graph-delay 1.0] [--workers 2]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_graph_api(delay):
+    """Stub Graph API that is slow but always succeeds"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            body = json.dumps({"messages": [{"id": f"wamid.bench{time.time_ns()}"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app(mode, workers, graph_url):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "SERVE_MODE": mode,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "GRAPH_API_URL": graph_url,
+        "ACCESS_TOKEN": "bench",
+        "LOG_LEVEL": "WARNING",
+        "GUNICORN_TIMEOUT": "120"
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base}/api/health", timeout=1).ok:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"app did not start in {mode} mode")
+
+
+def webhook_payload(i):
+    return {
+        "entry": [{"changes": [{"value": {"messages": [{
+            "from": f"9689{i:07d}",
+            "id": f"wamid.in{i}",
+            "type": "text",
+            "text": {"body": "hello"}
+        }]}}]}]
+    }
+
+
+def run_load(base, concurrency, request_timeout):
+    def one(i):
+        started = time.perf_counter()
+        try:
+            ok = requests.post(f"{base}/webhook", json=webhook_payload(i), timeout=request_timeout).ok
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    completed = len(latencies)
+    return {
+        "completed": completed,
+        "failed": concurrency - completed,
+        "wall_seconds": round(wall, 2),
+        "throughput_rps": round(completed / wall, 1) if wall else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--graph-delay", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--modes", default="sync,gevent")
+    args = parser.parse_args()
+
+    stub = start_stub_graph_api(args.graph_delay)
+    graph_url = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    print(f"{args.concurrency} concurrent webhooks, {args.workers} workers, "
+          f"Graph API latency {args.graph_delay}s")
+    print(f"{'mode':<8} {'ok':>5} {'fail':>5} {'wall s':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for mode in args.modes.split(","):
+            proc, base = start_app(mode, args.workers, graph_url)
+            try:
+                result = run_load(base, args.concurrency, args.timeout)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            print(f"{mode:<8} {result['completed']:>5} {result['failed']:>5} {result['wall_seconds']:>8} "
+                  f"{result['throughput_rps']:>8} {str(result['p50_ms']):>8} {str(result['p95_ms']):>8}")
+    finally:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Gunicorn configuration for the Sindbad Ship Cruises WhatsApp API
+#
+#   gunicorn app:app                  # uses this file automatically
+#   SERVE_MODE=sync gunicorn app:app  # classic blocking workers
+#
+# SERVE_MODE=gevent runs cooperative green-thread workers: while a request
+# waits on Google Sheets or the Graph API its socket yields, so one worker
+# process can hold hundreds of in-flight webhooks instead of one.
+#
+# sqlite3 calls run in C and never yield to gevent, so with the opt-in SQLite
+# booking store (or an outbox database) every save, capacity check and outbox
+# poll would stall the whole worker. gthread is the default then; real
+# threads release the GIL around SQLite and keep serving. SERVE_MODE=gevent still
+# forces green threads for deployments that accept that trade-off.
+import multiprocessing
+import os
+
+SQLITE_IN_USE = (
+    os.environ.get("BOOKING_STORE", "sheets").lower() == "sqlite"
+    or bool(os.environ.get("OUTBOX_DB_PATH"))
+)
+SERVE_MODE = os.environ.get("SERVE_MODE", "gthread" if SQLITE_IN_USE else "gevent").lower()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# The app starts its Sheets scheduler and logging listener threads lazily per
+# process; preloading would create them (and their locks) before gevent has
+# patched the worker, so leave preload off.
+preload_app = False
+
+if SERVE_MODE == "gevent":
+    try:
+        import gevent  # noqa: F401
+        worker_class = "gevent"
+        worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 500))
+    except ImportError:
+        SERVE_MODE = "gthread"
+
+if SERVE_MODE == "gthread":
+    worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", 16))
+elif SERVE_MODE == "sync":
+    worker_class = "sync"
+
+# Requests one worker serves at once; the app's admission control keeps
+# WEBHOOK_RESERVED_SLOTS of these free for customer webhooks.
+os.environ.setdefault("WORKER_CONCURRENCY", str({
+    "gevent": globals().get("worker_connections", 1),
+    "gthread": globals().get("threads", 1)
+}.get(SERVE_MODE, 1)))
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
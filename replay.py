@@ -0,0 +1,344 @@
+"""
+Replay recorded webhook traffic against stubbed Google Sheets and Graph API
+
+Feeds recordings made with WEBHOOK_RECORD_DIR (gzip JSONL, one payload per
+line with its arrival time) back into the app in-process, at real speed, a
+multiple of it or as fast as possible. Messages from one sender are replayed
+in order on one worker, as WhatsApp delivers them. Reports webhook latency
+percentiles per outcome and how many Sheets and Graph API calls the traffic
+caused, so a change can be checked against real traffic shapes.
+
+Usage:
+    python replay.py recordings/ [--speed 1|10|max] [--workers 16]
+                     [--graph-delay 0.2] [--sheets-delay 0.3] [--json]
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_concurrency import free_port
+
+
+def recording_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "*.jsonl.gz")))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(files)
+
+
+def load_recording(paths):
+    """All recorded (arrival time, payload) events, oldest first"""
+    events = []
+    for path in recording_files(paths):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        events.append((record["ts"], record["payload"]))
+        except (EOFError, zlib.error):
+            # A file the app is still writing has no gzip trailer yet
+            pass
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def sender_of(payload):
+    try:
+        return payload["entry"][0]["changes"][0]["value"]["messages"][0]["from"]
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+def start_stub_graph_api(delay, calls):
+    """Stub Graph API that counts sends by message type"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            calls[f"graph.{body.get('type', 'other')}"] += 1
+            time.sleep(delay)
+            response = json.dumps({"messages": [{"id": f"wamid.replay{time.time_ns()}"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StubWorksheet:
+    """In-memory worksheet answering the gspread calls the app makes"""
+
+    _ids = 0
+
+    def __init__(self, title, calls, delay, header=None):
+        StubWorksheet._ids += 1
+        self.id = StubWorksheet._ids
+        self.title = title
+        self.calls = calls
+        self.delay = delay
+        self.rows = [list(header)] if header else []
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        self.calls[f"sheets.{name}"] += 1
+        time.sleep(self.delay)
+
+    def _updated_range(self, first, last):
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:Z{last}"}}
+
+    def row_values(self, row):
+        self._call("row_values")
+        with self.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def acell(self, label):
+        self._call("acell")
+        with self.lock:
+            value = self.rows[0][0] if self.rows and self.rows[0] else ""
+        return type("Cell", (), {"value": value})()
+
+    def append_row(self, values, **kwargs):
+        return self._append("append_row", [values])
+
+    def append_rows(self, rows, **kwargs):
+        return self._append("append_rows", rows)
+
+    def _append(self, name, rows):
+        self._call(name)
+        with self.lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(value) for value in row] for row in rows)
+            return self._updated_range(first, len(self.rows))
+
+    def update(self, start, values, **kwargs):
+        self._call("update")
+        with self.lock:
+            header = self.rows[0] if self.rows else []
+            header.extend(values[0])
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        with self.lock:
+            header, rows = self.rows[0], self.rows[1:]
+            return [dict(zip(header, _numericise(row))) for row in rows]
+
+    def batch_get(self, ranges, major_dimension="ROWS", **kwargs):
+        self._call("batch_get")
+        from gspread.utils import a1_to_rowcol
+        result = []
+        with self.lock:
+            for cell_range in ranges:
+                first_row, col = a1_to_rowcol(cell_range.split(":")[0])
+                column = [row[col - 1] if col <= len(row) else "" for row in self.rows[first_row - 1:]]
+                while column and column[-1] == "":
+                    column.pop()
+                result.append([column] if column else [])
+        return result
+
+    def update_title(self, title):
+        self._call("update_title")
+        self.title = title
+
+    def hide(self):
+        self._call("hide")
+
+
+def _numericise(row):
+    from gspread.utils import numericise
+    return [numericise(value) for value in row]
+
+
+class StubSpreadsheet:
+    def __init__(self, calls, delay, header):
+        self.calls = calls
+        self.delay = delay
+        self.sheets = [StubWorksheet("Sindbad Ship Cruises", calls, delay, header)]
+
+    def worksheets(self):
+        self.calls["sheets.worksheets"] += 1
+        return list(self.sheets)
+
+    def worksheet(self, title):
+        self.calls["sheets.worksheet"] += 1
+        return next(sheet for sheet in self.sheets if sheet.title == title)
+
+    def add_worksheet(self, title, rows, cols):
+        self.calls["sheets.add_worksheet"] += 1
+        sheet = StubWorksheet(title, self.calls, self.delay)
+        self.sheets.append(sheet)
+        return sheet
+
+
+def load_app(args, graph_url, calls):
+    """Import the app against the stubs, with its own throwaway booking database"""
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.environ.update({
+        "GRAPH_API_URL": graph_url,
+        "ACCESS_TOKEN": "replay",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+        "BOOKING_STORE": args.store,
+        "BOOKING_DB_PATH": os.path.join(workdir, "bookings.db"),
+        "WEBHOOK_RECORD_DIR": ""
+    })
+    # Compressing time compresses each sender's message rate by the same factor
+    if "INBOUND_RATE_PER_MINUTE" not in os.environ:
+        scale = 1_000_000 if args.speed == "max" else float(args.speed)
+        os.environ["INBOUND_RATE_PER_MINUTE"] = str(20 * scale)
+    import app as server
+
+    spreadsheet = StubSpreadsheet(calls, args.sheets_delay, server.required_headers)
+    server.spreadsheet = spreadsheet
+    server.sheet = spreadsheet.sheets[0]
+    server.partition_router.discover(spreadsheet, server.sheet, server.sheet_columns)
+    calls.clear()
+    return server
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"count": 0}
+    latencies = sorted(latencies)
+
+    def at(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 1)
+
+    return {
+        "count": len(latencies),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": round(latencies[-1] * 1000, 1)
+    }
+
+
+def replay(server, events, speed, workers):
+    """Post every event at its scaled arrival time; returns per-event results"""
+    results = []
+    results_lock = threading.Lock()
+    lanes = [queue.Queue() for _ in range(workers)]
+
+    def worker(lane):
+        client = server.app.test_client()
+        while True:
+            item = lane.get()
+            if item is None:
+                return
+            due, payload = item
+            started = time.perf_counter()
+            response = client.post("/webhook", json=payload)
+            latency = time.perf_counter() - started
+            body = response.get_json(silent=True) or {}
+            outcome = body.get("status") or f"http_{response.status_code}"
+            with results_lock:
+                results.append((outcome, latency, max(0.0, started - due)))
+
+    threads = [threading.Thread(target=worker, args=(lane,), daemon=True) for lane in lanes]
+    for thread in threads:
+        thread.start()
+
+    first_ts = events[0][0]
+    started = time.perf_counter()
+    for ts, payload in events:
+        due = started if speed == "max" else started + (ts - first_ts) / float(speed)
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        lanes[hash(sender_of(payload)) % workers].put((due, payload))
+    for lane in lanes:
+        lane.put(None)
+    for thread in threads:
+        thread.join()
+    # Sends are made by the outbox senders; count them all before reporting
+    deadline = time.perf_counter() + 120
+    while server.OUTBOX_ENABLED and server.outbox.backlog() and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="recording files, globs or directories")
+    parser.add_argument("--speed", default="1", help="1, 10, any multiplier, or max")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--graph-delay", type=float, default=0.2)
+    parser.add_argument("--sheets-delay", type=float, default=0.3)
+    parser.add_argument("--store", default="sqlite", choices=["sqlite", "sheets"])
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N events")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    events = load_recording(args.recordings)
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        parser.error("no recorded events found")
+
+    calls = Counter()
+    stub = start_stub_graph_api(args.graph_delay, calls)
+    try:
+        server = load_app(args, f"http://127.0.0.1:{stub.server_address[1]}", calls)
+        results, wall = replay(server, events, args.speed, args.workers)
+    finally:
+        stub.shutdown()
+
+    by_outcome = {}
+    for outcome, latency, _ in results:
+        by_outcome.setdefault(outcome, []).append(latency)
+    report = {
+        "events": len(events),
+        "recorded_span_seconds": round(events[-1][0] - events[0][0], 1),
+        "speed": args.speed,
+        "wall_seconds": round(wall, 2),
+        "throughput_rps": round(len(results) / wall, 1) if wall else 0.0,
+        "max_dispatch_lag_ms": round(max(lag for _, _, lag in results) * 1000, 1),
+        "latency": percentiles([latency for _, latency, _ in results]),
+        "latency_by_outcome": {outcome: percentiles(values) for outcome, values in sorted(by_outcome.items())},
+        "dependency_calls": dict(sorted(calls.items())),
+        "sheets_calls": sum(count for name, count in calls.items() if name.startswith("sheets.")),
+        "graph_calls": sum(count for name, count in calls.items() if name.startswith("graph."))
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['events']} events over {report['recorded_span_seconds']}s replayed at {args.speed}x "
+          f"in {report['wall_seconds']}s ({report['throughput_rps']} req/s, "
+          f"max dispatch lag {report['max_dispatch_lag_ms']} ms)")
+    print(f"{'outcome':<22} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for outcome, stats in [("all", report["latency"])] + list(report["latency_by_outcome"].items()):
+        print(f"{outcome:<22} {stats['count']:>6} {stats['p50_ms']:>8} {stats['p90_ms']:>8} "
+              f"{stats['p99_ms']:>8} {stats['max_ms']:>8}")
+    print(f"Sheets calls: {report['sheets_calls']}  Graph API calls: {report['graph_calls']}")
+    for name, count in report["dependency_calls"].items():
+        print(f"  {name:<28} {count:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Shared fixtures: the app imported once against stubbed Google Sheets and
+Graph API, with its own throwaway SQLite database and a second tenant
+"""
+import itertools
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix="app-tests-")
+SECOND_TENANT = {"key": "boat2", "phone_number_id": "222000", "name": "Boat Two"}
+
+os.environ.update({
+    "ACCESS_TOKEN": "test",
+    "LOG_LEVEL": "CRITICAL",
+    "LOG_ASYNC": "false",
+    "BOOKING_STORE": "sqlite",
+    "BOOKING_DB_PATH": os.path.join(WORKDIR, "bookings.db"),
+    "BOOKING_SYNC_INTERVAL": "0",
+    "OUTBOX_ENABLED": "false",
+    "TRACE_FILE": "",
+    "WEBHOOK_RECORD_DIR": "",
+    "INBOUND_RATE_PER_MINUTE": "100000",
+    "INBOUND_BURST": "1000",
+    "OUTBOUND_MAX_RATE": "100000",
+    "OUTBOUND_BURST": "1000",
+    "TENANTS_CONFIG": json.dumps([SECOND_TENANT])
+})
+os.environ.pop("GOOGLE_CREDS_JSON", None)
+
+from replay import StubSpreadsheet  # noqa: E402
+import app as server_module  # noqa: E402
+
+_phones = itertools.count(90100001)
+_booking_ids = itertools.count(1)
+
+
+class GraphResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class StubGraph:
+    """Records every Graph API send; queue (status, body) pairs to fail some"""
+
+    def __init__(self):
+        self.sent = []
+        self.responses = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.sent.append({"url": url, "payload": json})
+        if self.responses:
+            return GraphResponse(*self.responses.pop(0))
+        return GraphResponse(200, {"messages": [{"id": f"wamid.test{len(self.sent)}"}]})
+
+    def texts_to(self, phone):
+        return [
+            entry["payload"].get("text", {}).get("body", "")
+            for entry in self.sent if entry["payload"].get("to") == phone
+        ]
+
+
+@pytest.fixture(scope="session")
+def server():
+    calls = Counter()
+    spreadsheet = StubSpreadsheet(calls, 0, server_module.required_headers)
+    server_module.spreadsheet = spreadsheet
+    server_module.sheet = spreadsheet.sheets[0]
+    server_module.partition_router.discover(spreadsheet, server_module.sheet, server_module.sheet_columns)
+    return server_module
+
+
+@pytest.fixture
+def graph(server, monkeypatch):
+    stub = StubGraph()
+    monkeypatch.setattr(server.graph_session, "post", stub.post)
+    return stub
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def phone():
+    """A WhatsApp ID no other test uses"""
+    return f"968{next(_phones)}"
+
+
+def webhook_payload(phone, text=None, reply=None, phone_number_id=None, name="Test Guest"):
+    message = {"from": phone, "id": f"wamid.in{phone}{next(_booking_ids)}", "type": "text"}
+    if text is not None:
+        message["text"] = {"body": text}
+    if reply is not None:
+        message["type"] = "interactive"
+        message["interactive"] = {"type": "list_reply", "list_reply": {"id": reply, "title": reply}}
+    value = {
+        "messaging_product": "whatsapp",
+        "contacts": [{"wa_id": phone, "profile": {"name": name}}],
+        "messages": [message]
+    }
+    if phone_number_id is not None:
+        value["metadata"] = {"phone_number_id": phone_number_id}
+    return {"entry": [{"changes": [{"value": value}]}]}
+
+
+def make_booking(server, tenant=None, **fields):
+    """Save a booking through the app as tenant (default tenant if None); returns its data"""
+    booking = {
+        "booking_id": f"SDBT{next(_booking_ids):06d}",
+        "name": "Test Guest",
+        "phone": "91234567",
+        "whatsapp_id": "96891234567",
+        "cruise_date": "01/01/2030",
+        "cruise_type": "morning",
+        "adults_count": 2,
+        "children_count": 0,
+        "infants_count": 0,
+        "total_guests": 2,
+        "total_amount": 5.0
+    }
+    booking.update(fields)
+    with server.tenant_context(tenant or server.tenants.default):
+        assert server.save_booking_to_sheets(booking, "english")
+    return booking
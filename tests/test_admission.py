@@ -0,0 +1,63 @@
+import threading
+import time
+
+from conftest import webhook_payload
+
+
+def fill(lane, monkeypatch):
+    """Make lane look saturated, with no room left in its queue"""
+    monkeypatch.setattr(lane, "active", lane.max_concurrent)
+    monkeypatch.setattr(lane, "max_queue", 0)
+
+
+def test_saturated_heavy_lane_sheds_with_retry_after(server, client, monkeypatch):
+    fill(server.admission.lanes["admin_heavy"], monkeypatch)
+
+    response = client.get("/api/bookings")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(server.ADMISSION_RETRY_AFTER)
+    assert response.get_json()["lane"] == "admin_heavy"
+    # Lighter dashboard calls, probes and webhooks are unaffected
+    assert client.get("/api/sessions").status_code == 200
+    assert client.get("/api/health").status_code == 200
+
+
+def test_webhooks_are_admitted_while_dashboard_lanes_are_full(server, client, graph, phone, monkeypatch):
+    fill(server.admission.lanes["admin"], monkeypatch)
+    fill(server.admission.lanes["admin_heavy"], monkeypatch)
+
+    assert client.get("/api/sessions").status_code == 503
+    assert client.post("/webhook", json=webhook_payload(phone, text="hello")).status_code == 200
+
+
+def test_dashboard_never_takes_the_reserved_webhook_slots(server, client, monkeypatch):
+    monkeypatch.setattr(server, "WORKER_CONCURRENCY", 10)
+    monkeypatch.setattr(server, "WEBHOOK_RESERVED_SLOTS", 8)
+    monkeypatch.setattr(server.admission.lanes["webhook"], "active", 2)
+    monkeypatch.setattr(server, "ADMISSION_QUEUE_TIMEOUT", 0.05)
+
+    response = client.get("/api/sessions")
+
+    assert response.status_code == 503
+
+
+def test_queued_request_is_admitted_when_a_slot_frees(server, monkeypatch):
+    monkeypatch.setattr(server, "ADMISSION_QUEUE_TIMEOUT", 2.0)
+    controller = server.AdmissionController()
+    lane = server.AdmissionLane("test", max_concurrent=1, max_queue=1)
+    assert controller.acquire(lane)
+
+    releaser = threading.Timer(0.05, controller.release, args=(lane,))
+    releaser.start()
+    started = time.monotonic()
+    assert controller.acquire(lane)
+    releaser.join()
+
+    assert time.monotonic() - started >= 0.04
+    assert lane.stats["queued"] == 1
+    assert lane.active == 1
+    # The queue holds one waiter; a second would be shed at once
+    monkeypatch.setattr(lane, "waiting", 1)
+    assert controller.acquire(lane) is False
+    assert lane.stats["shed_queue_full"] == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import make_booking
+
+
+def booking(whatsapp_id, status="Confirmed", slot="Sunset Cruise", language="Arabic", date="05/01/2030"):
+    return {
+        "WhatsApp ID": whatsapp_id, "Booking Status": status, "Cruise Type": slot,
+        "Language": language, "Cruise Date": date, "Timestamp": "2029-12-20 10:00:00"
+    }
+
+
+@pytest.fixture
+def index(server):
+    index = server.AudienceIndex()
+    index.apply("append", ("p", 2), booking("96891111111"), None)
+    index.apply("append", ("p", 3), booking("96892222222", status="Pending", language="English"), None)
+    index.apply("append", ("p", 4), booking("96893333333", slot="Morning Cruise"), None)
+    return index
+
+
+def resolve(server, index, segment):
+    return index.resolve(server.parse_segment(segment), server.DEFAULT_TENANT_KEY)
+
+
+def test_terms_are_anded_ored_and_negated(server, index):
+    assert resolve(server, index, "language:arabic slot:sunset") == {"96891111111"}
+    assert resolve(server, index, "status:confirmed|pending -slot:morning") == {"96891111111", "96892222222"}
+    assert resolve(server, index, "pending") == {"96892222222"}
+    assert resolve(server, index, "date:05/01/2030..06/01/2030") == {"96891111111", "96892222222", "96893333333"}
+
+
+def test_customer_stays_until_their_last_matching_booking_goes(server, index):
+    second = booking("96891111111", date="09/01/2030")
+    index.apply("append", ("p", 5), second, None)
+    index.apply("update", ("p", 2), booking("96891111111", status="Cancelled"), booking("96891111111"))
+    assert "96891111111" in resolve(server, index, "status:confirmed")
+
+    index.apply("update", ("p", 5), dict(second, **{"Booking Status": "Cancelled"}), second)
+    assert "96891111111" not in resolve(server, index, "status:confirmed")
+    assert resolve(server, index, "status:cancelled") == {"96891111111"}
+
+
+def test_bookings_without_a_whatsapp_id_are_counted_as_rejected(server, index):
+    index.apply("append", ("p", 9), booking(""), None)
+    status = index.status(server.DEFAULT_TENANT_KEY)
+    assert status["rejected_bookings"] == 1
+    assert status["customers"] == 3
+
+
+def test_each_vessel_reaches_only_its_own_customers(server, index):
+    index.apply("append", ("p", 6), dict(booking("96894444444"), Vessel="boat2"), None)
+
+    assert index.resolve(server.parse_segment("all"), "boat2") == {"96894444444"}
+    assert "96894444444" not in resolve(server, index, "all")
+    assert index.resolve(server.parse_segment("all"), "nobody") == set()
+
+
+def test_broadcast_counts_the_requesting_tenants_audience(server, client):
+    def counts():
+        default = client.get("/api/audience/count", query_string={"segment": "all"}).get_json()["count"]
+        boat2 = client.post("/api/broadcast", json={"segment": "all", "dry_run": True}, headers={"X-Tenant": "boat2"})
+        return default, boat2.get_json()["total_recipients"]
+
+    default, boat2 = counts()
+    make_booking(server, tenant=server.tenants.get("boat2"), whatsapp_id="96895555555")
+
+    assert counts() == (default, boat2 + 1)
+
+
+@pytest.mark.parametrize("segment", ["slot:brunch", "colour:blue", "status:", "cruise_within:soon", "date:01/01/2020..01/01/2030"])
+def test_bad_segments_are_rejected(server, client, segment):
+    with pytest.raises(ValueError):
+        server.parse_segment(segment)
+    assert client.get("/api/audience/count", query_string={"segment": segment}).status_code == 400
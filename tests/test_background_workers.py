@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+
+import pytest
+
+RealThread = threading.Thread
+real_getpid = os.getpid
+
+
+class CountingThread:
+    """Stands in for threading.Thread and records what was started"""
+    started = []
+
+    def __init__(self, target=None, name=None, daemon=None):
+        self.name = name
+
+    def start(self):
+        CountingThread.started.append(self.name)
+
+
+def slow_getpid():
+    # Widens the gap between checking the pid and recording it
+    time.sleep(0.01)
+    return real_getpid()
+
+
+def race(ensure_started, callers=8):
+    barrier = threading.Barrier(callers)
+
+    def call():
+        barrier.wait()
+        ensure_started()
+
+    threads = [RealThread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@pytest.fixture
+def counting_threads(server, monkeypatch):
+    CountingThread.started = []
+    monkeypatch.setattr(server.threading, "Thread", CountingThread)
+    monkeypatch.setattr(server.os, "getpid", slow_getpid)
+    return CountingThread.started
+
+
+def test_manifest_builder_starts_one_thread_per_process(server, counting_threads):
+    race(server.ManifestBuilder().ensure_started)
+    assert counting_threads == ["manifest-builder"]
+
+
+def test_booking_sync_starts_one_thread_per_process(server, counting_threads, monkeypatch):
+    monkeypatch.setattr(server, "BOOKING_SYNC_INTERVAL", 60)
+    race(server.BookingChangeLog(10).ensure_sync_thread)
+    assert counting_threads == ["booking-sync"]
+
+
+def test_booking_exporter_starts_one_thread_per_process(server, counting_threads, monkeypatch):
+    store = server.booking_store
+    monkeypatch.setattr(store, "export_pid", None)
+    race(store.ensure_started)
+    assert counting_threads == ["booking-exporter"]
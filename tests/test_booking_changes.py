@@ -0,0 +1,69 @@
+import sqlite3
+
+from conftest import make_booking
+
+
+def cursor_of(client):
+    return client.get("/api/bookings/changes").get_json()["cursor"]
+
+
+def insert_as_other_worker(server, booking_id):
+    """Write a booking the way another gunicorn worker would: straight to the database"""
+    values = [""] * len(server.required_headers)
+    values[server.required_headers.index("Booking ID")] = booking_id
+    values[server.required_headers.index("Cruise Date")] = "03/03/2031"
+    conn = sqlite3.connect(server.booking_store.path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    server.booking_store._insert(conn, values)
+    conn.execute("COMMIT")
+    version = conn.execute("SELECT MAX(version) FROM bookings").fetchone()[0]
+    conn.close()
+    return version
+
+
+def test_changes_since_cursor_returns_only_new_bookings(server, client):
+    cursor = cursor_of(client)
+    booking = make_booking(server)
+
+    body = client.get(f"/api/bookings/changes?since={cursor}").get_json()
+
+    assert body["reset"] is False
+    assert [change["record"]["Booking ID"] for change in body["changes"]] == [booking["booking_id"]]
+    assert body["changes"][0]["op"] == "append"
+    again = client.get(f"/api/bookings/changes?since={body['cursor']}").get_json()
+    assert again["reset"] is False and again["count"] == 0
+
+
+def test_unknown_cursor_resets_with_full_snapshot(server, client):
+    make_booking(server)
+    body = client.get("/api/bookings/changes?since=deadbeef.1").get_json()
+    assert body["reset"] is True
+    assert body["count"] == len(body["bookings"]) == len(body["rows"]) > 0
+
+
+def test_cursor_is_shared_by_every_worker_on_the_database(server, client):
+    epoch = cursor_of(client).split(".")[0]
+    assert epoch == server.booking_store.epoch
+
+    cursor = cursor_of(client)
+    version = insert_as_other_worker(server, "SDBOTHERWORKER")
+    # The other worker's cursor is ahead of this worker's log until it catches up
+    body = client.get(f"/api/bookings/changes?since={cursor}").get_json()
+    assert body["reset"] is False
+    assert [change["record"]["Booking ID"] for change in body["changes"]] == ["SDBOTHERWORKER"]
+    assert body["cursor"] == f"{epoch}.{version}"
+
+    other_cursor = f"{epoch}.{version}"
+    assert client.get(f"/api/bookings/changes?since={other_cursor}").get_json()["reset"] is False
+
+
+def test_cursor_older_than_the_log_resets(server):
+    log = server.BookingChangeLog(3)
+    for row in range(5):
+        log.record_append(("p", row), {"Booking ID": f"B{row}"})
+    epoch = log.epoch
+
+    assert log.changes_since(f"{epoch}.1")[0] is None
+    changes, cursor = log.changes_since(f"{epoch}.2")
+    assert [change["record"]["Booking ID"] for change in changes] == ["B2", "B3", "B4"]
+    assert cursor == f"{epoch}.5"
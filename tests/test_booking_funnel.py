@@ -0,0 +1,58 @@
+from conftest import webhook_payload
+
+
+def step(funnel, language, old, new, seconds=1.0, reason=None):
+    funnel.on_step_change({"language": language}, old, new, seconds, reason)
+
+
+def by_step(report):
+    return {item["step"]: item for item in report["steps"]}
+
+
+def test_conversion_and_dropoffs(server):
+    funnel = server.BookingFunnel()
+    for _ in range(4):
+        step(funnel, "english", None, "awaiting_name")
+    for _ in range(3):
+        step(funnel, "english", "awaiting_name", "awaiting_phone", seconds=20)
+    step(funnel, "english", "awaiting_name", None, seconds=4000, reason="expired")
+
+    report = funnel.report(60)
+    steps = by_step(report)
+    assert report["started"] == 4
+    assert steps["awaiting_name"]["exited"] == 4
+    assert steps["awaiting_name"]["conversion_to_next"] == 0.75
+    assert steps["awaiting_name"]["dropoffs"] == {"expired": 1}
+    assert steps["awaiting_name"]["time_in_step"]["p50"] == "<=30s"
+    assert steps["awaiting_name"]["time_in_step"]["p99"] == ">3600s"
+
+
+def test_report_filters_by_language(server):
+    funnel = server.BookingFunnel()
+    step(funnel, "english", None, "awaiting_name")
+    step(funnel, "arabic", None, "awaiting_name")
+    funnel.record_retry("awaiting_name", "arabic")
+
+    arabic = funnel.report(15, "arabic")
+    assert arabic["started"] == 1
+    assert by_step(arabic)["awaiting_name"]["retries_by_language"] == {"arabic": 1}
+    assert by_step(arabic)["awaiting_name"]["time_in_step"] is None
+    assert funnel.report(15)["started"] == 2
+
+
+def test_invalid_answer_counts_as_a_retry(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    client.post("/webhook", json=webhook_payload(phone, reply="book_cruise"))
+    client.post("/webhook", json=webhook_payload(phone, text="Test Guest"))
+    before = by_step(server.booking_funnel.report(15))["awaiting_phone"]["retries"]
+
+    client.post("/webhook", json=webhook_payload(phone, text="not a number"))
+
+    body = client.get("/api/funnel?window=15m&language=english").get_json()
+    assert by_step(body)["awaiting_phone"]["retries"] == before + 1
+    assert body["window"] == "15m"
+
+
+def test_unknown_window_is_rejected(client):
+    response = client.get("/api/funnel?window=2d")
+    assert response.status_code == 400
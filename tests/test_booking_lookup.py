@@ -0,0 +1,39 @@
+from conftest import make_booking
+
+BOAT2 = {"X-Tenant": "boat2"}
+
+
+def test_booking_is_found_only_by_its_own_tenant(server, client):
+    booking = make_booking(server, tenant=server.tenants.get("boat2"))
+
+    assert client.get(f"/api/bookings/{booking['booking_id']}").status_code == 404
+    response = client.get(f"/api/bookings/{booking['booking_id'].lower()}", headers=BOAT2)
+    assert response.status_code == 200
+    assert response.get_json()["booking"]["Vessel"] == "boat2"
+
+
+def test_reused_booking_id_lists_every_match(server, client):
+    first = make_booking(server, name="First Guest")
+    make_booking(server, booking_id=first["booking_id"], name="Second Guest")
+    make_booking(server, tenant=server.tenants.get("boat2"), booking_id=first["booking_id"])
+
+    response = client.get(f"/api/bookings/{first['booking_id']}")
+
+    assert response.status_code == 409
+    body = response.get_json()
+    assert [match["booking"]["Customer Name"] for match in body["bookings"]] == ["First Guest", "Second Guest"]
+    assert len({match["row"] for match in body["bookings"]}) == 2
+    assert client.get(f"/api/bookings/{first['booking_id']}", headers=BOAT2).status_code == 200
+
+
+def test_customer_bookings_and_search_are_per_tenant(server, client):
+    make_booking(server, name="Zubair Default", whatsapp_id="96899887766")
+    make_booking(server, tenant=server.tenants.get("boat2"), name="Zubair Boat", whatsapp_id="96899887766")
+
+    default = client.get("/api/customers/96899887766/bookings").get_json()
+    boat2 = client.get("/api/customers/96899887766/bookings", headers=BOAT2).get_json()
+    assert [b["Customer Name"] for b in default["bookings"]] == ["Zubair Default"]
+    assert [b["Customer Name"] for b in boat2["bookings"]] == ["Zubair Boat"]
+
+    found = client.get("/api/customers/search?prefix=zub", headers=BOAT2).get_json()["customers"]
+    assert [(c["name"], c["bookings"]) for c in found] == [("Zubair Boat", 1)]
@@ -0,0 +1,54 @@
+from collections import Counter
+
+from replay import StubWorksheet
+
+
+def reordered_headers(server):
+    """The required headers with two columns swapped and an extra staff column first"""
+    headers = list(server.required_headers)
+    date, guests = headers.index("Cruise Date"), headers.index("Total Guests")
+    headers[date], headers[guests] = headers[guests], headers[date]
+    return ["Staff Notes"] + headers
+
+
+def test_columns_are_bound_by_header_name(server):
+    headers = reordered_headers(server)
+    columns = server.bind_columns(headers)
+    assert columns["Cruise Date"] == headers.index("Cruise Date") + 1
+    assert columns["Timestamp"] == 2
+    assert len(columns) == len(server.required_headers)
+
+
+def test_column_range_covers_the_data_rows(server):
+    assert server.column_range(6) == "F2:F"
+    assert server.column_range(27) == "AA2:AA"
+
+
+def test_layout_places_values_under_their_headers(server):
+    headers = reordered_headers(server)
+    partition = server.BookingPartition("2030-01", None, columns=server.bind_columns(headers))
+    values = [f"value of {header}" for header in server.required_headers]
+
+    row = partition.layout(values)
+
+    assert row[0] == ""
+    assert all(row[headers.index(header)] == f"value of {header}" for header in server.required_headers)
+
+
+def test_capacity_read_projects_only_the_four_columns(server):
+    headers = reordered_headers(server)
+    worksheet = StubWorksheet("Sindbad Ship Cruises 2030-01", Counter(), 0, headers)
+    partition = server.BookingPartition("2030-01", worksheet, columns=server.bind_columns(headers))
+    layout = dict(zip(server.required_headers, [""] * len(server.required_headers)))
+    for date, guests, status in (("01/01/2030", 4, "Confirmed"), ("02/01/2030", 2, "Cancelled")):
+        values = dict(layout, **{"Cruise Date": date, "Cruise Type": "Morning Cruise",
+                                 "Total Guests": guests, "Booking Status": status})
+        worksheet.append_row(partition.layout([values[header] for header in server.required_headers]))
+
+    rows = server._read_capacity_columns(partition)
+
+    assert worksheet.calls["sheets.batch_get"] == 1
+    assert rows == [
+        ("01/01/2030", "Morning Cruise", "4", "Confirmed", ""),
+        ("02/01/2030", "Morning Cruise", "2", "Cancelled", "")
+    ]
@@ -0,0 +1,69 @@
+from conftest import webhook_payload
+
+
+def message(text, message_id=1):
+    return {"id": message_id, "message": text, "sender": "user", "type": "text"}
+
+
+def test_arabic_variants_and_case_fold_to_the_same_terms(server):
+    assert server.search_terms("أهلاً بالرحلة") == server.search_terms("اهلا بالرحله")
+    assert server.search_terms("SUNSET Café ٣") == ["sunset", "cafe", "3"]
+
+
+def test_conversations_matching_more_terms_rank_first(server):
+    index = server.ChatSearchIndex()
+    index.add("96890000001", message("sunset sunset sunset"))
+    index.add("96890000002", message("is the sunset cruise full?"))
+    index.add("96890000003", message("morning cruise please"))
+
+    terms, total, conversations = index.search("sunset cruise")
+
+    assert terms == ["sunset", "cruise"]
+    assert total == 3
+    assert [c["phone_number"] for c in conversations][0] == "96890000002"
+    assert conversations[0]["matched_terms"] == ["cruise", "sunset"]
+
+
+def test_prefixes_match_longer_words_at_a_lower_weight(server):
+    index = server.ChatSearchIndex()
+    index.add("96890000001", message("sunset"))
+    index.add("96890000002", message("sun"))
+
+    _, total, conversations = index.search("sun")
+
+    assert total == 2
+    assert conversations[0]["phone_number"] == "96890000002"
+    # Two letters are too short to expand
+    assert index.search("su")[1] == 0
+
+
+def test_trimmed_and_evicted_messages_are_forgotten(server):
+    index = server.ChatSearchIndex(max_postings=4)
+    first = message("dolphin tour", 1)
+    index.add("96890000001", first)
+    index.add("96890000001", message("dinner menu", 2))
+    index.trim("96890000001", [first])
+    assert index.search("dolphin")[1] == 0
+
+    index.add("96890000002", message("life jackets", 1))
+    index.add("96890000002", message("parking space", 2))
+    status = index.status()
+    assert status["postings"] <= 4
+    assert status["evicted"] == 1 and index.search("dinner")[1] == 0
+
+    index.drop("96890000002")
+    assert index.status()["messages"] == 0 and index.vocabulary == []
+
+
+def test_search_endpoint_finds_stored_messages_of_the_current_tenant(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    client.post("/webhook", json=webhook_payload(phone, text="Do you have vegetarian food?"))
+
+    response = client.get("/api/chat/search", query_string={"q": "vegetarian"})
+    boat2 = client.get("/api/chat/search", query_string={"q": "vegetarian"}, headers={"X-Tenant": "boat2"})
+
+    found = response.get_json()["conversations"]
+    assert [c["phone_number"] for c in found] == [phone]
+    assert found[0]["hits"][0]["message"] == "Do you have vegetarian food?"
+    assert boat2.get_json()["total_conversations"] == 0
+    assert client.get("/api/chat/search").status_code == 400
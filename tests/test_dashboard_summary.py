@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from conftest import make_booking, webhook_payload
+
+
+def summary(client, **params):
+    response = client.get("/api/dashboard/summary", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_summary_counts_todays_bookings_and_occupancy(server, client):
+    today = datetime.now().strftime("%d/%m/%Y")
+    before = summary(client)
+
+    make_booking(server, cruise_date=today, cruise_type="sunset", adults_count=3, total_guests=3, total_amount=13.5)
+
+    after = summary(client)
+    assert after["today"]["bookings"] == before["today"]["bookings"] + 1
+    assert after["today"]["revenue"] == round(before["today"]["revenue"] + 13.5, 3)
+    sunset = after["today"]["occupancy"]["Sunset Cruise"]
+    assert sunset["booked"] == before["today"]["occupancy"]["Sunset Cruise"]["booked"] + 3
+    assert sunset["available"] == server.CRUISE_CONFIG["max_capacity"] - sunset["booked"]
+    assert after["totals"]["bookings"] == before["totals"]["bookings"] + 1
+
+
+def test_summary_counts_upcoming_bookings(server, client):
+    next_week = (datetime.now() + timedelta(days=7)).strftime("%d/%m/%Y")
+    before = summary(client)["upcoming"]
+    make_booking(server, cruise_date=next_week, adults_count=4, total_guests=4)
+    after = summary(client)["upcoming"]
+    assert after["bookings"] == before["bookings"] + 1
+    assert after["guests"] == before["guests"] + 4
+
+
+def test_summary_reports_sessions_and_unread_chats(server, client, graph, phone):
+    before = summary(client)
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    client.post("/webhook", json=webhook_payload(phone, text="what time is sunset?"))
+    after = summary(client)
+    assert after["sessions"]["active"] == before["sessions"]["active"] + 1
+    assert after["sessions"]["by_language"]["english"] >= 1
+    assert after["chat"]["unread_conversations"] == before["chat"]["unread_conversations"] + 1
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+real_sleep = time.sleep
+
+
+class Clock:
+    """Fake time for the test's own thread; background threads keep sleeping for real"""
+
+    def __init__(self):
+        self.now = 1024.0
+        self.slept = []
+        self.thread = threading.current_thread()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if threading.current_thread() is not self.thread:
+            return real_sleep(seconds)
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(server.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def pacer(server, clock, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOUND_MAX_RATE", 8.0)
+    monkeypatch.setattr(server, "OUTBOUND_BURST", 3)
+    pacer = server.OutboundPacer()
+    monkeypatch.setattr(server, "outbound_pacer", pacer)
+    return pacer
+
+
+def statuses(*items):
+    return [dict({"id": message_id, "status": status, "timestamp": str(at)}, **extra)
+            for message_id, status, at, extra in items]
+
+
+def test_burst_goes_out_at_once_then_sends_are_spaced(server, pacer, clock):
+    for _ in range(5):
+        pacer.acquire()
+    assert clock.slept == [0.125, 0.125]
+    assert pacer.status()["paced"] == 2
+
+
+def test_inline_sends_fail_fast_instead_of_sleeping(server, pacer, clock, graph):
+    results = [server.send_whatsapp_message("96891234567", f"message {i}") for i in range(4)]
+
+    assert results == [True, True, True, False]
+    assert clock.slept == []
+    assert len(graph.sent) == 3
+    assert pacer.status()["rejected"] == 1
+
+
+def test_throttling_halves_the_rate_and_clean_windows_raise_it(server, pacer, clock):
+    pacer.observe(failed=1, error_codes=[130429])
+    assert pacer.rate == 4.0
+    # At most one immediate decrease a second
+    pacer.observe(failed=1, error_codes=[130429])
+    assert pacer.rate == 4.0
+
+    clock.now += server.OUTBOUND_PACING_WINDOW
+    pacer.observe(delivered=100)
+    assert pacer.rate == 3.0
+
+    clock.now += server.OUTBOUND_PACING_WINDOW
+    pacer.observe(delivered=100)
+    assert pacer.rate == 3.0 + server.OUTBOUND_RATE_STEP
+
+
+def test_callbacks_are_timed_deduplicated_and_fed_to_the_pacer(server, pacer):
+    tracker = server.DeliveryTracker()
+    tracker.record_sent("wamid.1")
+    sent = tracker.messages[hash("wamid.1")].sent
+
+    applied = tracker.ingest(statuses(
+        ("wamid.1", "delivered", int(sent) + 3, {}),
+        ("wamid.1", "delivered", int(sent) + 3, {}),
+        ("wamid.2", "failed", int(sent), {"errors": [{"code": 131048}]}),
+        ("wamid.3", "typing", int(sent), {})
+    ))
+
+    assert applied == 2
+    status = tracker.status()
+    assert status["counts"]["duplicate"] == 1
+    assert status["counts"]["unknown_message"] == 1
+    assert status["error_codes"] == {"131048": 1}
+    assert status["failure_rate"] == 0.5
+    assert status["delivery_latency"]["count"] == 1
+    assert pacer.rate == 4.0
+
+
+def test_status_webhook_takes_the_fast_path(server, client, monkeypatch):
+    tracker = server.DeliveryTracker()
+    monkeypatch.setattr(server, "delivery_tracker", tracker)
+    payload = {"entry": [{"changes": [{"value": {"statuses": statuses(("wamid.9", "read", 1, {}))}}]}]}
+
+    response = client.post("/webhook", json=payload)
+
+    assert response.get_json() == {"status": "statuses", "applied": 1}
+    assert tracker.status()["counts"]["read"] == 1
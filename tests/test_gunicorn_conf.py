@@ -0,0 +1,63 @@
+import os
+import runpy
+
+import pytest
+
+from conftest import ROOT
+
+
+def load_conf(monkeypatch, **env):
+    monkeypatch.delenv("WORKER_CONCURRENCY", raising=False)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    settings = runpy.run_path(os.path.join(ROOT, "gunicorn.conf.py"))
+    return settings, os.environ["WORKER_CONCURRENCY"]
+
+
+def test_gthread_mode_sizes_worker_concurrency_from_threads(monkeypatch):
+    settings, concurrency = load_conf(monkeypatch, SERVE_MODE="gthread", GUNICORN_THREADS="12", PORT="8123")
+    assert settings["worker_class"] == "gthread"
+    assert settings["threads"] == 12
+    assert settings["bind"] == "0.0.0.0:8123"
+    assert concurrency == "12"
+
+
+def test_sync_mode_serves_one_request_per_worker(monkeypatch):
+    settings, concurrency = load_conf(monkeypatch, SERVE_MODE="sync")
+    assert settings["worker_class"] == "sync"
+    assert concurrency == "1"
+
+
+def test_gevent_mode_falls_back_to_gthread_without_gevent(monkeypatch):
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        settings, _ = load_conf(monkeypatch, SERVE_MODE="gevent")
+        assert settings["worker_class"] == "gthread"
+    else:
+        settings, concurrency = load_conf(monkeypatch, SERVE_MODE="gevent", WORKER_CONNECTIONS="300")
+        assert settings["worker_class"] == "gevent"
+        assert concurrency == "300"
+
+
+def test_default_mode_follows_the_booking_store(monkeypatch):
+    monkeypatch.delenv("OUTBOX_DB_PATH", raising=False)
+    settings, _ = load_conf(monkeypatch, BOOKING_STORE="sqlite")
+    assert settings["worker_class"] == "gthread"
+
+    settings, _ = load_conf(monkeypatch, BOOKING_STORE="sheets")
+    assert settings["SERVE_MODE"] in ("gevent", "gthread")
+    assert settings["worker_class"] == settings["SERVE_MODE"]
+    if settings["SERVE_MODE"] == "gevent":
+        settings, _ = load_conf(monkeypatch, BOOKING_STORE="sheets", OUTBOX_DB_PATH="outbox.db")
+        assert settings["worker_class"] == "gthread"
+
+
+def test_preload_stays_off(monkeypatch):
+    settings, _ = load_conf(monkeypatch)
+    assert settings["preload_app"] is False
+
+
+@pytest.fixture(autouse=True)
+def keep_serve_mode(monkeypatch):
+    monkeypatch.delenv("SERVE_MODE", raising=False)
@@ -0,0 +1,64 @@
+import gzip
+import json
+
+from conftest import make_booking, webhook_payload
+
+
+def test_unchanged_bookings_revalidate_with_304(server, client):
+    make_booking(server)
+    first = client.get("/api/bookings")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    second = client.get("/api/bookings", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+
+def test_new_booking_changes_the_etag(server, client):
+    etag = client.get("/api/bookings").headers["ETag"]
+    make_booking(server)
+    response = client.get("/api/bookings", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_bookings_etag_is_the_same_on_another_worker(server, client, monkeypatch):
+    make_booking(server)
+    bookings_etag = client.get("/api/bookings").headers["ETag"]
+    sessions_etag = client.get("/api/sessions").headers["ETag"]
+
+    # Another worker process has its own epoch for in-memory data
+    monkeypatch.setattr(server, "DATA_VERSION_EPOCH", "otherworker")
+
+    assert client.get("/api/bookings", headers={"If-None-Match": bookings_etag}).status_code == 304
+    assert client.get("/api/sessions", headers={"If-None-Match": sessions_etag}).status_code == 200
+
+
+def test_large_json_is_gzipped(server, client):
+    for _ in range(5):
+        make_booking(server)
+    response = client.get("/api/bookings", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert isinstance(json.loads(gzip.decompress(response.data)), list)
+    assert response.headers["ETag"].endswith('-gz"')
+
+
+def test_webhook_responses_are_never_stored(client):
+    response = client.post("/webhook", json={"entry": [{"changes": [{"value": {}}]}]})
+    assert response.headers["Cache-Control"] == "no-store"
+
+
+def test_revalidated_chat_history_still_marks_the_chat_read(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    client.post("/webhook", json=webhook_payload(phone, text="is there parking?"))
+    etag = client.get(f"/api/chat/history/{phone}").headers["ETag"]
+    # Unread again without a new version, e.g. counted by a request this ETag predates
+    server.chat_unread[phone] = 1
+
+    response = client.get(f"/api/chat/history/{phone}", headers={"If-None-Match": etag})
+
+    assert phone not in server.chat_unread
+    # Clearing the count is a change, so the client gets fresh data rather than a 304
+    assert response.status_code == 200
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import webhook_payload
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+def test_flood_gets_one_notice_then_is_dropped(server, clock):
+    limiter = server.InboundRateLimiter(rate_per_minute=6, burst=2, max_phones=100)
+    decisions = [limiter.check("96890000001") for _ in range(5)]
+    assert decisions == ["allow", "allow", "notify", "drop", "drop"]
+    assert limiter.status()["top_throttled"] == [{"phone": "96890000001", "throttled": 3}]
+
+
+def test_bucket_refills_at_the_configured_rate(server, clock):
+    limiter = server.InboundRateLimiter(rate_per_minute=6, burst=1, max_phones=100)
+    assert limiter.check("96890000001") == "allow"
+    assert limiter.check("96890000001") == "notify"
+
+    clock.now += 10  # one token at six per minute
+    assert limiter.check("96890000001") == "allow"
+    # A fresh flood after recovering earns a fresh notice
+    assert limiter.check("96890000001") == "notify"
+
+
+def test_least_recently_seen_phones_are_evicted(server, clock):
+    limiter = server.InboundRateLimiter(rate_per_minute=6, burst=1, max_phones=2)
+    for phone in ("96890000001", "96890000002", "96890000001", "96890000003"):
+        limiter.check(phone)
+    assert list(limiter.buckets) == ["96890000001", "96890000003"]
+    assert limiter.status()["evicted"] == 1
+
+
+def test_throttled_webhook_is_not_processed(server, client, graph, phone, monkeypatch):
+    monkeypatch.setattr(server, "inbound_limiter", server.InboundRateLimiter(1, 1, 100))
+
+    first = client.post("/webhook", json=webhook_payload(phone, text="hello"))
+    graph.sent.clear()
+    second = client.post("/webhook", json=webhook_payload(phone, text="hello"))
+    third = client.post("/webhook", json=webhook_payload(phone, text="hello"))
+
+    assert first.get_json()["status"] != "throttled"
+    assert second.get_json()["status"] == third.get_json()["status"] == "throttled"
+    assert graph.texts_to(phone) == [server.MESSAGES["english"]["rate_limited"]]
+    assert len(server.chat_messages[phone]) == 1
@@ -0,0 +1,70 @@
+import json
+import logging
+
+
+def make_record(category=None, level=logging.DEBUG, msg="event %s", args=("x",), created=None):
+    record = logging.LogRecord("app", level, __file__, 1, msg, args, None)
+    if category is not None:
+        record.category = category
+    if created is not None:
+        record.created = created
+    return record
+
+
+def test_category_settings_skip_malformed_items(server):
+    settings = server._parse_category_settings("phone=0.5, chat=x,broken,outbound=2", float)
+    assert settings == {"phone": 0.5, "outbound": 2.0}
+
+
+def test_sampler_rate_limits_per_second_and_counts_drops(server):
+    sampler = server.CategorySampler({}, {"chat": 2})
+    kept = [sampler.filter(make_record("chat", created=100.2)) for _ in range(5)]
+    assert kept == [True, True, False, False, False]
+    assert sampler.dropped == {"chat": 3}
+    # A new second opens a new window
+    assert sampler.filter(make_record("chat", created=101.0))
+
+
+def test_sampler_never_drops_warnings_or_uncategorised(server):
+    sampler = server.CategorySampler({"phone": 0.0}, {"phone": 0})
+    assert not sampler.filter(make_record("phone"))
+    assert sampler.filter(make_record("phone", level=logging.WARNING))
+    assert sampler.filter(make_record())
+
+
+def test_info_records_are_only_sampled_when_opted_in(server):
+    assert server.CategorySampler({"webhook": 0.0}, {}).filter(make_record("webhook", level=logging.INFO))
+    opted_in = server.CategorySampler({"webhook": 0.0}, {}, max_level=logging.INFO)
+    assert not opted_in.filter(make_record("webhook", level=logging.INFO))
+
+
+def test_json_formatter_keeps_extra_fields(server):
+    record = make_record("outbound")
+    record.status_code = 429
+    entry = json.loads(server.JsonLogFormatter().format(record))
+    assert entry["msg"] == "event x"
+    assert entry["category"] == "outbound"
+    assert entry["status_code"] == 429
+    assert entry["level"] == "DEBUG"
+
+
+def test_queue_handler_formats_on_the_listener(server):
+    import queue
+
+    formatted = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            formatted.append(self.format(record))
+
+    target = Capture()
+    target.setFormatter(server.JsonLogFormatter())
+    handler = server.LazyQueueHandler(queue.SimpleQueue(), [target])
+    record = make_record("chat", args=({"lazy": True},))
+    handler.emit(record)
+    handler.stop()
+
+    assert len(formatted) == 1
+    assert json.loads(formatted[0])["msg"] == "event {'lazy': True}"
+    # Formatting was left to the listener: the queued record still has its args
+    assert record.args == {"lazy": True}
@@ -0,0 +1,75 @@
+import logging
+
+from conftest import webhook_payload
+
+
+def test_info_and_menu_go_out_as_one_interactive_message(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    graph.sent.clear()
+
+    client.post("/webhook", json=webhook_payload(phone, reply="pricing"))
+
+    assert len(graph.sent) == 1
+    payload = graph.sent[0]["payload"]
+    assert payload["type"] == "interactive"
+    assert "Cruise Pricing" in payload["interactive"]["body"]["text"]
+
+
+def test_compose_falls_back_when_body_is_too_long(server):
+    assert server.compose_interactive_body("info", "prompt") == "info\n\nprompt"
+    assert server.compose_interactive_body("x" * server.WHATSAPP_INTERACTIVE_BODY_LIMIT, "prompt") is None
+
+
+def test_budget_is_report_only_by_default(server, graph, phone, caplog):
+    assert server.OUTBOUND_BUDGET_ENFORCED is False
+    before = dict(server.outbound_stats)
+
+    with caplog.at_level(logging.WARNING, logger="app"):
+        with server.outbound_turn(phone) as turn:
+            results = [server.send_whatsapp_message(phone, f"message {i}") for i in range(3)]
+
+    assert results == [True, True, True]
+    assert len(graph.sent) == 3
+    assert turn["suppressed"] == 0
+    assert server.outbound_stats["over_budget_turns"] == before["over_budget_turns"] + 1
+    warnings = [record.getMessage() for record in caplog.records if "budget" in record.getMessage()]
+    assert len(warnings) == 1
+    assert f"turn {turn['id']}" in warnings[0] and "anyway" in warnings[0]
+
+
+def test_enforced_budget_logs_every_suppressed_send(server, graph, phone, caplog, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOUND_BUDGET_ENFORCED", True)
+
+    with caplog.at_level(logging.WARNING, logger="app"):
+        with server.outbound_turn(phone) as turn:
+            results = [server.send_whatsapp_message(phone, f"message {i}") for i in range(4)]
+
+    assert results == [True, True, False, False]
+    assert len(graph.sent) == 2
+    assert turn["suppressed"] == 2
+    suppressed = [record for record in caplog.records if "suppressed" in record.getMessage()]
+    assert len(suppressed) == 2
+    assert all(record.levelno == logging.WARNING for record in suppressed)
+    assert all(f"turn {turn['id']}" in record.getMessage() for record in suppressed)
+
+
+def test_text_outside_a_typed_step_gets_one_reply(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    graph.sent.clear()
+
+    client.post("/webhook", json=webhook_payload(phone, text="what?"))
+    client.post("/webhook", json=webhook_payload(phone, text="hello"))
+
+    # A hint pointing back at the menu already shown, then the menu again for a greeting
+    assert [entry["payload"]["type"] for entry in graph.sent] == ["text", "interactive"]
+    assert graph.sent[0]["payload"]["text"]["body"] == server.MESSAGES["english"]["choose_option"]
+
+
+def test_overlong_info_is_shortened_into_the_menu(server, graph, phone):
+    with server.outbound_turn(phone) as turn:
+        server.send_main_menu(phone, "english", info_text="x" * 2000)
+
+    assert turn["calls"] == 1
+    body = graph.sent[0]["payload"]["interactive"]["body"]["text"]
+    assert len(body) == server.WHATSAPP_INTERACTIVE_BODY_LIMIT
+    assert body.endswith("…\n\nChoose from options:")
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def outbox(server, tmp_path):
+    outbox = server.Outbox(str(tmp_path / "outbox.db"))
+    # No sender threads: the test claims messages itself
+    outbox.sender_pid = os.getpid()
+    return outbox
+
+
+def payload(text):
+    return {"messaging_product": "whatsapp", "to": "96891234567", "type": "text", "text": {"body": text}}
+
+
+def test_idle_poll_does_not_take_the_write_lock(server, outbox):
+    writer = sqlite3.connect(outbox.path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        assert outbox._claim() is None
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+
+def test_messages_to_one_recipient_are_claimed_in_order(server, outbox):
+    outbox.enqueue("96891234567", payload("first"))
+    outbox.enqueue("96891234567", payload("second"))
+    outbox.enqueue("96897654321", payload("other"))
+
+    first = outbox._claim()
+    # "second" waits for "first"; the other recipient's message is free to go
+    other = outbox._claim()
+    assert outbox._claim() is None
+
+    assert '"first"' in first[1] and '"other"' in other[1]
+    outbox._complete(first[0], 1, True, False, None)
+    assert '"second"' in outbox._claim()[1]
+
+
+def test_sheets_store_runs_without_an_outbox_or_a_database_file(tmp_path):
+    env = dict(os.environ, BOOKING_STORE="sheets", OUTBOX_ENABLED="true", PYTHONPATH=ROOT)
+    env.pop("BOOKING_DB_PATH", None)
+    env.pop("OUTBOX_DB_PATH", None)
+    result = subprocess.run(
+        [sys.executable, "-c", "import app; print(app.OUTBOX_ENABLED, app.outbox)"],
+        cwd=str(tmp_path), env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.stdout.split()[-2:] == ["False", "None"]
+    assert not list(tmp_path.glob("bookings.db*"))
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import pytest
+
+from replay import StubSpreadsheet, StubWorksheet
+
+
+@pytest.fixture
+def book(server, monkeypatch):
+    """A fresh spreadsheet with a legacy worksheet and two month worksheets"""
+    calls = Counter()
+    spreadsheet = StubSpreadsheet(calls, 0, server.required_headers)
+    for title in ("Sindbad Ship Cruises 2030-01", "Sindbad Ship Cruises 2029-12 (archived)", "Notes"):
+        spreadsheet.sheets.append(StubWorksheet(title, calls, 0, server.required_headers))
+    monkeypatch.setattr(server, "spreadsheet", spreadsheet)
+    return spreadsheet
+
+
+@pytest.fixture
+def router(server, book):
+    router = server.PartitionRouter()
+    router.discover(book, book.sheets[0])
+    return router
+
+
+def test_partition_month_accepts_the_sheet_date_formats(server):
+    assert server.partition_month("05/01/2030") == "2030-01"
+    assert server.partition_month("2030-01-05") == "2030-01"
+    assert server.partition_month(" 05-01-2030 ") == "2030-01"
+    assert server.partition_month("next week") is None
+
+
+def test_discover_registers_month_and_archived_worksheets(server, router):
+    partitions = {partition.key: partition for partition in router.all()}
+    assert set(partitions) == {server.LEGACY_PARTITION, "2030-01", "2029-12"}
+    assert partitions["2029-12"].archived is True
+    assert partitions["2030-01"].archived is False
+
+
+def test_reads_go_only_to_partitions_that_can_hold_the_month(server, router):
+    keys = {partition.key for partition in router.for_months({"2030-01"})}
+    # The legacy worksheet's months are unknown until it has been read
+    assert keys == {server.LEGACY_PARTITION, "2030-01"}
+
+    router.partitions[server.LEGACY_PARTITION].months = {"2029-11"}
+    assert {partition.key for partition in router.for_months({"2030-01"})} == {"2030-01"}
+
+
+def test_first_write_for_a_month_creates_its_worksheet_once(server, router, book):
+    first = router.for_write("03/02/2030")
+    second = router.for_write("28/02/2030")
+
+    assert first is second
+    assert first.worksheet.title == "Sindbad Ship Cruises 2030-02"
+    assert book.calls["sheets.add_worksheet"] == 1
+    assert first.worksheet.rows[0] == server.required_headers
+
+
+def test_past_and_archived_months_are_inactive(server, router, monkeypatch):
+    monkeypatch.setattr(router, "_current_month", lambda: "2030-02")
+    router.partitions[server.LEGACY_PARTITION].months = {"2030-01", "2030-03"}
+    active = {partition.key for partition in router.active()}
+    assert active == {server.LEGACY_PARTITION}
+
+    router.partitions[server.LEGACY_PARTITION].months = {"2030-01"}
+    assert router.active() == []
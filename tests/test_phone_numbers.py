@@ -0,0 +1,51 @@
+import csv
+import io
+
+import pytest
+
+from conftest import make_booking
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("96891234567", "96891234567"),
+    ("91234567", "96891234567"),
+    ("+968 9123 4567", "96891234567"),
+    ("00968-9123-4567", "96891234567"),
+    ("78505509", "96878505509"),
+    ("12", None),
+    ("", None),
+])
+def test_clean_phone_number(server, raw, expected):
+    assert server.clean_phone_number(raw) == expected
+
+
+def test_normalization_is_memoized(server):
+    before = server._normalize_phone.cache_info().hits
+    for _ in range(3):
+        server.clean_phone_number("+968 7777 1234")
+    assert server._normalize_phone.cache_info().hits >= before + 2
+
+
+def test_bulk_normalizer_dedups_and_explains_rejections(server):
+    result = server.normalize_phone_numbers(
+        ["91234567", "+968 9123 4567", "96899887766", "", None, "12", "abc"]
+    )
+    assert result["normalized"] == ["96891234567", "96899887766"]
+    assert [item["reason"] for item in result["rejected"]] == ["empty", "empty", "too_short", "no_digits"]
+    assert result["stats"] == {
+        "total": 7, "valid": 3, "unique": 2, "duplicates": 1, "rejected": 4
+    }
+
+
+def test_daily_report_counts_unique_customers(server):
+    make_booking(server, cruise_date="02/02/2031", whatsapp_id="96891112222")
+    make_booking(server, cruise_date="02/02/2031", whatsapp_id="+968 9111 2222")
+    make_booking(server, cruise_date="02/02/2031", whatsapp_id="96893334444")
+
+    with server.app.test_request_context("/api/report/02-02-2031"):
+        response = server.generate_daily_report("02/02/2031")
+    rows = {row[0]: row[1:] for row in csv.reader(io.StringIO(response.get_data(as_text=True))) if row}
+
+    assert rows["Total Bookings"] == ["3"]
+    assert rows["Unique Customers"] == ["2"]
+    assert rows["Invalid WhatsApp IDs"] == ["0"]
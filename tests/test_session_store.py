@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def store(server):
+    return server.SessionStore("sessions-test")
+
+
+def test_indexes_follow_field_changes(server, store):
+    store["96890000001"] = {"step": "awaiting_name", "language": "english", "flow": "booking"}
+    store["96890000002"] = {"step": "awaiting_name", "language": "arabic", "flow": "booking"}
+
+    store["96890000001"]["step"] = "awaiting_phone"
+
+    assert store.counts("step") == {"awaiting_name": 1, "awaiting_phone": 1}
+    assert store.counts("language") == {"english": 1, "arabic": 1}
+    assert store.phones_matching(step="awaiting_name") == ["96890000002"]
+    assert store.phones_matching(step="awaiting_name", language="english") == []
+
+    del store["96890000002"]
+    assert store.counts("step") == {"awaiting_phone": 1}
+    assert store.counts("language") == {"english": 1}
+
+
+def test_session_reads_like_the_dict_it_replaced(server, store):
+    store["96890000001"] = {"step": "awaiting_payment", "name": "Guest", "booking_id": "SDB1",
+                            "cruise_type": "sunset", "adults_count": 2, "children_count": 1}
+    session = store["96890000001"]
+
+    assert "infants_count" not in session
+    assert session.get("infants_count", 0) == 0
+    assert session["booking_data"]["total_guests"] == 3
+    assert session["booking_data"]["whatsapp_id"] == "96890000001"
+    with pytest.raises(KeyError):
+        session["favourite_colour"] = "blue"
+
+
+def test_menu_only_sessions_are_listed_under_their_flow(server, store):
+    store["96890000001"] = {"flow": "info", "language": "english"}
+    assert store.counts("step") == {"info": 1}
+
+
+def test_idle_sessions_expire_with_a_reason(server, store, monkeypatch):
+    reasons = []
+    monkeypatch.setattr(server.SessionStore, "step_listeners", [
+        lambda session, old, new, seconds, reason: reasons.append((old, new, reason))
+    ])
+    store["96890000001"] = {"step": "awaiting_date"}
+    store["96890000002"] = {"step": "awaiting_date"}
+    store["96890000001"]["last_activity"] = time.time() - server.SESSION_IDLE_TIMEOUT - 1
+
+    assert store.expire_idle() == ["96890000001"]
+    assert list(store) == ["96890000002"]
+    assert reasons[-1] == ("awaiting_date", None, "expired")
+    # Sweeps run at most once a minute unless forced
+    store["96890000002"]["last_activity"] = 0
+    assert store.expire_idle() == []
+    assert store.expire_idle(force=True) == ["96890000002"]
@@ -0,0 +1,39 @@
+import time
+
+
+def seed_sessions(server, language, count):
+    """count sessions in language, the last one being the most recently active"""
+    now = time.time()
+    phones = [f"9689300{language[-2:]}{i:02d}" for i in range(count)]
+    for i, phone in enumerate(phones):
+        server.user_sessions[phone] = {"step": "awaiting_date", "language": language}
+        server.user_sessions[phone]["last_activity"] = now - (count - i)
+    return phones
+
+
+def test_pages_are_ordered_newest_first(server, client):
+    phones = seed_sessions(server, "pg01", 7)
+
+    pages = [
+        client.get(f"/api/sessions/list?language=pg01&page_size=3&page={page}").get_json()
+        for page in (1, 2, 3)
+    ]
+
+    listed = [item["phone"] for body in pages for item in body["sessions"]]
+    assert listed == phones[::-1]
+    assert [len(body["sessions"]) for body in pages] == [3, 3, 1]
+    assert pages[0]["total"] == 7 and pages[0]["pages"] == 3
+
+
+def test_page_past_the_end_is_empty(server, client):
+    seed_sessions(server, "pg02", 2)
+    body = client.get("/api/sessions/list?language=pg02&page=5").get_json()
+    assert body["sessions"] == []
+    assert body["total"] == 2
+
+
+def test_most_recent_ranks_only_what_is_asked_for(server):
+    phones = seed_sessions(server, "pg03", 5)
+    store = server.tenants.default.sessions
+    recent = store.most_recent(phones + ["96800000000"], 2)
+    assert [phone for phone, _ in recent] == [phones[4], phones[3]]
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def scheduler(server):
+    return server.SheetsScheduler(6000, 6000, workers=1)
+
+
+def occupy_worker(scheduler, server):
+    """Submit a write that blocks the only worker until the returned event is set"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+        return "blocked"
+
+    thread = threading.Thread(
+        target=scheduler.submit, args=(server.LANE_BOOKING_WRITE, "write", blocking), daemon=True
+    )
+    thread.start()
+    assert started.wait(5)
+    return release, thread
+
+
+def test_merged_reads_share_one_call(server, scheduler):
+    release, blocker = occupy_worker(scheduler, server)
+    calls = []
+
+    def read():
+        calls.append(1)
+        return ["row"]
+
+    results = []
+    readers = [
+        threading.Thread(target=lambda: results.append(
+            scheduler.submit(server.LANE_DASHBOARD_READ, "read", read, merge_key="all")
+        ))
+        for _ in range(3)
+    ]
+    for reader in readers:
+        reader.start()
+    time.sleep(0.1)
+    release.set()
+    for reader in readers + [blocker]:
+        reader.join(5)
+
+    assert results == [["row"]] * 3
+    assert len(calls) == 1
+    assert scheduler.stats["merged"] == 2
+
+
+def test_more_urgent_lane_runs_first(server, scheduler):
+    release, blocker = occupy_worker(scheduler, server)
+    order = []
+    threads = [
+        threading.Thread(target=scheduler.submit, args=(lane, "read", order.append, lane))
+        for lane in (server.LANE_DASHBOARD_READ, server.LANE_CAPACITY_READ)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads + [blocker]:
+        thread.join(5)
+
+    assert order == [server.LANE_CAPACITY_READ, server.LANE_DASHBOARD_READ]
+
+
+def test_timed_out_queued_write_never_runs(server, scheduler, monkeypatch):
+    release, blocker = occupy_worker(scheduler, server)
+    monkeypatch.setattr(server, "SHEETS_REQUEST_TIMEOUT", 0.1)
+    written = []
+
+    with pytest.raises(server.FutureTimeout):
+        scheduler.submit(server.LANE_BOOKING_WRITE, "write", written.append, "row")
+
+    release.set()
+    blocker.join(5)
+    # A later call proves the worker has moved past the cancelled job
+    assert scheduler.submit(server.LANE_BOOKING_WRITE, "write", lambda: "next") == "next"
+    assert written == []
+    assert scheduler.stats["cancelled"] == 1
+    assert scheduler.quota_status()["queued"][server.LANE_NAMES[server.LANE_BOOKING_WRITE]] == 0
+
+
+def test_timed_out_running_write_reports_its_outcome(server, scheduler, monkeypatch):
+    monkeypatch.setattr(server, "SHEETS_REQUEST_TIMEOUT", 0.2)
+
+    def slow_write():
+        time.sleep(0.3)
+        return {"updates": {"updatedRange": "A2:T2"}}
+
+    result = scheduler.submit(server.LANE_BOOKING_WRITE, "write", slow_write)
+    assert result["updates"]["updatedRange"] == "A2:T2"
+    assert scheduler.stats["cancelled"] == 0
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, make_booking
+from replay import StubWorksheet
+
+
+def sheet_row(server, **fields):
+    return [str(fields.get(header, "")) for header in server.required_headers]
+
+
+@pytest.fixture
+def past_month(server, monkeypatch):
+    """A month worksheet from 2020 mirroring one booking, registered with the router"""
+    worksheet = StubWorksheet("Sindbad Ship Cruises 2020-01", server.spreadsheet.calls, 0, server.required_headers)
+    worksheet.append_row(sheet_row(server, **{"Booking ID": "SDBPAST1", "Cruise Date": "05/01/2020", "Total Guests": 2}))
+    server.spreadsheet.sheets.append(worksheet)
+    partitions = dict(server.partition_router.partitions)
+    partitions["2020-01"] = server.BookingPartition("2020-01", worksheet)
+    monkeypatch.setattr(server.partition_router, "partitions", partitions)
+    yield partitions["2020-01"]
+    server.spreadsheet.sheets.remove(worksheet)
+
+
+def test_month_rollover_archives_without_reseeding(server, past_month, monkeypatch):
+    make_booking(server)
+    changes = []
+    monkeypatch.setattr(server.booking_changes, "listeners", server.booking_changes.listeners + [
+        lambda op, key, record, previous: changes.append((op, key))
+    ])
+    reads_before = past_month.worksheet.calls["sheets.get_all_records"]
+    totals_before = server.booking_aggregates.summary(server.datetime.now().date(), server.DEFAULT_TENANT_KEY)[2]
+
+    server.booking_store.export_cycle()
+
+    assert past_month.archived is True
+    assert past_month.worksheet.title.endswith(server.PARTITION_ARCHIVE_SUFFIX)
+    assert past_month.worksheet.calls["sheets.get_all_records"] == reads_before
+    assert "2020-01" not in server.booking_changes.seeded
+    assert changes == []
+    assert server.booking_aggregates.summary(server.datetime.now().date(), server.DEFAULT_TENANT_KEY)[2] == totals_before
+
+
+class LockProbeWorksheet(StubWorksheet):
+    """Checks, while being read, that no write transaction is held on the database"""
+
+    def __init__(self, title, calls, header, path):
+        super().__init__(title, calls, 0, header)
+        self.path = path
+        self.database_was_free = None
+
+    def get_all_values(self):
+        conn = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("ROLLBACK")
+            self.database_was_free = True
+        except sqlite3.OperationalError:
+            self.database_was_free = False
+        finally:
+            conn.close()
+        return super().get_all_values()
+
+
+@pytest.fixture
+def fresh_store(server, tmp_path, monkeypatch):
+    # A second store must not change the process's change-log epoch for good
+    monkeypatch.setattr(server.booking_changes, "epoch", server.booking_changes.epoch)
+    return server.SqliteBookingStore(str(tmp_path / "import.db"))
+
+
+def test_import_reads_sheets_outside_the_write_transaction(server, fresh_store, monkeypatch):
+    worksheets = [
+        LockProbeWorksheet(f"Sindbad Ship Cruises 2030-0{month}", server.spreadsheet.calls,
+                           server.required_headers, fresh_store.path)
+        for month in (1, 2)
+    ]
+    worksheets[0].append_row(sheet_row(server, **{"Booking ID": "SDBIMPORT1", "Cruise Date": "01/01/2030"}))
+    # The same booking copied by hand into the next month's worksheet
+    worksheets[1].append_row(sheet_row(server, **{"Booking ID": "SDBIMPORT1", "Cruise Date": "01/01/2030"}))
+    worksheets[1].append_row(sheet_row(server, **{"Booking ID": "SDBIMPORT2", "Cruise Date": "02/02/2030"}))
+    monkeypatch.setattr(server.partition_router, "partitions", {
+        f"2030-0{month}": server.BookingPartition(f"2030-0{month}", worksheet)
+        for month, worksheet in zip((1, 2), worksheets)
+    })
+
+    assert fresh_store.import_from_sheets() == 2
+
+    assert [worksheet.database_was_free for worksheet in worksheets] == [True, True]
+    rows = fresh_store._connect().execute("SELECT booking_id, sheet_partition FROM bookings ORDER BY id").fetchall()
+    assert rows == [("SDBIMPORT1", "2030-01"), ("SDBIMPORT2", "2030-02")]
+    assert fresh_store.import_from_sheets() == 0
+
+
+def test_sheets_stay_the_default_store(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, LOG_LEVEL="WARNING")
+    for key in ("BOOKING_STORE", "BOOKING_DB_PATH", "OUTBOX_ENABLED", "OUTBOX_DB_PATH"):
+        env.pop(key, None)
+    result = subprocess.run(
+        [sys.executable, "-c", "import app; print(app.booking_store.name, app.OUTBOX_ENABLED)"],
+        cwd=str(tmp_path), env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.stdout.split()[-2:] == ["sheets", "False"]
+    assert "OUTBOX_DB_PATH" not in result.stderr
+    assert not list(tmp_path.glob("bookings.db*"))
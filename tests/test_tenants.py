@@ -0,0 +1,123 @@
+import logging
+import time
+from datetime import datetime
+
+from conftest import make_booking, webhook_payload
+
+BOAT2 = {"X-Tenant": "boat2"}
+
+
+def test_manifests_are_kept_per_vessel(server, client):
+    make_booking(server, cruise_date="05/02/2030", cruise_type="morning", name="Default Guest")
+    make_booking(server, tenant=server.tenants.get("boat2"), cruise_date="05/02/2030",
+                 cruise_type="morning", name="Boat Two Guest")
+
+    default = client.get("/api/manifest/05-02-2030/morning?format=json").get_json()
+    boat2 = client.get("/api/manifest/05-02-2030/morning?format=json", headers=BOAT2).get_json()
+
+    assert [p["name"] for p in default["passengers"]] == ["Default Guest"]
+    assert [p["name"] for p in boat2["passengers"]] == ["Boat Two Guest"]
+    assert boat2["vessel"] == "boat2"
+    assert client.get("/api/manifest/05-02-2030/morning", headers=BOAT2).data.startswith(b"Boat Two")
+
+
+def test_upcoming_manifests_cover_every_tenant(server):
+    vessels = {key[0] for key in server.manifest_builder._upcoming_keys()}
+    assert vessels == {server.DEFAULT_TENANT_KEY, "boat2"}
+
+
+def test_dashboard_summary_counts_only_the_tenants_bookings(server, client):
+    today = datetime.now().strftime("%d/%m/%Y")
+    before = client.get("/api/dashboard/summary").get_json()
+    before_boat2 = client.get("/api/dashboard/summary", headers=BOAT2).get_json()
+
+    make_booking(server, tenant=server.tenants.get("boat2"), cruise_date=today, cruise_type="sunset",
+                 adults_count=5, total_guests=5, total_amount=20.0)
+
+    after = client.get("/api/dashboard/summary").get_json()
+    after_boat2 = client.get("/api/dashboard/summary", headers=BOAT2).get_json()
+    assert after["today"] == before["today"]
+    assert after["totals"] == before["totals"]
+    assert after_boat2["today"]["bookings"] == before_boat2["today"]["bookings"] + 1
+    sunset = after_boat2["today"]["occupancy"]["Sunset Cruise"]
+    assert sunset["booked"] == before_boat2["today"]["occupancy"]["Sunset Cruise"]["booked"] + 5
+
+
+def test_webhook_for_an_unknown_number_is_dropped(server, client, graph, phone, caplog):
+    with caplog.at_level(logging.WARNING, logger=server.logger.name):
+        response = client.post("/webhook", json=webhook_payload(phone, text="hello", phone_number_id="999999"))
+
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "unknown_number"}
+    assert graph.sent == []
+    assert all(phone not in tenant.sessions for tenant in server.tenants.all())
+    assert "unknown phone_number_id 999999" in caplog.text
+
+
+def test_webhook_for_a_known_number_is_served_by_that_tenant(server, client, graph, phone):
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english", phone_number_id="222000"))
+
+    assert phone in server.tenants.get("boat2").sessions
+    assert phone not in server.tenants.default.sessions
+    assert graph.sent and all("/222000/" in entry["url"] for entry in graph.sent)
+
+
+def test_dashboard_expires_idle_sessions_of_every_tenant(server, client, graph, phone):
+    boat2 = server.tenants.get("boat2")
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english", phone_number_id="222000"))
+    boat2.sessions[phone]["last_activity"] = time.time() - server.SESSION_IDLE_TIMEOUT - 1
+
+    assert client.get("/api/active_sessions").status_code == 200
+
+    assert phone not in boat2.sessions
+
+
+def test_daily_report_lists_only_the_tenants_passengers(server):
+    make_booking(server, cruise_date="07/02/2030", name="Default Guest")
+    make_booking(server, tenant=server.tenants.get("boat2"), cruise_date="07/02/2030", name="Boat Two Guest")
+
+    def report(tenant):
+        # The report route takes the date as stored, DD/MM/YYYY, so call the view directly
+        with server.app.test_request_context("/api/report/07-02-2030"), server.tenant_context(tenant):
+            return server.generate_daily_report("07/02/2030").get_data(as_text=True)
+
+    default = report(server.tenants.default)
+    boat2 = report(server.tenants.get("boat2"))
+
+    assert "Default Guest" in default and "Boat Two Guest" not in default
+    assert "Boat Two Guest" in boat2 and "Default Guest" not in boat2
+
+
+def test_booking_listing_and_delta_sync_are_per_tenant(server, client):
+    cursor = client.get("/api/bookings/changes", headers=BOAT2).get_json()["cursor"]
+    make_booking(server, name="Default Only")
+    boat2_booking = make_booking(server, tenant=server.tenants.get("boat2"), name="Boat Two Only")
+
+    changes = client.get(f"/api/bookings/changes?since={cursor}", headers=BOAT2).get_json()["changes"]
+    assert [change["record"]["Booking ID"] for change in changes] == [boat2_booking["booking_id"]]
+
+    listed = client.get("/api/bookings", headers=BOAT2).get_json()
+    assert {record["Vessel"] for record in listed} == {"boat2"}
+    reset = client.get("/api/bookings/changes", headers=BOAT2, query_string={"since": "stale.0"}).get_json()
+    assert reset["reset"] and {record["Vessel"] for record in reset["bookings"]} == {"boat2"}
+    assert "Default Only" not in {record["Customer Name"] for record in listed}
+
+
+def test_booking_moved_to_another_vessel_leaves_the_old_ones_changes(server):
+    log = server.BookingChangeLog(10)
+    record = {"Booking ID": "SDBMOVE1", "Vessel": "boat2"}
+    log.record_append(("p", 2), record)
+    cursor = log.cursor()
+    log.record_upsert(("p", 2), dict(record, Vessel=""))
+
+    assert [change["op"] for change in log.changes_since(cursor, "boat2")[0]] == ["delete"]
+    assert [change["op"] for change in log.changes_since(cursor, server.DEFAULT_TENANT_KEY)[0]] == ["update"]
+
+
+def test_sheets_debug_probe_does_not_write_a_booking(server, client):
+    rows = [len(worksheet.rows) for worksheet in server.spreadsheet.sheets]
+
+    response = client.get("/api/debug/sheets")
+
+    assert response.status_code == 200
+    assert [len(worksheet.rows) for worksheet in server.spreadsheet.sheets] == rows
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, webhook_payload
+
+
+@pytest.fixture
+def traces(server, monkeypatch):
+    """Finished traces, captured instead of sampled and written"""
+    finished = []
+    monkeypatch.setattr(server, "TRACING_ENABLED", True)
+    monkeypatch.setattr(server.trace_sampler, "finish", lambda trace, root: finished.append(trace))
+    return finished
+
+
+def test_sender_is_a_keyed_hash_in_span_attributes(server, client, graph, phone, traces):
+    client.post("/webhook", json=webhook_payload(phone, text="hello"))
+
+    root = traces[-1].spans[0]
+    assert root.attributes["whatsapp.from_hash"] == server.trace_subject(phone)
+    assert phone not in json.dumps(root.to_otlp())
+
+
+def test_failed_spans_do_not_copy_log_arguments(server, phone, traces):
+    with server.start_trace("test"):
+        record = logging.LogRecord("app", logging.ERROR, __file__, 1, "Send to %s failed", (phone,), None)
+        server.TraceContextFilter().filter(record)
+
+    root = traces[-1].spans[0]
+    assert root.status_message == "Send to %s failed"
+    assert traces[-1].failed
+
+
+def test_numbers_in_failure_messages_are_masked(server, traces):
+    with pytest.raises(ValueError):
+        with server.start_trace("test"):
+            raise ValueError("Failed to send to +968 9123 4567 (booking for 3 guests)")
+
+    assert traces[-1].spans[0].status_message == "Failed to send to <digits> (booking for 3 guests)"
+
+
+def test_tracing_is_off_without_a_trace_file(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("TRACE_FILE", None)
+    result = subprocess.run(
+        [sys.executable, "-c", "import app; print(app.TRACING_ENABLED, repr(app.TRACE_FILE))"],
+        cwd=str(tmp_path), env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.stdout.split()[-2:] == ["False", "''"]
@@ -0,0 +1,62 @@
+import glob
+import gzip
+import json
+import os
+
+import pytest
+
+from conftest import webhook_payload
+
+
+@pytest.fixture
+def recorder(server, tmp_path):
+    return server.WebhookRecorder(str(tmp_path), "test-key")
+
+
+def test_pseudonym_keeps_length_and_prefix(server, recorder):
+    pseudonym = recorder.pseudonym("96891234567")
+    assert pseudonym != "96891234567"
+    assert len(pseudonym) == 11 and pseudonym.startswith("968")
+    assert recorder.pseudonym("96891234567") == pseudonym
+    assert server.WebhookRecorder("", "other-key").pseudonym("96891234567") != pseudonym
+    # A local mobile number keeps its leading 9, so it still validates
+    local = recorder.pseudonym("91234567")
+    assert local[0] == "9" and server.clean_phone_number(local) == "968" + local
+
+
+def test_separated_numbers_are_pseudonymized_in_place(server, recorder):
+    body = recorder.pseudonymize({"body": "call me on +968 9123 4567 or 7850-5509"})["body"]
+
+    assert "9123" not in body and "4567" not in body and "7850" not in body
+    assert body.startswith("call me on +968 ") and body[-5] == "-"
+    assert [len(group) for group in body.split()[3:6]] == [4, 4, 4]
+
+
+def test_dates_and_counts_are_kept(server, recorder):
+    body = "15-01-2030 for 2 adults, 1 child"
+    assert recorder.pseudonymize({"body": body})["body"] == body
+
+
+def test_name_and_phone_answers_are_redacted(server, client, graph, phone, tmp_path, monkeypatch):
+    recorder = server.WebhookRecorder(str(tmp_path), "test-key")
+    monkeypatch.setattr(server, "webhook_recorder", recorder)
+    client.post("/webhook", json=webhook_payload(phone, reply="lang_english"))
+    client.post("/webhook", json=webhook_payload(phone, reply="book_cruise"))
+    client.post("/webhook", json=webhook_payload(phone, text="Fatima Al Harthy"))
+    client.post("/webhook", json=webhook_payload(phone, text="my number is 9123 4567"))
+    client.post("/webhook", json=webhook_payload(phone, text="I am at 9123 4567 Street until 5"))
+    recorder.stop()
+
+    with gzip.open(glob.glob(os.path.join(str(tmp_path), "webhooks-*.jsonl.gz"))[0], "rt") as recording:
+        messages = [
+            json.loads(line)["payload"]["entry"][0]["changes"][0]["value"]["messages"][0]
+            for line in recording
+        ]
+    bodies = [message["text"]["body"] for message in messages if message["type"] == "text"]
+
+    assert bodies[0] == "Guest"
+    assert bodies[1] == recorder.pseudonymize({"body": "9123 4567"})["body"]
+    # Past the phone question only the numbers are pseudonymized
+    assert bodies[2].startswith("I am at ") and bodies[2].endswith(" Street until 5")
+    assert all(message["from"] != phone and message["from"][:3] == "968" for message in messages)
+    assert "Fatima" not in json.dumps(messages)